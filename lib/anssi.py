@@ -0,0 +1,198 @@
+import argparse
+import csv
+import datetime
+import io
+import itertools
+import os
+import re
+import lib.archives as archives
+import lib.logs as logging
+
+# vuln1_trusts_forest_sidhistory, vuln3_dc_inconsistent_uac...
+VULNERABILITY_ID_PATTERN = re.compile(r"^vuln\d_\w+$", re.IGNORECASE)
+
+# Keywords of the headers of the columns, in English or in French
+STATUS_HEADERS = ("status", "statut", "result", "résultat", "state", "état")
+DATE_HEADERS = ("date", "time", "timestamp", "generation", "génération")
+DOMAIN_HEADERS = ("domain", "domaine", "fqdn", "forest", "forêt")
+
+# Statuses of the checks that passed, the other statuses mean that the vulnerability has been found, and an empty status that it has not been tested
+PASSED_STATUSES = {"ok", "pass", "passed", "success", "compliant", "conforme", "not found", "non détecté", "false", "no", "non", "0"}
+
+# Statuses of the checks that failed, used to find the status column of the exports without a header
+FAILED_STATUSES = {"ko", "fail", "failed", "non compliant", "non conforme", "found", "détecté", "true", "yes", "oui", "1"}
+
+# Delimiters of the exports (TSV, CSV with commas or semicolons)
+DELIMITERS = "\t;,"
+
+# Formats of the dates not written in ISO 8601
+DATE_FORMATS = ["%d/%m/%Y %H:%M:%S", "%d/%m/%Y %H:%M", "%d/%m/%Y", "%Y%m%d%H%M%S"]
+
+@logging.log_call
+def extract_anssi_csv_report(file_path:str) -> dict:
+
+    report = {
+        "tool": "anssi",
+        "format": "csv",
+        "path": file_path,
+        "datetime": None,
+        "domain": None,
+        "risk_ids": [],
+        "untested_ids": []
+    }
+
+    # Only the IDs of the vulnerabilities found or not tested are kept, the rows are streamed one by one
+    risk_ids = set()
+    tested_ids = set()
+    untested_ids = set()
+    latest_datetime = None
+
+    with archives.open_input(file_path) as binary_file:
+        file = io.TextIOWrapper(binary_file, encoding="utf-8-sig", errors="replace", newline="")
+
+        # The header gives the delimiter and the position of the columns
+        header_line = file.readline()
+        delimiter = get_delimiter(header_line)
+        first_row = next(csv.reader([header_line], delimiter=delimiter), [])
+        rows = csv.reader(file, delimiter=delimiter)
+
+        # The exports without a header start directly with the results
+        if any(VULNERABILITY_ID_PATTERN.match(cell.strip()) for cell in first_row):
+            header = []
+            rows = itertools.chain([first_row], rows)
+        else:
+            header = [cell.strip().casefold() for cell in first_row]
+
+        columns = {
+            "id": None,
+            "status": find_column(header, STATUS_HEADERS),
+            "date": find_column(header, DATE_HEADERS),
+            "domain": find_column(header, DOMAIN_HEADERS)
+        }
+
+        for row in rows:
+
+            # The ID column is the first one holding a vulnerability ID, whatever its header
+            if columns["id"] is None:
+                columns["id"] = next((index for index, cell in enumerate(row) if VULNERABILITY_ID_PATTERN.match(cell.strip())), None)
+                if columns["id"] is None:
+                    continue
+
+            risk_id = get_cell(row, columns["id"])
+            if not VULNERABILITY_ID_PATTERN.match(risk_id):
+                continue
+
+            # Without a header, the status column is the first one holding a known status
+            if columns["status"] is None and not header:
+                columns["status"] = next((index for index, cell in enumerate(row) if index != columns["id"] and cell.strip().casefold() in PASSED_STATUSES | FAILED_STATUSES), None)
+
+            row_datetime = parse_datetime(get_cell(row, columns["date"]))
+            if row_datetime is not None and (latest_datetime is None or row_datetime > latest_datetime):
+                latest_datetime = row_datetime
+
+            if report["domain"] is None and "." in get_cell(row, columns["domain"]):
+                report["domain"] = get_cell(row, columns["domain"]).lower()
+
+            status = get_cell(row, columns["status"]).casefold()
+            if not status:
+                untested_ids.add(risk_id.lower())
+                continue
+            tested_ids.add(risk_id.lower())
+            if status not in PASSED_STATUSES:
+                risk_ids.add(risk_id.lower())
+
+    # Without a status, the vulnerabilities found cannot be told from the others, so the export is skipped
+    if columns["status"] is None:
+        logging.log(f'No status column found in the ANSSI export at "{file_path}". The file is skipped.', "error")
+        return report
+
+    # Without a date in the export, the modification time of the file is the time of the audit
+    if latest_datetime is None:
+        latest_datetime = datetime.datetime.fromtimestamp(archives.stat(file_path).st_mtime, datetime.timezone.utc)
+        logging.log(f'No date found in the ANSSI export at "{file_path}", its modification time is used instead.', "warning")
+
+    report["datetime"] = latest_datetime.isoformat()
+    report["risk_ids"] = sorted(risk_ids)
+    report["untested_ids"] = sorted(untested_ids - tested_ids)
+    return report
+
+def get_delimiter(header_line:str) -> str:
+
+    # The delimiter used the most in the header
+    counts = {delimiter: header_line.count(delimiter) for delimiter in DELIMITERS}
+    return max(counts, key=counts.get)
+
+def find_column(header:list, keywords:tuple) -> int:
+
+    for keyword in keywords:
+        for index, label in enumerate(header):
+            if keyword in label:
+                return index
+
+    return None
+
+def get_cell(row:list, index:int) -> str:
+
+    if index is None or index >= len(row):
+        return ""
+
+    return row[index].strip()
+
+def parse_datetime(value:str) -> datetime.datetime:
+
+    if not value:
+        return None
+
+    try:
+        parsed_datetime = datetime.datetime.fromisoformat(value.replace("Z", "+00:00"))
+    except ValueError:
+        parsed_datetime = None
+        for date_format in DATE_FORMATS:
+            try:
+                parsed_datetime = datetime.datetime.strptime(value, date_format)
+                break
+            except ValueError:
+                continue
+
+    if parsed_datetime is None:
+        return None
+
+    # The dates without a timezone are in the local time of the audit
+    return parsed_datetime.astimezone() if parsed_datetime.tzinfo is None else parsed_datetime
+
+@logging.log_call
+def request_anssi_file_path() -> str:
+    file_path = None
+    while not file_path:
+        try:
+            file_path = input("Path to the ANSSI CSV export (Ctrl+C to quit) : ")
+        except KeyboardInterrupt as e:
+            raise KeyboardInterrupt
+        if not os.path.isfile(file_path):
+            print(f'Error : File not found at "{file_path}".')
+            file_path = None
+    return file_path
+
+@logging.log_call
+def main():
+
+    # ARGUMENTS
+    parser = argparse.ArgumentParser(description='Parse an ANSSI ORADAD/ADS CSV export and extract the list of the vulnerabilities ID')
+    parser.add_argument('-f', '--file', type=str, help='Path to an ANSSI CSV or TSV export.')
+    args = parser.parse_args()
+
+    if hasattr(args, 'file') and args.file is not None:
+        file_path = args.file
+    else:
+        try:
+            file_path = request_anssi_file_path()
+        except KeyboardInterrupt:
+            return
+
+    # IDS
+    report = extract_anssi_csv_report(file_path)
+    print(f'Vulnerability ids from the ANSSI export at "{file_path}" ({report["datetime"]}):\n{", ".join(report["risk_ids"])}')
+    return report["risk_ids"]
+
+if __name__ == '__main__':
+    main()
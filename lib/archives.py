@@ -0,0 +1,152 @@
+import contextlib
+import gzip
+import io
+import os
+import shutil
+import tarfile
+import tempfile
+import zipfile
+import lib.logs as logging
+
+# Separator between the path of an archive and the name of one of its members
+# Example: "./input/2023-05.zip::reports/ad_hc_contoso.local.xml"
+MEMBER_SEPARATOR = "::"
+
+# Extensions of the archives whose members are read as input files
+ZIP_EXTENSIONS = (".zip",)
+TAR_EXTENSIONS = (".tar", ".tar.gz", ".tgz")
+COMPRESSED_TAR_EXTENSIONS = (".tar.gz", ".tgz")
+
+# Extension of the single compressed files
+# Example: "./input/ad_hc_contoso.local.xml.gz"
+GZIP_EXTENSION = ".gz"
+
+# Members of the archives already listed, with their uncompressed size {("./input/2023-05.zip", 1024, 1700000000000000000): {"reports/ad_hc_contoso.local.xml": 4096, ...}, ...}
+MEMBERS = {}
+
+# Archives opened once per process for all the reads of their members {(1234, "./input/2023-05.tar.gz", 1024, 1700000000000000000): TarFile, ...}
+OPEN_ARCHIVES = {}
+
+# Size of the decompressed TAR archives kept in memory, the larger ones being written in a temporary file (64 MB)
+SPOOL_MAX_SIZE = 64 * 1024 * 1024
+
+def is_archive(path:str) -> bool:
+	return path.lower().endswith(ZIP_EXTENSIONS + TAR_EXTENSIONS)
+
+def split_path(path:str) -> tuple:
+	if MEMBER_SEPARATOR in path:
+		archive_path, member_name = path.split(MEMBER_SEPARATOR, 1)
+		return archive_path, member_name
+	return path, None
+
+def get_file_name(path:str) -> str:
+	# "./input/2023-05.zip::reports/ad_hc_contoso.local.xml" -> "ad_hc_contoso.local.xml"
+	archive_path, member_name = split_path(path)
+	return os.path.basename(member_name if member_name is not None else archive_path)
+
+def get_uncompressed_name(path:str) -> str:
+	# "./input/ad_hc_contoso.local.xml.gz" -> "./input/ad_hc_contoso.local.xml"
+	if path.lower().endswith(GZIP_EXTENSION) and not path.lower().endswith(TAR_EXTENSIONS):
+		return path[:-len(GZIP_EXTENSION)]
+	return path
+
+def stat(path:str) -> os.stat_result:
+	# The members of an archive change with the archive itself
+	return os.stat(split_path(path)[0])
+
+def get_size(path:str) -> int:
+	# Size of the file, or uncompressed size of the member of an archive
+	archive_path, member_name = split_path(path)
+	if member_name is None:
+		return os.stat(archive_path).st_size
+	return list_members(archive_path).get(member_name)
+
+def exists(path:str) -> bool:
+	return os.path.isfile(split_path(path)[0])
+
+def get_archive(archive_path:str):
+	# The processes extracting the files in parallel open their own archives, instead of sharing the position in the file of the parent process
+	archive_stat = os.stat(archive_path)
+	key = (os.getpid(), archive_path, archive_stat.st_size, archive_stat.st_mtime_ns)
+	if key not in OPEN_ARCHIVES:
+		if archive_path.lower().endswith(ZIP_EXTENSIONS):
+			OPEN_ARCHIVES[key] = zipfile.ZipFile(archive_path)
+		elif archive_path.lower().endswith(COMPRESSED_TAR_EXTENSIONS):
+			# A compressed TAR archive is decompressed once, so that its members can be read in any order without decompressing it again from the start
+			spool = tempfile.SpooledTemporaryFile(max_size=SPOOL_MAX_SIZE)
+			try:
+				with gzip.open(archive_path, "rb") as file:
+					shutil.copyfileobj(file, spool)
+				spool.seek(0)
+				OPEN_ARCHIVES[key] = tarfile.open(fileobj=spool)
+			except Exception:
+				spool.close()
+				raise
+		else:
+			OPEN_ARCHIVES[key] = tarfile.open(archive_path)
+	return OPEN_ARCHIVES[key]
+
+def close_archives() -> None:
+	# Close the archives opened by this process, once all the input files have been read
+	for key in [key for key in OPEN_ARCHIVES if key[0] == os.getpid()]:
+		archive = OPEN_ARCHIVES.pop(key)
+		archive.close()
+		# A TAR archive opened from a decompressed copy does not close the copy itself
+		if isinstance(archive, tarfile.TarFile):
+			archive.fileobj.close()
+
+@logging.log_call
+def list_members(archive_path:str) -> dict:
+	archive_stat = os.stat(archive_path)
+	key = (archive_path, archive_stat.st_size, archive_stat.st_mtime_ns)
+	if key not in MEMBERS:
+		try:
+			archive = get_archive(archive_path)
+			if isinstance(archive, zipfile.ZipFile):
+				MEMBERS[key] = {member.filename: member.file_size for member in archive.infolist() if not member.is_dir()}
+			else:
+				# The members are listed once, and kept by the archive to find them when they are read
+				MEMBERS[key] = {member.name: member.size for member in archive.getmembers() if member.isfile()}
+		except (OSError, EOFError, zipfile.BadZipFile, tarfile.TarError) as e:
+			logging.log(f'Unable to list the files of the archive at "{archive_path}" : {e}', "error")
+			return {}
+	return MEMBERS[key]
+
+@logging.log_call
+def expand_input_files(file_paths:list) -> list:
+	input_files = []
+	for file_path in file_paths:
+		if not is_archive(file_path):
+			input_files.append(file_path)
+			continue
+		members = list_members(file_path)
+		logging.log(f'{len(members)} files found in the archive at "{file_path}".', "debug")
+		input_files.extend([f"{file_path}{MEMBER_SEPARATOR}{member_name}" for member_name in members])
+	return input_files
+
+@contextlib.contextmanager
+def open_input(path:str, seekable:bool=False):
+	archive_path, member_name = split_path(path)
+
+	# Regular file, or single compressed file
+	if member_name is None:
+		if archive_path.lower().endswith(GZIP_EXTENSION):
+			with gzip.open(archive_path, "rb") as file:
+				# Seeking backward in a compressed stream means decompressing it again from the start
+				yield io.BytesIO(file.read()) if seekable else file
+		else:
+			with open(archive_path, "rb") as file:
+				yield file
+
+	# Member of a ZIP archive, opened once for all its members
+	elif archive_path.lower().endswith(ZIP_EXTENSIONS):
+		with get_archive(archive_path).open(member_name) as file:
+			yield io.BytesIO(file.read()) if seekable else file
+
+	# Member of a TAR archive, opened and listed once for all its members
+	else:
+		file = get_archive(archive_path).extractfile(member_name)
+		if file is None:
+			raise FileNotFoundError(f'No file "{member_name}" in the archive at "{archive_path}"')
+		with file:
+			yield io.BytesIO(file.read()) if seekable else file
@@ -0,0 +1,197 @@
+import hashlib
+import json
+import os
+import lib.archives as archives
+import lib.logs as logging
+
+# Version of the cached entries, to increase each time the content extracted from the reports changes
+CACHE_VERSION = 8
+
+# Size of the blocks read when hashing a file (1 MB)
+HASH_BLOCK_SIZE = 1024 * 1024
+
+# Hashes of the archives already read {("./input/2023-05.zip", 1024, 1700000000000000000): "9f86d0...", ...}
+ARCHIVE_HASHES = {}
+
+def hash_file(file_path:str) -> str:
+	archive_path, member_name = archives.split_path(file_path)
+	# The members of an archive are identified by the hash of the archive and their name, so the archive is read once for all its members
+	if member_name is not None:
+		archive_stat = os.stat(archive_path)
+		key = (archive_path, archive_stat.st_size, archive_stat.st_mtime_ns)
+		if key not in ARCHIVE_HASHES:
+			ARCHIVE_HASHES[key] = hash_file(archive_path)
+		return hashlib.sha256(f"{ARCHIVE_HASHES[key]}{archives.MEMBER_SEPARATOR}{member_name}".encode("utf-8")).hexdigest()
+	file_hash = hashlib.sha256()
+	with open(file_path, "rb") as file:
+		for block in iter(lambda: file.read(HASH_BLOCK_SIZE), b""):
+			file_hash.update(block)
+	return file_hash.hexdigest()
+
+class Cache():
+
+	################################################################# SURCHARGE
+
+	def __init__(self, path:str=None) -> None:
+		self._entries = {}		# {"./input/ad_hc_contoso.local.xml": {"size": 1024, "mtime": 1700000000000000000, "hash": "9f86d0...", "version": 1, "report": {...}}, ...}
+		self._hashes = {}		# {"9f86d0...": "./input/ad_hc_contoso.local.xml", ...}
+		self._missed = {}		# {"./input/ad_hc_new.xml": "5e8848...", ...} Hashes computed for the files not found, reused when they are added
+		self._path = None		# ./cache/input_reports.json
+		self._modified = False	# True when the entries have changed since the last save
+
+		if path:
+			self.load(path)
+
+	def __str__(self) -> str:
+		substrings = []
+		for attribute, value in vars(self).items():
+			substrings.append(f"{attribute}: {str(value)}")
+		return "\n".join(substrings)
+
+	################################################################### GETTERS
+
+	@property
+	def entries(self) -> dict:
+		return self._entries
+
+	@property
+	def hashes(self) -> dict:
+		return self._hashes
+
+	@property
+	def modified(self) -> bool:
+		return self._modified
+
+	@property
+	def path(self) -> str:
+		return self._path
+
+	################################################################### SETTERS
+
+	@entries.setter
+	def entries(self, entries:dict) -> None:
+		self._entries = entries
+		self.index_hashes()
+
+	@modified.setter
+	def modified(self, modified:bool) -> None:
+		self._modified = modified
+
+	@path.setter
+	def path(self, path:str) -> None:
+		self._path = path
+
+	################################################################### METHODS
+
+	def load(self, path:str) -> bool:
+		self.path = path
+		if not os.path.isfile(path):
+			logging.log(f'No cache of the input reports found at "{path}". A new one will be created.', "info")
+			self.entries = {}
+			return True
+		try:
+			with open(path, "r", encoding="utf-8") as file:
+				self.entries = json.load(file)
+		except (OSError, ValueError) as e:
+			logging.log(f'Unable to load the cache of the input reports at "{path}" : {e}. A new one will be created.', "warning")
+			self.entries = {}
+			self.modified = True
+			return False
+		logging.log(f'Cache of the input reports loaded from "{path}" ({len(self.entries)} entries).', "info")
+		return True
+
+	def save(self, path:str=None) -> bool:
+		path = path if path else self.path
+		if not self.modified:
+			logging.log(f'No changes to save in the cache of the input reports.', "debug")
+			return True
+		try:
+			os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+			# Write in a temporary file first, so that an interrupted run never leaves a truncated cache
+			with open(f"{path}.tmp", "w", encoding="utf-8") as file:
+				json.dump(self.entries, file)
+			os.replace(f"{path}.tmp", path)
+		except OSError as e:
+			logging.log(f'Unable to save the cache of the input reports at "{path}" : {e}', "error")
+			return False
+		self.modified = False
+		logging.log(f'Cache of the input reports saved at "{path}" ({len(self.entries)} entries).', "info")
+		return True
+
+	def get(self, file_path:str) -> dict:
+		stat = archives.stat(file_path)
+		entry = self.entries.get(file_path)
+		# Same path, same size and same modification time: the content has not changed
+		if entry and entry["version"] == CACHE_VERSION and entry["size"] == stat.st_size and entry["mtime"] == stat.st_mtime_ns:
+			logging.log(f'Report at "{file_path}" found in the cache.', "debug")
+			return entry["report"]
+		# Else, look for the same content under this path or another one (touched, renamed or copied file)
+		file_hash = hash_file(file_path)
+		known_path = self.hashes.get(file_hash)
+		if known_path is None or self.entries[known_path]["version"] != CACHE_VERSION:
+			self._missed[file_path] = file_hash
+			return None
+		self.add(file_path, dict(self.entries[known_path]["report"]), file_hash)
+		logging.log(f'Report at "{file_path}" found in the cache with the content of "{known_path}".', "debug")
+		return self.entries[file_path]["report"]
+
+	def get_hash(self, file_path:str) -> str:
+		# Hash of the content of a file that has not changed since it was cached
+		# The hash of a compressed file or of the member of an archive is not the hash of its content, so it is not returned
+		if archives.split_path(file_path)[1] is not None or file_path.lower().endswith(archives.GZIP_EXTENSION):
+			return None
+		stat = archives.stat(file_path)
+		entry = self.entries.get(file_path)
+		if entry and entry["size"] == stat.st_size and entry["mtime"] == stat.st_mtime_ns:
+			return entry["hash"]
+		return None
+
+	def get_format(self, file_path:str) -> tuple:
+		# Tool and format of a file that has not changed since it was cached, so that it does not have to be sniffed again
+		stat = archives.stat(file_path)
+		entry = self.entries.get(file_path)
+		if entry and entry["version"] == CACHE_VERSION and entry["size"] == stat.st_size and entry["mtime"] == stat.st_mtime_ns:
+			return entry["report"]["tool"], entry["report"]["format"]
+		return None
+
+	def set(self, file_path:str, report:dict) -> None:
+		file_hash = self._missed.pop(file_path, None)
+		self.add(file_path, report, file_hash if file_hash else hash_file(file_path))
+
+	def add(self, file_path:str, report:dict, file_hash:str) -> None:
+		stat = archives.stat(file_path)
+		self.entries[file_path] = {
+			"size": stat.st_size,
+			"mtime": stat.st_mtime_ns,
+			"hash": file_hash,
+			"version": CACHE_VERSION,
+			"report": report
+		}
+		self.hashes[file_hash] = file_path
+		self.modified = True
+
+	def index_hashes(self) -> None:
+		self._hashes = {entry["hash"]: file_path for file_path, entry in self.entries.items()}
+
+	def evict_stale(self) -> int:
+		stale_paths = [file_path for file_path, entry in self.entries.items() if entry["version"] != CACHE_VERSION or not archives.exists(file_path)]
+		for file_path in stale_paths:
+			del self.entries[file_path]
+		if stale_paths:
+			self.index_hashes()
+			self.modified = True
+			logging.log(f'{len(stale_paths)} stale entries evicted from the cache of the input reports.', "info")
+		return len(stale_paths)
+
+	def clear(self) -> None:
+		self.entries = {}
+		self.modified = True
+		logging.log(f'Cache of the input reports cleared.', "info")
+
+	def print_entries(self) -> None:
+		print(f'Cache of the input reports at "{self.path}": {len(self.entries)} entries')
+		for file_path, entry in sorted(self.entries.items()):
+			report = entry["report"]
+			print(f'-> {file_path}')
+			print(f'   tool: {report.get("tool")}, datetime: {report.get("datetime")}, domain: {report.get("domain")}, risks: {len(report.get("risk_ids", []))}')
+			print(f'   size: {entry["size"]}, sha256: {entry["hash"]}, version: {entry["version"]}')
@@ -0,0 +1,69 @@
+import datetime
+import json
+import os
+import lib.logs as logging
+import lib.mapping as mapping
+
+# Version of the format of the coverage file, to increase each time its structure changes
+COVERAGE_VERSION = 1
+
+def count_reported_ids(framework_id:str, snapshots:list) -> dict:
+	# {"a-krbtgt": {"id": "A-Krbtgt", "snapshots": 3, "first_seen": "2023-05-23T16:40:56+02:00", "last_seen": "...", "domains": {"contoso.local"}}, ...}
+	# The IDs are counted by their normalized form, as they are matched with the mapping
+	reported_ids = {}
+	for report in snapshots:
+		report_datetime = report["datetime"]
+		# An ID listed twice in a report is counted once for the snapshot
+		for normalized_id, reported_id in {mapping.normalize_id(framework_id, reported_id): reported_id for reported_id in report["risk_ids"]}.items():
+			statistics = reported_ids.get(normalized_id)
+			if statistics is None:
+				statistics = reported_ids[normalized_id] = {"id": reported_id, "snapshots": 0, "first_seen": report_datetime, "last_seen": report_datetime, "domains": set()}
+			statistics["snapshots"] += 1
+			statistics["last_seen"] = report_datetime
+			statistics["domains"].add(str(report["domain"]).lower())
+	return reported_ids
+
+def get_tool_coverage(framework_id:str, framework_index:dict, snapshots:list) -> dict:
+	# Coverage of the IDs of a tool by the mapping, the snapshots being in chronological order
+	mapped_ids = framework_index["ids"]
+	reported_ids = count_reported_ids(framework_id, snapshots)
+
+	unmapped_ids = [
+		{"id": statistics["id"], "snapshots": statistics["snapshots"], "first_seen": statistics["first_seen"], "last_seen": statistics["last_seen"], "domains": sorted(statistics["domains"])}
+		for normalized_id, statistics in reported_ids.items() if normalized_id not in mapped_ids
+	]
+	# The most frequent gaps first
+	unmapped_ids.sort(key=lambda unmapped_id: (-unmapped_id["snapshots"], unmapped_id["id"]))
+
+	# The aliases are not listed, only the IDs written in the risks, reported under their name or one of their aliases
+	reported_names = {framework_index["aliases"].get(normalized_id, normalized_id) for normalized_id in reported_ids}
+	return {
+		"snapshots": len(snapshots),
+		"reported_ids": len(reported_ids),
+		"mapped_reported_ids": sum(1 for normalized_id in reported_ids if normalized_id in mapped_ids),
+		"unmapped_ids": unmapped_ids,
+		"never_reported_ids": sorted(name for normalized_id, name in framework_index["names"].items() if normalized_id not in reported_names)
+	}
+
+@logging.log_call
+def compute_coverage(index:dict, reported_ids:dict) -> dict:
+	# {"version": 1, "generated": "...", "tools": {"pingcastle": {"snapshots": 12, "unmapped_ids": [...], ...}, ...}}
+	# reported_ids: {"pingcastle": [{"domain": "contoso.local", "datetime": "...", "risk_ids": [...]}, ...], ...} Snapshots of the history of the audits
+	empty_index = {"ids": {}, "names": {}, "aliases": {}, "risks": []}
+	return {
+		"version": COVERAGE_VERSION,
+		"generated": datetime.datetime.now(datetime.timezone.utc).isoformat(),
+		"tools": {tool: get_tool_coverage(tool, index.get(tool, empty_index), snapshots) for tool, snapshots in reported_ids.items()}
+	}
+
+@logging.log_call
+def save_coverage(coverage:dict, path:str) -> bool:
+	try:
+		os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+		with open(f"{path}.tmp", "w", encoding="utf-8") as file:
+			json.dump(coverage, file, indent=4, ensure_ascii=False)
+		os.replace(f"{path}.tmp", path)
+	except OSError as e:
+		logging.log(f'Unable to save the coverage of the mapping at "{path}" : {e}', "error")
+		return False
+	return True
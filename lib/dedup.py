@@ -0,0 +1,67 @@
+import datetime
+import hashlib
+import re
+import lib.archives as archives
+import lib.logs as logging
+
+# Number of bytes read at the start of a file to compare it with the files of the same size (64 KB)
+PREFIX_SIZE = 64 * 1024
+
+# Size of the blocks read when hashing the whole content of a file (1 MB)
+HASH_BLOCK_SIZE = 1024 * 1024
+
+# <GenerationDate>2023-05-23T14:40:56.0000000+02:00</GenerationDate> and <DomainFQDN>contoso.local</DomainFQDN>, written at the top of the PingCastle XML reports
+GENERATION_DATE_PATTERN = re.compile(rb"<GenerationDate>\s*([^<]+?)\s*</GenerationDate>")
+DOMAIN_FQDN_PATTERN = re.compile(rb"<DomainFQDN>\s*([^<]+?)\s*</DomainFQDN>")
+
+def read_prefix(path:str) -> bytes:
+	with archives.open_input(path) as file:
+		return file.read(PREFIX_SIZE)
+
+def hash_content(path:str) -> str:
+	content_hash = hashlib.sha256()
+	with archives.open_input(path) as file:
+		for block in iter(lambda: file.read(HASH_BLOCK_SIZE), b""):
+			content_hash.update(block)
+	return content_hash.hexdigest()
+
+def group_by(paths:list, get_key) -> list:
+	groups = {}
+	for path in paths:
+		groups.setdefault(get_key(path), []).append(path)
+	return [group for group in groups.values() if len(group) > 1]
+
+@logging.log_call
+def find_duplicates(paths:list, get_known_hash=None) -> dict:
+	# {"./input/copy/ad_hc_contoso.local.xml": "./input/ad_hc_contoso.local.xml", ...}
+	duplicates = {}
+
+	# Hash of the content, without reading the files whose hash is already known (cache)
+	def get_content_hash(path:str) -> str:
+		known_hash = get_known_hash(path) if get_known_hash else None
+		return known_hash if known_hash else hash_content(path)
+
+	# Only the files of the same size can be identical, then only the ones starting the same way
+	for same_size_paths in group_by(sorted(paths), archives.get_size):
+		for same_prefix_paths in group_by(same_size_paths, lambda path: hashlib.sha256(read_prefix(path)).hexdigest()):
+			# Read the whole content only for the files that are still candidates
+			for same_content_paths in group_by(same_prefix_paths, get_content_hash):
+				original_path = same_content_paths[0]
+				for duplicate_path in same_content_paths[1:]:
+					duplicates[duplicate_path] = original_path
+
+	return duplicates
+
+@logging.log_call
+def sniff_pingcastle_xml_snapshot(path:str) -> tuple:
+	# Domain and generation time (UTC, to the second) read in the first bytes of a PingCastle XML report, without parsing it
+	prefix = read_prefix(path)
+	generation_date = GENERATION_DATE_PATTERN.search(prefix)
+	domain_fqdn = DOMAIN_FQDN_PATTERN.search(prefix)
+	if generation_date is None or domain_fqdn is None:
+		return None
+	try:
+		generation_time = datetime.datetime.fromisoformat(generation_date.group(1).decode("utf-8")).astimezone(datetime.timezone.utc).replace(microsecond=0)
+	except ValueError:
+		return None
+	return (domain_fqdn.group(1).decode("utf-8").lower(), generation_time)
@@ -1,3 +1,4 @@
+import io
 import os
 import docx
 import docxcompose.composer
@@ -11,6 +12,25 @@ import win32com.client
 
 ABSOLUTE_FILE_PATH = os.path.abspath(__file__)
 
+# Content of the DOCX files loaded once and shared by all the documents {"C:\...\header.docx": b"PK...", ...}
+FILES_CONTENT = {}
+
+@logging.log_call
+def preload_files(paths:list) -> None:
+	for path in paths:
+		absolute_path = os.path.abspath(path)
+		if absolute_path in FILES_CONTENT or not os.path.isfile(absolute_path):
+			continue
+		with open(absolute_path, "rb") as file:
+			FILES_CONTENT[absolute_path] = file.read()
+	logging.log(f'{len(FILES_CONTENT)} DOCX files loaded in memory.', "debug")
+
+def open_document(path:str) -> docx.Document:
+	absolute_path = os.path.abspath(path)
+	if absolute_path in FILES_CONTENT:
+		return docx.Document(io.BytesIO(FILES_CONTENT[absolute_path]))
+	return docx.Document(path)
+
 class DocxManager():
 
 	################################################################# SURCHARGE
@@ -127,7 +147,7 @@ class DocxManager():
 			return -1		
 		try:
 			composer = docxcompose.composer.Composer(self.document)
-			next_document = docx.Document(path)
+			next_document = open_document(path)
 			if heading_offset:
 				for paragraph in next_document.paragraphs:
 					if paragraph.style.name.startswith('Heading '):
@@ -226,7 +246,7 @@ class DocxManager():
 	def load_file(self, path:str=None) -> bool:
 		path = path if path else self.path.abs
 		try:
-			self.document = docx.Document(path)
+			self.document = open_document(path)
 			self.saved_to_file = False
 		except Exception as e:
 			logging.log(f'Error while loading the file at "{path}" : {e}', "Error")
@@ -429,6 +449,32 @@ class DocxManager():
 
 		logging.log(f'Link to "{text}" added to the document.')
 
+	@logging.log_call
+	def add_table(self, rows, header=None, style="Table Grid"):
+		#
+		columns = len(header) if header else max(len(row) for row in rows)
+		#
+		try:
+			table = self.document.add_table(rows=0, cols=columns, style=style)
+		#
+		# If the template does not define the style
+		#
+		except KeyError:
+			table = self.document.add_table(rows=0, cols=columns)
+		#
+		for row_index, row in enumerate([header] + list(rows) if header else rows):
+			cells = table.add_row().cells
+			for cell, value in zip(cells, row):
+				cell.text = str(value)
+				# Bold header
+				if header and row_index == 0:
+					for run in cell.paragraphs[0].runs:
+						run.bold = True
+		#
+		logging.log(f'Table of {len(table.rows)} rows added to the document.')
+		#
+		return table
+
 	@logging.log_call
 	def bookmark(self, name, anchor=None):
 		el = [el for el in self.document._element[0] if el.tag.endswith('}p')][-1]
@@ -0,0 +1,25 @@
+import heapq
+
+# Evidence of the risks (affected accounts, computers...), of which only the first objects in alphabetical order are kept
+# Example: push(details, "Account: krbtgt", 20) for each object, then get_sorted(details) -> ["Account: administrator", "Account: krbtgt", ...]
+
+class Descending():
+
+	__slots__ = ("value",)
+
+	def __init__(self, value) -> None:
+		self.value = value
+
+	# Reversed order, so that the top of the heap is the last of the kept objects
+	def __lt__(self, other) -> bool:
+		return self.value > other.value
+
+def push(heap:list, value, top_k:int) -> None:
+	if len(heap) < top_k:
+		heapq.heappush(heap, Descending(value))
+	# Replace the last kept object, if the new one comes before it
+	elif heap and value < heap[0].value:
+		heapq.heapreplace(heap, Descending(value))
+
+def get_sorted(heap:list) -> list:
+	return [item.value for item in sorted(heap, reverse=True)]
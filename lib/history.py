@@ -0,0 +1,223 @@
+import datetime
+import json
+import os
+import sqlite3
+import lib.logs as logging
+
+# Version of the schema of the database, to increase each time the tables change
+SCHEMA_VERSION = 3
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS snapshots (
+	id INTEGER PRIMARY KEY,
+	client TEXT NOT NULL,
+	domain TEXT NOT NULL,
+	tool TEXT NOT NULL,
+	format TEXT NOT NULL,
+	timestamp TEXT NOT NULL,
+	datetime TEXT NOT NULL,
+	path TEXT,
+	mapping_hash TEXT NOT NULL,
+	UNIQUE (client, domain, tool, timestamp)
+);
+CREATE INDEX IF NOT EXISTS snapshots_by_domain ON snapshots (client, domain, timestamp);
+CREATE TABLE IF NOT EXISTS observations (
+	snapshot_id INTEGER NOT NULL REFERENCES snapshots (id) ON DELETE CASCADE,
+	client TEXT NOT NULL,
+	domain TEXT NOT NULL,
+	risk_uid INTEGER NOT NULL,
+	timestamp TEXT NOT NULL,
+	state INTEGER NOT NULL,
+	PRIMARY KEY (snapshot_id, risk_uid)
+);
+CREATE INDEX IF NOT EXISTS observations_by_risk ON observations (client, domain, risk_uid, timestamp);
+CREATE TABLE IF NOT EXISTS evidence (
+	snapshot_id INTEGER NOT NULL REFERENCES snapshots (id) ON DELETE CASCADE,
+	risk_id TEXT NOT NULL,
+	record TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS evidence_by_snapshot ON evidence (snapshot_id);
+CREATE TABLE IF NOT EXISTS reported_ids (
+	snapshot_id INTEGER NOT NULL REFERENCES snapshots (id) ON DELETE CASCADE,
+	risk_id TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS reported_ids_by_snapshot ON reported_ids (snapshot_id);
+"""
+
+def get_timestamp(report_datetime:str) -> str:
+	# "2023-05-23T16:40:56.1234567+02:00" -> "2023-05-23T14:40:56+00:00", comparable as text whatever the format of the tool
+	# Truncated to the second, as the HTML version of a PingCastle report does not write the fractions of second of the XML one
+	return datetime.datetime.fromisoformat(report_datetime).astimezone(datetime.timezone.utc).replace(microsecond=0).isoformat()
+
+class History():
+
+	################################################################# SURCHARGE
+
+	def __init__(self, path:str=None) -> None:
+		self._connection = None		# sqlite3.Connection to ./cache/history.sqlite3
+		self._path = None			# ./cache/history.sqlite3
+
+		if path:
+			self.load(path)
+
+	def __str__(self) -> str:
+		substrings = []
+		for attribute, value in vars(self).items():
+			substrings.append(f"{attribute}: {str(value)}")
+		return "\n".join(substrings)
+
+	################################################################### GETTERS
+
+	@property
+	def connection(self) -> sqlite3.Connection:
+		return self._connection
+
+	@property
+	def path(self) -> str:
+		return self._path
+
+	################################################################### SETTERS
+
+	@path.setter
+	def path(self, path:str) -> None:
+		self._path = path
+
+	################################################################### METHODS
+
+	def load(self, path:str) -> None:
+		self.path = path
+		os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+		self._connection = sqlite3.connect(path)
+		self.connection.execute("PRAGMA foreign_keys = ON")
+		self.connection.execute("PRAGMA journal_mode = WAL")
+		# With WAL, an interrupted run can only lose the last snapshots recorded, which are recorded again by the next run
+		self.connection.execute("PRAGMA synchronous = NORMAL")
+		# A database of the first schema keeps its snapshots, which may come from archived input files
+		if self.connection.execute("PRAGMA user_version").fetchone()[0] == 1:
+			self.truncate_timestamps()
+		if self.connection.execute("PRAGMA user_version").fetchone()[0] == 2:
+			self.expire_snapshots()
+		# A database of another previous schema is emptied, its snapshots are recorded again from the input files
+		if self.connection.execute("PRAGMA user_version").fetchone()[0] != SCHEMA_VERSION:
+			with self.connection:
+				for table in ["evidence", "observations", "snapshots"]:
+					self.connection.execute(f"DROP TABLE IF EXISTS {table}")
+				self.connection.execute(f"PRAGMA user_version = {SCHEMA_VERSION}")
+		self.connection.executescript(SCHEMA)
+		logging.log(f'History of the audits loaded from "{path}".', "debug")
+
+	def truncate_timestamps(self) -> None:
+		# Schema 1 -> 2: the timestamps are truncated to the second, the versions of a same snapshot being merged into the XML one, or else the last recorded
+		with self.connection:
+			kept_snapshots = {}
+			for snapshot_id, client, domain, tool, timestamp in self.connection.execute("SELECT id, client, domain, tool, timestamp FROM snapshots ORDER BY format = 'xml', id").fetchall():
+				key = (client, domain, tool, get_timestamp(timestamp))
+				if key in kept_snapshots:
+					self.connection.execute("DELETE FROM snapshots WHERE id = ?", (kept_snapshots[key],))
+				kept_snapshots[key] = snapshot_id
+			for (client, domain, tool, timestamp), snapshot_id in kept_snapshots.items():
+				self.connection.execute("UPDATE snapshots SET timestamp = ? WHERE id = ?", (timestamp, snapshot_id))
+				self.connection.execute("UPDATE observations SET timestamp = ? WHERE snapshot_id = ?", (timestamp, snapshot_id))
+			self.connection.execute("PRAGMA user_version = 2")
+		logging.log(f'Timestamps of the history of the audits at "{self.path}" truncated to the second ({len(kept_snapshots)} snapshots).', "info")
+
+	def expire_snapshots(self) -> None:
+		# Schema 2 -> 3: the IDs reported by the tools are recorded with the snapshots, so the snapshots whose input files are still there are recorded again
+		# The snapshots of archived input files keep their states and evidence, without their reported IDs
+		with self.connection:
+			self.connection.execute("UPDATE snapshots SET mapping_hash = ''")
+			self.connection.execute("PRAGMA user_version = 3")
+		logging.log(f'Snapshots of the history of the audits at "{self.path}" to be recorded again with their reported IDs.', "info")
+
+	def close(self) -> None:
+		if self.connection is not None:
+			self.connection.close()
+			self._connection = None
+
+	def has_snapshot(self, client:str, domain:str, report:dict, mapping_hash:str) -> bool:
+		# True if the snapshot has been recorded with the same mapping of the risks, from the same format or from the XML one (more detailed)
+		row = self.connection.execute(
+			"SELECT mapping_hash, format FROM snapshots WHERE client = ? AND domain = ? AND tool = ? AND timestamp = ?",
+			(client, domain, report["tool"], get_timestamp(report["datetime"]))
+		).fetchone()
+		return row is not None and row[0] == mapping_hash and row[1] in (report["format"], "xml")
+
+	def add_snapshot(self, client:str, domain:str, report:dict, mapping_hash:str, observations:list, evidence_records:list) -> int:
+		# observations: [(12, 1), (57, -1), ...] State of the risks tested by the tool
+		# evidence_records: [{"risk_id": "A-Krbtgt", ...}, ...] Evidence given by the tool, mapped to the risks when they are read
+		# The IDs reported by the tool (report["risk_ids"]) are recorded as they are, mapped or not, for the coverage of the mapping
+		timestamp = get_timestamp(report["datetime"])
+		with self.connection:
+			# A snapshot recorded again (new mapping of the risks) replaces the previous version
+			self.connection.execute("DELETE FROM snapshots WHERE client = ? AND domain = ? AND tool = ? AND timestamp = ?", (client, domain, report["tool"], timestamp))
+			snapshot_id = self.connection.execute(
+				"INSERT INTO snapshots (client, domain, tool, format, timestamp, datetime, path, mapping_hash) VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+				(client, domain, report["tool"], report["format"], timestamp, report["datetime"], report["path"], mapping_hash)
+			).lastrowid
+			self.connection.executemany(
+				"INSERT INTO observations (snapshot_id, client, domain, risk_uid, timestamp, state) VALUES (?, ?, ?, ?, ?, ?)",
+				((snapshot_id, client, domain, risk_uid, timestamp, state) for risk_uid, state in observations)
+			)
+			self.connection.executemany(
+				"INSERT INTO evidence (snapshot_id, risk_id, record) VALUES (?, ?, ?)",
+				((snapshot_id, evidence_record["risk_id"], json.dumps(evidence_record)) for evidence_record in evidence_records)
+			)
+			self.connection.executemany(
+				"INSERT INTO reported_ids (snapshot_id, risk_id) VALUES (?, ?)",
+				((snapshot_id, risk_id) for risk_id in report["risk_ids"])
+			)
+		return snapshot_id
+
+	def get_snapshots(self, client:str, domain:str) -> list:
+		# [{"id": 1, "tool": "pingcastle", "format": "xml", "timestamp": "...", "datetime": "...", "path": "..."}, ...] in chronological order
+		rows = self.connection.execute(
+			"SELECT id, tool, format, timestamp, datetime, path FROM snapshots WHERE client = ? AND domain = ? ORDER BY timestamp, id",
+			(client, domain)
+		)
+		return [dict(zip(["id", "tool", "format", "timestamp", "datetime", "path"], row)) for row in rows]
+
+	def get_observations(self, client:str, domain:str) -> dict:
+		# {1: [(12, 1), (57, -1), ...], ...} State of the risks tested in each snapshot of a domain
+		observations = {}
+		for snapshot_id, risk_uid, state in self.connection.execute("SELECT snapshot_id, risk_uid, state FROM observations WHERE client = ? AND domain = ?", (client, domain)):
+			observations.setdefault(snapshot_id, []).append((risk_uid, state))
+		return observations
+
+	def get_reported_ids(self, client:str) -> dict:
+		# {"pingcastle": [{"domain": "contoso.local", "datetime": "...", "risk_ids": ["A-Krbtgt", ...]}, ...], ...} IDs reported in each snapshot of all the domains, in chronological order
+		reported_ids = {}
+		snapshots = {}
+		for snapshot_id, tool, domain, snapshot_datetime, risk_id in self.connection.execute(
+			"SELECT snapshots.id, tool, domain, datetime, risk_id FROM snapshots LEFT JOIN reported_ids ON reported_ids.snapshot_id = snapshots.id WHERE client = ? ORDER BY timestamp, snapshots.id, reported_ids.rowid",
+			(client,)
+		):
+			snapshot = snapshots.get(snapshot_id)
+			if snapshot is None:
+				snapshot = snapshots[snapshot_id] = {"domain": domain, "datetime": snapshot_datetime, "risk_ids": []}
+				reported_ids.setdefault(tool, []).append(snapshot)
+			if risk_id is not None:
+				snapshot["risk_ids"].append(risk_id)
+		return reported_ids
+
+	def get_evidence(self, snapshot_id:int) -> list:
+		return [json.loads(record) for (record,) in self.connection.execute("SELECT record FROM evidence WHERE snapshot_id = ? ORDER BY rowid", (snapshot_id,))]
+
+	def get_latest_states(self, client:str, domain:str, risk_uids:list) -> dict:
+		# {12: 1, 57: -1, ...} State of each risk in its last snapshot tested, for the risks tested at least once in the domain
+		# One seek in the index of the observations per risk, the last recorded snapshot winning between snapshots taken at the same time
+		latest_states = {}
+		for risk_uid in risk_uids:
+			row = self.connection.execute(
+				"SELECT state FROM observations WHERE client = ? AND domain = ? AND risk_uid = ? ORDER BY timestamp DESC, snapshot_id DESC LIMIT 1",
+				(client, domain, risk_uid)
+			).fetchone()
+			if row is not None:
+				latest_states[risk_uid] = row[0]
+		return latest_states
+
+	def get_risk_history(self, client:str, domain:str, risk_uid:int) -> list:
+		# [("2023-05-23T14:40:56+00:00", 1), ...] States of a risk in the snapshots of the tools testing it, in chronological order
+		return self.connection.execute(
+			"SELECT timestamp, state FROM observations WHERE client = ? AND domain = ? AND risk_uid = ? ORDER BY timestamp, snapshot_id",
+			(client, domain, risk_uid)
+		).fetchall()
@@ -1,4 +1,5 @@
 import datetime
+import functools
 import os
 import inspect
 import colorama
@@ -43,6 +44,8 @@ def log(text:str, level:str="info", caller:str=None) -> bool:
 		print_available_log_levels()
 
 def log_call(method):
+	# Keep the name of the method so that the decorated functions can be sent to other processes
+	@functools.wraps(method)
 	def wrapper(*args, **kwargs):
 		text = f'{method.__name__}({str(args[1:])}, {str(kwargs)})'
 		caller = method.__module__.split('.')[-1] + ".py"
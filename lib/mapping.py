@@ -0,0 +1,268 @@
+import hashlib
+import json
+import os
+import pickle
+import re
+import unicodedata
+import lib.logs as logging
+
+# Version of the compiled mapping, to increase each time the content added by compile() changes
+MAPPING_VERSION = 5
+
+# Severities of the risks, from the most to the least severe
+SEVERITIES = range(1, 10)
+
+# Fields of the estimation of the days needed to fix a risk
+DAYS_TO_FIX_FIELDS = ["minimum", "average", "maximum"]
+
+# Frameworks identifying the risks by a sentence rather than a code, matched whatever their case, spacing and punctuation
+# Example: "Domain trust to a third-party domain without quarantine" and "Domain Trust to a Third Party domain without quarantine."
+NORMALIZED_FRAMEWORKS = {"purpleknight"}
+
+# Punctuation and symbols ignored when matching the normalized IDs
+PUNCTUATION_PATTERN = re.compile(r"[\W_]+")
+
+# Base of the links to the references of each framework
+PINGCASTLE_RULES_URL = "https://pingcastle.com/PingCastleFiles/ad_hc_rules_list.html"
+PURPLEKNIGHT_INDICATORS_URL = "https://www.semperis.com/purple-knight/security-indicators/"
+ANSSI_CHECKLIST_URL = "https://www.cert.ssi.gouv.fr/uploads/ad_checklist.html"
+MITRE_ATTACK_URL = "https://attack.mitre.org"
+
+def hash_content(content:bytes) -> str:
+	return hashlib.sha256(content).hexdigest()
+
+def normalize_id(framework_id:str, reference_id:str) -> str:
+	# ("purpleknight", "Domain trust to a third-party domain without quarantine") -> "domain trust to a third party domain without quarantine"
+	if framework_id not in NORMALIZED_FRAMEWORKS:
+		return reference_id
+	reference_id = unicodedata.normalize("NFKC", reference_id).casefold()
+	return " ".join(PUNCTUATION_PATTERN.sub(" ", reference_id).split())
+
+def get_risk_indexes(framework_index:dict, framework_id:str, reference_id:str) -> list:
+	# Positions of the risks mapped to an ID reported by a tool, [] if it is not mapped
+	return framework_index["ids"].get(normalize_id(framework_id, reference_id), [])
+
+def get_reference_link(framework_id:str, reference_id:str) -> tuple:
+	# ("vuln1_trusts_forest_sidhistory", "anssi") -> ("vuln_trusts_forest_sidhistory", "https://www.cert.ssi.gouv.fr/uploads/ad_checklist.html#vuln_trusts_forest_sidhistory")
+	if framework_id == "pingcastle":
+		return reference_id, PINGCASTLE_RULES_URL
+	if framework_id == "purpleknight":
+		return reference_id, PURPLEKNIGHT_INDICATORS_URL
+	if framework_id == "anssi":
+		# The checklist does not number the levels in its anchors
+		reference_id = reference_id[:4] + reference_id[5:]
+		return reference_id, f"{ANSSI_CHECKLIST_URL}#{reference_id}"
+	if framework_id == "mitre_att&ck":
+		major_id, _, minor_id = reference_id.partition(".")
+		link = ""
+		if reference_id[0] == "M":
+			link = f"{MITRE_ATTACK_URL}/mitigations/{major_id}"
+		elif reference_id[0] == "T":
+			link = f"{MITRE_ATTACK_URL}/techniques/{major_id}"
+		if link and minor_id:
+			link += f"/{minor_id}"
+		return reference_id, link
+	return reference_id, ""
+
+def validate(json_database:dict) -> list:
+	# ['Risk 12: unknown concept "kerberos"', ...]
+	errors = []
+
+	for key, expected_type in [("documentations", dict), ("frameworks", dict), ("risks", list)]:
+		if not isinstance(json_database.get(key), expected_type):
+			errors.append(f'Missing or invalid "{key}" ({expected_type.__name__} expected)')
+	if errors:
+		return errors
+
+	for framework_id, framework in json_database["frameworks"].items():
+		for field in ["id", "name", "link"]:
+			if not isinstance(framework.get(field), str):
+				errors.append(f'Framework "{framework_id}": missing or invalid "{field}"')
+
+	documentations = json_database["documentations"]
+	for documentation_id, documentation in documentations.items():
+		for field in ["title", "file_name"]:
+			if not isinstance(documentation.get(field), str):
+				errors.append(f'Documentation "{documentation_id}": missing or invalid "{field}"')
+		if not isinstance(documentation.get("concepts"), list):
+			errors.append(f'Documentation "{documentation_id}": missing or invalid "concepts"')
+			continue
+		for concept_id in documentation["concepts"]:
+			if concept_id not in documentations:
+				errors.append(f'Documentation "{documentation_id}": unknown concept "{concept_id}"')
+
+	uids = set()
+	for risk_index, risk in enumerate(json_database["risks"]):
+		name = f'Risk {risk.get("uid", f"#{risk_index}")}'
+		if not isinstance(risk.get("uid"), int):
+			errors.append(f'{name}: missing or invalid "uid"')
+		elif risk["uid"] in uids:
+			errors.append(f'{name}: duplicate "uid"')
+		else:
+			uids.add(risk["uid"])
+		if risk.get("severity") not in SEVERITIES:
+			errors.append(f'{name}: missing or invalid "severity" ({SEVERITIES.start} to {SEVERITIES.stop - 1} expected)')
+		for field in ["title", "file_name"]:
+			if not isinstance(risk.get(field), str):
+				errors.append(f'{name}: missing or invalid "{field}"')
+		if not isinstance(risk.get("frameworks"), dict):
+			errors.append(f'{name}: missing or invalid "frameworks"')
+		else:
+			for framework_id, reference_ids in risk["frameworks"].items():
+				if framework_id not in json_database["frameworks"]:
+					errors.append(f'{name}: unknown framework "{framework_id}"')
+				if not isinstance(reference_ids, list) or not all(isinstance(reference_id, str) and reference_id for reference_id in reference_ids):
+					errors.append(f'{name}: invalid IDs of the framework "{framework_id}"')
+		if not isinstance(risk.get("concepts"), list):
+			errors.append(f'{name}: missing or invalid "concepts"')
+		else:
+			for concept_id in risk["concepts"]:
+				if concept_id not in documentations:
+					errors.append(f'{name}: unknown concept "{concept_id}"')
+		days_to_fix = risk.get("days_to_fix")
+		if not isinstance(days_to_fix, dict) or not all(isinstance(days_to_fix.get(field), (int, float)) for field in DAYS_TO_FIX_FIELDS):
+			errors.append(f'{name}: missing or invalid "days_to_fix" ({", ".join(DAYS_TO_FIX_FIELDS)} expected)')
+
+	errors += validate_aliases(json_database)
+	errors += resolve_concepts(documentations)[1]
+	return errors
+
+def validate_aliases(json_database:dict) -> list:
+	# {"aliases": {"purpleknight": {"Former name of the indicator": "Name of the indicator in the mapping", ...}}}
+	aliases = json_database.get("aliases", {})
+	if not isinstance(aliases, dict):
+		return ['Invalid "aliases" (dict expected)']
+	errors = []
+	for framework_id, framework_aliases in aliases.items():
+		if framework_id not in json_database["frameworks"]:
+			errors.append(f'Aliases: unknown framework "{framework_id}"')
+			continue
+		if not isinstance(framework_aliases, dict):
+			errors.append(f'Aliases of the framework "{framework_id}": dict expected')
+			continue
+		mapped_ids = {normalize_id(framework_id, reference_id) for risk in json_database["risks"] if isinstance(risk.get("frameworks"), dict) for reference_id in risk["frameworks"].get(framework_id, []) if isinstance(reference_id, str)}
+		for alias, reference_id in framework_aliases.items():
+			if normalize_id(framework_id, str(reference_id)) not in mapped_ids:
+				errors.append(f'Alias "{alias}" of the framework "{framework_id}": "{reference_id}" is not mapped to any risk')
+	return errors
+
+def resolve_concepts(documentations:dict) -> tuple:
+	# ({"kerberos": ["ntlm", "authentication"], ...}, ['Cycle between the concepts: fsmo -> acl -> fsmo', ...])
+	# Each documentation is resolved once into the concepts needed to understand it, without duplicates and the most basic ones first
+	closures = {}
+	errors = []
+	visiting = {}		# {"kerberos": 0, "ntlm": 1, ...} Position of the documentations being resolved in the current path
+
+	def resolve(documentation_id:str) -> list:
+		if documentation_id in closures:
+			return closures[documentation_id]
+		visiting[documentation_id] = len(visiting)
+		closure = {}
+		concept_ids = documentations[documentation_id].get("concepts", [])
+		for concept_id in concept_ids if isinstance(concept_ids, list) else []:
+			if concept_id not in documentations:
+				continue
+			# A concept that requires itself, directly or not, cannot be listed before the concepts requiring it
+			if concept_id in visiting:
+				path = list(visiting)
+				errors.append(f'Cycle between the concepts: {" -> ".join(path[visiting[concept_id]:] + [concept_id])}')
+				continue
+			closure.update(dict.fromkeys(resolve(concept_id)))
+			closure[concept_id] = None
+		del visiting[documentation_id]
+		closures[documentation_id] = list(closure)
+		return closures[documentation_id]
+
+	for documentation_id in documentations:
+		resolve(documentation_id)
+	return closures, errors
+
+def index_risks(risks:list, aliases:dict=None) -> dict:
+	# {"pingcastle": {"ids": {"A-Krbtgt": [2, 57], ...}, "names": {"A-Krbtgt": "A-Krbtgt", ...}, "aliases": {}, "risks": [0, 1, 2, ...]}, "anssi": {...}, ...}
+	# The IDs are normalized (see normalize_id), "names" giving back the ID written in the mapping and "aliases" the normalized ID an alias stands for
+	index = {}
+	for risk_index, risk in enumerate(risks):
+		for framework_id, reference_ids in risk["frameworks"].items():
+			framework_index = index.setdefault(framework_id, {"ids": {}, "names": {}, "aliases": {}, "risks": []})
+			framework_index["risks"].append(risk_index)
+			for reference_id in reference_ids:
+				normalized_id = normalize_id(framework_id, reference_id)
+				framework_index["names"].setdefault(normalized_id, reference_id)
+				risk_indexes = framework_index["ids"].setdefault(normalized_id, [])
+				if risk_index not in risk_indexes:
+					risk_indexes.append(risk_index)
+	# The aliases share the risks of the ID they stand for
+	for framework_id, framework_aliases in (aliases or {}).items():
+		framework_index = index.get(framework_id)
+		if framework_index is None:
+			continue
+		for alias, reference_id in framework_aliases.items():
+			normalized_id = normalize_id(framework_id, reference_id)
+			normalized_alias = normalize_id(framework_id, alias)
+			if normalized_id in framework_index["ids"] and normalized_alias not in framework_index["ids"]:
+				framework_index["ids"][normalized_alias] = framework_index["ids"][normalized_id]
+				framework_index["aliases"][normalized_alias] = normalized_id
+	return index
+
+def bucket_risks_by_severity(risks:list) -> dict:
+	# {1: [0, 4, ...], 2: [...], ...}, positions of the risks in their original order
+	buckets = {severity: [] for severity in SEVERITIES}
+	for risk_index, risk in enumerate(risks):
+		buckets[risk["severity"]].append(risk_index)
+	return {severity: risk_indexes for severity, risk_indexes in buckets.items() if risk_indexes}
+
+@logging.log_call
+def compile(json_database:dict) -> dict:
+	# Lookups derived from the mapping, computed once instead of on each run
+	for risk in json_database["risks"]:
+		# The states of the risks in each snapshot are kept in a matrix when the input files are processed (see lib/states.py)
+		risk.pop("found", None)
+		risk["references"] = {framework_id: [get_reference_link(framework_id, reference_id) for reference_id in reference_ids] for framework_id, reference_ids in risk["frameworks"].items()}
+	json_database.setdefault("aliases", {})
+	json_database["index"] = index_risks(json_database["risks"], json_database["aliases"])
+	json_database["severities"] = bucket_risks_by_severity(json_database["risks"])
+	json_database["concept_closures"] = resolve_concepts(json_database["documentations"])[0]
+	return json_database
+
+@logging.log_call
+def load(path:str, encoding:str, compiled_path:str, force:bool=False) -> dict:
+	with open(path, "rb") as file:
+		content = file.read()
+	content_hash = hash_content(content)
+
+	# Reuse the compiled mapping if it has been compiled from the same JSON file
+	if not force:
+		try:
+			with open(compiled_path, "rb") as file:
+				compiled_mapping = pickle.load(file)
+			if compiled_mapping["version"] == MAPPING_VERSION and compiled_mapping["hash"] == content_hash:
+				logging.log(f'Compiled mapping of the risks loaded from "{compiled_path}".', "debug")
+				return compiled_mapping["database"]
+		except (OSError, EOFError, pickle.UnpicklingError, KeyError, TypeError, AttributeError):
+			logging.log(f'No valid compiled mapping of the risks at "{compiled_path}", it will be compiled again.', "debug")
+
+	# Else, validate the JSON file before compiling it
+	try:
+		json_database = json.loads(content.decode(encoding))
+	except (UnicodeDecodeError, ValueError) as e:
+		logging.log(f'Unable to read the mapping of the risks at "{path}" : {e}', "error")
+		return None
+	errors = validate(json_database)
+	for error in errors:
+		logging.log(f'Invalid mapping of the risks at "{path}": {error}', "error")
+	if errors:
+		return None
+	json_database = compile(json_database)
+	# The hash identifies the mapping the states of the risks recorded in the history of the audits were computed with
+	json_database["hash"] = content_hash
+
+	try:
+		os.makedirs(os.path.dirname(os.path.abspath(compiled_path)), exist_ok=True)
+		with open(f"{compiled_path}.tmp", "wb") as file:
+			pickle.dump({"version": MAPPING_VERSION, "hash": content_hash, "database": json_database}, file, protocol=pickle.HIGHEST_PROTOCOL)
+		os.replace(f"{compiled_path}.tmp", compiled_path)
+		logging.log(f'Mapping of the risks compiled at "{compiled_path}".', "info")
+	except OSError as e:
+		logging.log(f'Unable to save the compiled mapping of the risks at "{compiled_path}" : {e}', "warning")
+
+	return json_database
@@ -0,0 +1,108 @@
+import importlib
+import re
+import zipfile
+import lib.archives as archives
+import lib.logs as logging
+
+# Number of bytes read at the start of a file to recognize the tool that generated it (8 KB)
+SNIFF_SIZE = 8 * 1024
+
+# Signature of the XLSX workbooks, which are ZIP archives
+ZIP_SIGNATURE = b"PK\x03\x04"
+
+# Parsers of the input reports, imported only when a file of their tool is found
+# Each format declares the signature of its files and the function extracting a report from them
+PARSERS = {
+	"pingcastle": {
+		"module": "lib.pingcastle",
+		"formats": {
+			"xml": {
+				# <?xml version="1.0" encoding="utf-8"?><HealthcheckData>...
+				"signature": {"prefix": re.compile(rb"^(?:\xef\xbb\xbf)?\s*(?:<\?xml[^>]*\?>\s*)?(?:<!--.*?-->\s*)*<HealthcheckData[\s>]", re.DOTALL)},
+				"function": "extract_pingcastle_xml_report"
+			},
+			"html": {
+				# <html>...PingCastle..., or an HTML file named like a PingCastle report (ad_hc_contoso.local.html)
+				"signature": {"prefix": re.compile(rb"<html", re.IGNORECASE), "marker": re.compile(rb"PingCastle"), "file_name": re.compile(r"^ad_hc_.+\.html(?:\.gz)?$", re.IGNORECASE)},
+				"function": "extract_pingcastle_html_report"
+			}
+		}
+	},
+	"purpleknight": {
+		"module": "lib.purpleknight",
+		"formats": {
+			"xlsx": {
+				# XLSX workbook with an "Indicators results" sheet
+				"signature": {"prefix": re.compile(re.escape(ZIP_SIGNATURE)), "sheet": re.compile(rb'<sheet\b[^>]*\bname="Indicators results"')},
+				"function": "extract_purpleknight_xlsx_report"
+			}
+		}
+	},
+	"anssi": {
+		"module": "lib.anssi",
+		"formats": {
+			"csv": {
+				# CSV or TSV export of the ANSSI checks, with IDs like vuln1_trusts_forest_sidhistory
+				"signature": {"prefix": re.compile(rb"(?:^|[\t;,\"'])vuln\d_\w+(?:$|[\t;,\"'\r\n])", re.MULTILINE)},
+				"function": "extract_anssi_csv_report"
+			}
+		}
+	}
+}
+
+def read_prefix(path:str) -> bytes:
+	with archives.open_input(path) as file:
+		return file.read(SNIFF_SIZE)
+
+def read_workbook(path:str) -> bytes:
+	# Description of the sheets of a XLSX workbook, read without loading the sheets themselves
+	with archives.open_input(path, seekable=True) as file:
+		with zipfile.ZipFile(file) as workbook:
+			return workbook.read("xl/workbook.xml")
+
+def matches(signature:dict, path:str, prefix:bytes) -> bool:
+	if not signature["prefix"].search(prefix):
+		return False
+	if "marker" in signature and not signature["marker"].search(prefix) and not signature["file_name"].match(archives.get_file_name(path)):
+		return False
+	if "sheet" in signature:
+		try:
+			return signature["sheet"].search(read_workbook(path)) is not None
+		except (KeyError, OSError, zipfile.BadZipFile):
+			return False
+	return True
+
+@logging.log_call
+def sniff(path:str) -> tuple:
+	# ("pingcastle", "xml"), ("purpleknight", "xlsx")... or None for the files of no known tool
+	try:
+		prefix = read_prefix(path)
+	except (OSError, EOFError) as e:
+		logging.log(f'Unable to read the input file at "{path}" : {e}', "error")
+		return None
+	for tool, parser in PARSERS.items():
+		for file_format, format_parser in parser["formats"].items():
+			if matches(format_parser["signature"], path, prefix):
+				return tool, file_format
+	return None
+
+@logging.log_call
+def classify_files(paths:list, get_known_format=None) -> dict:
+	# {"pingcastle": {"xml": ["./input/ad_hc_contoso.local.xml", ...], "html": [...]}, "purpleknight": {"xlsx": [...]}}
+	classified_files = {tool: {file_format: [] for file_format in parser["formats"]} for tool, parser in PARSERS.items()}
+	for path in paths:
+		tool_format = get_known_format(path) if get_known_format else None
+		if tool_format is None:
+			tool_format = sniff(path)
+		if tool_format is None:
+			logging.log(f'Input file "{path}" ignored, it does not look like a report of a known tool.', "debug")
+			continue
+		tool, file_format = tool_format
+		classified_files[tool][file_format].append(path)
+	return classified_files
+
+def get_extract_function(tool:str, file_format:str):
+	# The module of the tool is imported the first time one of its files has to be parsed
+	parser = PARSERS[tool]
+	module = importlib.import_module(parser["module"])
+	return getattr(module, parser["formats"][file_format]["function"])
@@ -104,7 +104,7 @@ class Path():
 				self.abs_dir = os.path.dirname(path)
 				self.rel_dir = os.path.relpath(self.abs_dir)
 				self.full_name = os.path.basename(path)
-				self.name, self.extension = self.full_name.split('.')
+				self.name, self.extension = self.full_name.rsplit('.', 1)
 		else:
 			if os.path.isdir(path):
 				self.rel_dir = path
@@ -115,5 +115,5 @@ class Path():
 				self.rel_dir = os.path.dirname(path)
 				self.abs_dir = os.path.abspath(self.rel_dir)
 				self.full_name = os.path.basename(path)
-				self.name, self.extension = self.full_name.split('.')
+				self.name, self.extension = self.full_name.rsplit('.', 1)
 		self.base = self.base
\ No newline at end of file
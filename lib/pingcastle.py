@@ -1,9 +1,37 @@
 import argparse
+import datetime
 import glob
-import bs4
+import hashlib
+import html
+import json
+import mmap
 import os
+import re
+import lib.archives as archives
+import lib.evidence as evidence
 import lib.logs as logging
 import xml.etree.ElementTree
+import xml.parsers.expat
+
+# Folder of the indexes of the sections of the PingCastle XML reports, each one named after the hash of the path of its report
+# Example: "./input/ad_hc_contoso.local.xml" -> "./cache/sections/9f86d0....json"
+SECTION_INDEX_FOLDER = "./cache/sections"
+
+# Size of the blocks read when indexing the sections of a PingCastle XML report (1 MB)
+INDEX_BLOCK_SIZE = 1024 * 1024
+
+# Maximum number of details (affected accounts, computers...) kept for each risk rule
+EVIDENCE_TOP_K = 20
+
+# Size of the blocks read when looking for the JSON summary of a PingCastle HTML report (64 KB)
+HTML_BLOCK_SIZE = 64 * 1024
+
+# <input type='hidden' name='json' value='{...}'>
+HTML_JSON_INPUT_PATTERN = re.compile(rb"<input\b[^>]*\bname\s*=\s*['\"]json['\"][^>]*>", re.IGNORECASE)
+HTML_VALUE_PATTERN = re.compile(rb"\bvalue\s*=\s*(?:'([^']*)'|\"([^\"]*)\")", re.IGNORECASE)
+
+# ad_hc_contoso.local.html
+REPORT_FILE_NAME_PATTERN = re.compile(r"^ad_hc_(.+)\.(?:xml|html)(?:\.gz)?$", re.IGNORECASE)
 
 @logging.log_call
 def get_risk_ids_from_pingcastle_file(file_path:str):
@@ -56,51 +84,12 @@ def get_risk_ids_from_pingcastle_html_file(file_path:str) -> list:
         print(f'Impossible to find a PingCastle HTML report at "{file_path}".')
         raise FileNotFoundError
 
-    with open(file_path, 'r', encoding="utf-8") as file:
-        html_content = file.read()
-  
-        soup = bs4.BeautifulSoup(html_content, 'html.parser')
-
-        # <input type='hidden' name='json' value='{
-        #   "generation":"2023-05-23 14:40:56Z",
-        #   "version":"2.11.0.0",
-        #   "users":4239,
-        #   "computers":4477,
-        #   "score":100,
-        #   "anomaly":100,
-        #   "staledobjects":100,
-        #   "trust":100,
-        #   "privilegedGroup":100,
-        #   "maturityLevel":1,
-        #   "rules":"A-Krbtgt,T-SIDFiltering,T-SIDHistoryUnknownDomain,P-DelegationGPOData,T-Inactive,S-OS-2003,P-Delegated,P-ServiceDomainAdmin,P-UnkownDelegation,S-OS-2008,A-CertTempCustomSubject,S-SIDHistory,S-PwdLastSet-90,S-DesEnabled,S-PwdNotRequired,P-ProtectedUsers,S-ADRegistrationSchema,P-AdminPwdTooOld,S-SMB-v1,S-OS-XP,P-Kerberoasting,S-OS-W10,A-AuditDC,P-ControlPathIndirectMany,S-OS-Win7,A-CertEnrollHttp,A-LAPS-Joined-Computers,S-PwdLastSet-DC,A-DCLdapSign,A-DCLdapsChannelBinding,S-WSUS-HTTP,P-UnconstrainedDelegation,S-Reversible,A-DnsZoneTransfert,A-PreWin2000Other,A-WeakRSARootCert2,S-PwdNeverExpires,P-LogonDenied,T-AlgsAES,A-DsHeuristicsLDAPSecurity,A-SHA1RootCert,A-DnsZoneAUCreateChild,A-NoServicePolicy,A-PreWin2000AuthenticatedUsers,P-DNSAdmin,A-NoNetSessionHardening,P-OperatorsEmpty,A-UnixPwd",
-        #   "id":"8LxHr7jw1I+C4W2m13Q8LAnJgpmkek+h1G80D9icy3w="
-        # }'>  
-        input_element = soup.find('input', {'name': 'json'})
-        
-        if input_element is None:
-            print("Impossible to find an \"input\" HTML element with the name \"json\"")
-            return None
-        
-        value = input_element.get('value')
-        
-        if value is None:
-            print("Impossible to find a \"value\" attribute in the \"input\" HTML element with the name \"json\"")
-            return None
-        
-        start_patern = '"rules":"'
-        start_patern_len = len(start_patern)
-        end_patern = '"'
-
-        start_index = value.find(start_patern)
-        end_index = value.find(end_patern, start_index + start_patern_len)
-        
-        if start_index == -1 or end_index == -1:
-            print("Impossible to find the sub-strings \"" + start_patern + "\" and \"" + end_patern + "\" in the \"value\" attribute of the \"input\" HTML element with the name \"json\"")
-            return None
-    
-    substring = value[start_index + start_patern_len:end_index]
-    risk_id_values = substring.split(',')
-    
+    # IDS
+    report = extract_pingcastle_html_report(file_path)
+    if report["datetime"] is None:
+        return None
+    risk_id_values = report["risk_ids"]
+
     print(f'Risk ids from the PingCastle HTML report at "{file_path}":\n{", ".join(risk_id_values)}')
     print()
     return risk_id_values
@@ -122,26 +111,344 @@ def get_risk_ids_from_pingcastle_xml_file(file_path:str) -> list:
         print(f'Impossible to find the PingCastle XML report at "{file_path}".')
         raise FileNotFoundError
 
+    # IDS
+    risk_id_values = extract_pingcastle_xml_report(file_path)["risk_ids"]
+    print(f'Risk ids from the PingCastle XML report at "{file_path}":\n{", ".join(risk_id_values)}')
+    print()
+    return risk_id_values
+
+@logging.log_call
+def extract_pingcastle_report(file_path:str) -> dict:
+
+    # ad_hc_contoso.local.html, ad_hc_contoso.local.html.gz or archive.zip::ad_hc_contoso.local.html
+    if archives.get_uncompressed_name(file_path).lower().endswith(".html"):
+        return extract_pingcastle_html_report(file_path)
+
+    return extract_pingcastle_xml_report(file_path)
+
+@logging.log_call
+def extract_pingcastle_html_report(file_path:str) -> dict:
+
+    # <input type='hidden' name='json' value='{
+    #   "generation":"2023-05-23 14:40:56Z",
+    #   "version":"2.11.0.0",
+    #   "users":4239,
+    #   "computers":4477,
+    #   "score":100,
+    #   "anomaly":100,
+    #   "staledobjects":100,
+    #   "trust":100,
+    #   "privilegedGroup":100,
+    #   "maturityLevel":1,
+    #   "rules":"A-Krbtgt,T-SIDFiltering,T-SIDHistoryUnknownDomain,...",
+    #   "id":"8LxHr7jw1I+C4W2m13Q8LAnJgpmkek+h1G80D9icy3w="
+    # }'>
+    file_name = REPORT_FILE_NAME_PATTERN.match(archives.get_file_name(file_path))
+
+    report = {
+        "tool": "pingcastle",
+        "format": "html",
+        "path": file_path,
+        "datetime": None,
+        # The summary does not contain the domain, PingCastle writes it in the name of the report instead
+        "domain": file_name.group(1) if file_name else None,
+        "risk_rules": [],
+        "risk_ids": []
+    }
+
+    input_element = None
+    buffer = b""
+
+    # Read the report block by block and stop as soon as the hidden "json" input is complete
+    with archives.open_input(file_path) as file:
+        for block in iter(lambda: file.read(HTML_BLOCK_SIZE), b""):
+            buffer += block
+            input_element = HTML_JSON_INPUT_PATTERN.search(buffer)
+            if input_element:
+                break
+            # Only keep the end of the buffer, or the last "input" element if it is not closed yet
+            start_index = buffer.rfind(b"<input")
+            if start_index == -1 or buffer.find(b">", start_index) != -1:
+                buffer = buffer[-len(b"<input"):]
+            else:
+                buffer = buffer[start_index:]
+
+    if input_element is None:
+        logging.log(f'Impossible to find an "input" HTML element with the name "json" in the PingCastle HTML report at "{file_path}".', "error")
+        return report
+
+    value = HTML_VALUE_PATTERN.search(input_element.group(0))
+
+    if value is None:
+        logging.log(f'Impossible to find a "value" attribute in the "input" HTML element with the name "json" in the PingCastle HTML report at "{file_path}".', "error")
+        return report
+
+    try:
+        summary = json.loads(html.unescape((value.group(1) or value.group(2)).decode("utf-8")))
+    except ValueError as e:
+        logging.log(f'Impossible to decode the "value" attribute of the "input" HTML element with the name "json" in the PingCastle HTML report at "{file_path}" : {e}', "error")
+        return report
+
+    risk_ids = [risk_id for risk_id in summary.get("rules", "").split(",") if risk_id]
+
+    report.update({
+        "datetime": get_iso_datetime(summary.get("generation")),
+        "risk_rules": [{"risk_id": risk_id} for risk_id in risk_ids],
+        "risk_ids": risk_ids,
+        "generation": summary.get("generation"),
+        "rules": summary.get("rules"),
+        "scores": {
+            "global": summary.get("score"),
+            "anomaly": summary.get("anomaly"),
+            "staled_objects": summary.get("staledobjects"),
+            "trust": summary.get("trust"),
+            "privileged_group": summary.get("privilegedGroup")
+        },
+        "users": summary.get("users"),
+        "computers": summary.get("computers")
+    })
+
+    return report
+
+def get_iso_datetime(generation:str) -> str:
+
+    if not generation:
+        return None
+
+    # "2023-05-23 14:40:56Z" -> "2023-05-23T14:40:56+00:00"
+    return datetime.datetime.fromisoformat(generation.replace("Z", "+00:00")).isoformat()
+
+@logging.log_call
+def extract_pingcastle_xml_report(file_path:str, evidence_top_k:int=EVIDENCE_TOP_K) -> dict:
+
     # <HealthcheckData>
+    #   <GenerationDate>2023-05-23T14:40:56.0000000+02:00</GenerationDate>
+    #   <DomainFQDN>contoso.local</DomainFQDN>
+    #   ...
     #   <RiskRules>
     #     <HealthcheckRiskRule>
     #       <Points>50</Points>
     #       <Category>Anomalies</Category>
     #       <Model>GoldenTicket</Model>
-    #   ->  <RiskId>A-Krbtgt</RiskId>
+    #       <RiskId>A-Krbtgt</RiskId>
     #       <Rationale>Last change of the Kerberos password: 3108 day(s) ago</Rationale>
+    #       <Details>
+    #         <string>Account: krbtgt</string>
+    #         ...
+    #       </Details>
     #     </HealthcheckRiskRule>
     #     <HealthcheckRiskRule>
     #     ...
     #   <RiskRules>
     # </HealthcheckData>
-    xml_tree = xml.etree.ElementTree.parse(file_path)
-    root_element = xml_tree.getroot()
-    risk_id_elements = root_element.findall('.//RiskId')
-    risk_id_values = [risk_id_element.text for risk_id_element in risk_id_elements]
-    print(f'Risk ids from the PingCastle XML report at "{file_path}":\n{", ".join(risk_id_values)}')
-    print()
-    return risk_id_values
+    report = {
+        "tool": "pingcastle",
+        "format": "xml",
+        "path": file_path,
+        "datetime": None,
+        "domain": None,
+        "risk_rules": [],
+        "risk_ids": []
+    }
+
+    # Stream the file, or the member of an archive, without extracting it on the disk
+    with archives.open_input(file_path) as file:
+        read_report_events(xml.etree.ElementTree.iterparse(file, events=("start", "end")), report, evidence_top_k)
+
+    if report["datetime"] is None:
+        logging.log(f'Impossible to find the "GenerationDate" element in the PingCastle XML report at "{file_path}".', "error")
+
+    return report
+
+def read_report_events(events, report:dict, evidence_top_k:int) -> None:
+
+    # Elements opened but not closed yet, from the root to the parent of the current element
+    opened_elements = []
+
+    # Details of the current risk rule, only the first ones in alphabetical order are kept
+    details = []
+    details_count = 0
+
+    for event, element in events:
+
+        if event == "start":
+            opened_elements.append(element)
+            continue
+
+        opened_elements.pop()
+        depth = len(opened_elements)
+
+        if depth == 1 and element.tag == "GenerationDate":
+            report["datetime"] = element.text
+
+        elif depth == 1 and element.tag == "DomainFQDN":
+            report["domain"] = element.text
+
+        elif depth == 2 and element.tag == "HealthcheckRiskRule" and opened_elements[1].tag == "RiskRules":
+            risk_rule = get_risk_rule_from_element(element)
+            risk_rule["details"] = evidence.get_sorted(details)
+            risk_rule["details_count"] = details_count
+            report["risk_rules"].append(risk_rule)
+            report["risk_ids"].append(risk_rule["risk_id"])
+            details = []
+            details_count = 0
+
+        # The details are kept in a heap bounded to the top-K, so that a rule listing thousands of objects does not use more memory
+        elif depth == 4 and element.tag == "string" and opened_elements[3].tag == "Details" and opened_elements[1].tag == "RiskRules":
+            details_count += 1
+            if element.text:
+                evidence.push(details, element.text, evidence_top_k)
+
+        # The other fields of a risk rule are read when the rule is closed
+        elif depth > 2 and opened_elements[1].tag == "RiskRules" and opened_elements[2].tag == "HealthcheckRiskRule":
+            continue
+
+        # Free the element and detach it from its parent so that the memory does not grow with the size of the file
+        element.clear()
+        if opened_elements:
+            opened_elements[-1].remove(element)
+
+def is_indexable(file_path:str) -> bool:
+
+    # Only the regular files can be memory-mapped, not the compressed files or the members of an archive
+    return archives.split_path(file_path)[1] is None and not file_path.lower().endswith(archives.GZIP_EXTENSION)
+
+def get_section_index_path(file_path:str, index_folder:str=SECTION_INDEX_FOLDER) -> str:
+
+    # The indexes are kept out of the input folder, like the cache of the input reports
+    path_hash = hashlib.sha256(os.path.abspath(file_path).encode("utf-8")).hexdigest()
+    return os.path.join(index_folder, f"{path_hash}.json")
+
+@logging.log_call
+def get_section_index(file_path:str, index_folder:str=SECTION_INDEX_FOLDER) -> dict:
+
+    # {"root": 39, "sections": {"GenerationDate": [120, 161], ..., "RiskRules": [20480, 24576], ...}}
+    # Byte offset of the start of HealthcheckData, and of the start of each of its children and of their end tag
+    stat = os.stat(file_path)
+    index_path = get_section_index_path(file_path, index_folder)
+
+    # Reuse the index written by a previous lookup, if the report has not changed since
+    try:
+        with open(index_path, "r", encoding="utf-8") as file:
+            section_index = json.load(file)
+        if section_index["path"] == os.path.abspath(file_path) and section_index["size"] == stat.st_size and section_index["mtime"] == stat.st_mtime_ns:
+            return {"root": section_index["root"], "sections": section_index["sections"]}
+    except (OSError, ValueError, KeyError, TypeError):
+        pass
+
+    try:
+        section_index = build_section_index(file_path)
+    except xml.parsers.expat.ExpatError as e:
+        logging.log(f'Unable to index the PingCastle XML report at "{file_path}" : {e}', "warning")
+        return None
+
+    # Write in a temporary file first, so that an interrupted lookup never leaves a truncated index
+    try:
+        os.makedirs(index_folder, exist_ok=True)
+        with open(f"{index_path}.tmp", "w", encoding="utf-8") as file:
+            json.dump({"path": os.path.abspath(file_path), "size": stat.st_size, "mtime": stat.st_mtime_ns, **section_index}, file)
+        os.replace(f"{index_path}.tmp", index_path)
+    except OSError as e:
+        logging.log(f'Unable to save the index of the PingCastle XML report at "{index_path}" : {e}', "warning")
+
+    return section_index
+
+@logging.log_call
+def build_section_index(file_path:str) -> dict:
+
+    root_start = None
+    sections = {}
+    section_starts = {}
+    depth = 0
+
+    # Only the byte offsets of the elements are read, no element is built
+    parser = xml.parsers.expat.ParserCreate()
+
+    def start_element(name, attributes):
+        nonlocal depth, root_start
+        depth += 1
+        if depth == 1:
+            root_start = parser.CurrentByteIndex
+        elif depth == 2:
+            section_starts[name] = parser.CurrentByteIndex
+
+    def end_element(name):
+        nonlocal depth
+        if depth == 2 and name not in sections:
+            sections[name] = [section_starts[name], parser.CurrentByteIndex]
+        depth -= 1
+
+    parser.StartElementHandler = start_element
+    parser.EndElementHandler = end_element
+
+    with open(file_path, "rb") as file:
+        for block in iter(lambda: file.read(INDEX_BLOCK_SIZE), b""):
+            parser.Parse(block, False)
+        parser.Parse(b"", True)
+
+    return {"root": root_start, "sections": sections}
+
+def get_root_tag(mapped_file, section_index:dict) -> bytes:
+
+    return mapped_file[section_index["root"]:mapped_file.find(b">", section_index["root"]) + 1]
+
+def get_section_bounds(mapped_file, section_index:dict, section_name:str) -> tuple:
+
+    # The end offset is the start of the end tag, or the end of an empty element (<Trusts />)
+    start, end = section_index["sections"][section_name]
+    if mapped_file[end:end + 2] == b"</":
+        end = mapped_file.find(b">", end) + 1
+    return start, end
+
+def read_sections(file_path:str, section_index:dict, section_names:list) -> tuple:
+
+    # b"<HealthcheckData xmlns:xsi=...>", {"GenerationDate": b"<GenerationDate>2023-05-23T14:40:56.0000000+02:00</GenerationDate>", ...}
+    sections = {}
+
+    # Only the pages of the requested sections are read from the disk
+    with open(file_path, "rb") as file:
+        with mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as mapped_file:
+            # The start tag of the root declares the namespaces used by the sections (xsi:nil...)
+            root_tag = get_root_tag(mapped_file, section_index)
+            for section_name in section_names:
+                if section_name in section_index["sections"]:
+                    start, end = get_section_bounds(mapped_file, section_index, section_name)
+                    sections[section_name] = mapped_file[start:end]
+
+    return root_tag, sections
+
+@logging.log_call
+def read_section(file_path:str, section_name:str, index_folder:str=SECTION_INDEX_FOLDER) -> bytes:
+
+    # XML of a single section of a PingCastle XML report, such as "RiskRules", "DomainControllers" or "Trusts"
+    # The regular files are indexed by their first lookup, the next ones only read the requested section
+    section_index = get_section_index(file_path, index_folder) if is_indexable(file_path) else None
+    if section_index is not None:
+        return read_sections(file_path, section_index, [section_name])[1].get(section_name)
+
+    # The compressed files and the members of an archive are streamed up to the section
+    with archives.open_input(file_path) as file:
+        depth = 0
+        for event, element in xml.etree.ElementTree.iterparse(file, events=("start", "end")):
+            depth += 1 if event == "start" else -1
+            if event == "end" and depth == 1 and element.tag == section_name:
+                return xml.etree.ElementTree.tostring(element)
+            if event == "end" and depth == 1:
+                element.clear()
+
+    return None
+
+def get_risk_rule_from_element(element) -> dict:
+
+    points = element.findtext("Points")
+
+    return {
+        "risk_id": element.findtext("RiskId"),
+        "points": int(points) if points and points.isdigit() else None,
+        "category": element.findtext("Category"),
+        "model": element.findtext("Model"),
+        "rationale": element.findtext("Rationale")
+    }
 
 @logging.log_call
 def request_pingcastle_file_path() -> str:
@@ -162,6 +469,7 @@ def main():
     # ARGUMENTS
     parser = argparse.ArgumentParser(description='Parse a PingCastle HTML report and extract the list of the risks ID')
     parser.add_argument('-f', '--file', type=str, help='Path to a PingCastle HTML or XML file.')
+    parser.add_argument('-s', '--section', type=str, help='Name of a section of a PingCastle XML file to print, such as "RiskRules", "DomainControllers" or "Trusts".')
     args = parser.parse_args()
 
     if hasattr(args, 'file') and args.file is not None:
@@ -171,6 +479,16 @@ def main():
             file_path = request_pingcastle_file_path()
         except KeyboardInterrupt:
             return
+
+    # SECTION
+    if args.section is not None:
+        section = read_section(file_path, args.section)
+        if section is None:
+            print(f'No section "{args.section}" in the PingCastle XML report at "{file_path}".')
+            return None
+        print(section.decode("utf-8"))
+        return section
+
     # IDS
     return get_risk_ids_from_pingcastle_file(file_path)
 
@@ -1,9 +1,45 @@
 import argparse
+import datetime
 import glob
 import openpyxl
 import os
+import pytz
+import re
+import lib.archives as archives
+import lib.evidence as evidence
 import lib.logs as logging
 
+# Number of rows read at the top of the "Assessment summary" sheet
+SUMMARY_MAX_ROW = 30
+
+# Maximum number of objects (rows of the detail sheet) kept for each indicator found
+EVIDENCE_TOP_K = 20
+
+# Columns of the "Indicators results" sheet, found by the keywords of their header, or at their usual position (B to F)
+INDICATOR_COLUMNS = {
+    "category": (("category",), 0),
+    "name": (("indicator", "name"), 1),
+    "severity": (("severity",), 2),
+    "score": (("score",), 3),
+    "status": (("status", "result"), 4),
+    "weight": (("weight",), 5)
+}
+
+# Timezone of the datetimes of the reports, which are written without one ("local" for the timezone of this computer)
+DEFAULT_TIMEZONE = "Europe/Berlin"
+
+# Status of the indicators whose security issue has been found
+FOUND_STATUS = "IOE Found"
+
+# Maximum length of the title of a sheet, the detail sheets are named after the truncated name of their indicator
+SHEET_TITLE_MAX_LENGTH = 31
+
+# Characters forbidden in the titles of the sheets
+FORBIDDEN_SHEET_TITLE_CHARACTERS = re.compile(r"[\\/*?:\[\]]")
+
+# Formats of the datetimes written as text in the reports, when they are not in ISO 8601
+DATETIME_FORMATS = ["%m/%d/%Y %I:%M:%S %p", "%m/%d/%Y %H:%M:%S", "%d/%m/%Y %H:%M:%S", "%d/%m/%Y %H:%M", "%d.%m.%Y %H:%M:%S"]
+
 @logging.log_call
 def get_risk_ids_from_purpleknight_file(file_path:str):
 
@@ -50,24 +86,191 @@ def get_risk_ids_from_purpleknight_xlsx_file(file_path:str) -> list:
         print(f'Impossible to find a PurpleKnight XLSX report at "{file_path}".')
         raise FileNotFoundError
 
-    # Open the workbook
-    workbook = openpyxl.load_workbook(file_path)
-    
-    # Select the specified sheet
-    sheet = workbook["Indicators results"]
-    
-    # Extract data from the specified column
-    risk_id_values = []
-    for row in sheet.iter_rows(min_row=2, max_row=sheet.max_row, min_col=2, max_col=5):
-        data_cell = row[0]  # Column B
-        condition_cell = row[3]  # Column E
-        if condition_cell.value == "IOE Found":
-            risk_id_values.append(data_cell.value)
-    
+    # IDS
+    risk_id_values = extract_purpleknight_xlsx_report(file_path)["risk_ids"]
     print(f'Risk ids from the PurpleKnight XLSX report at "{file_path}":\n{", ".join(risk_id_values)}')
     print()
     return risk_id_values
 
+@logging.log_call
+def extract_purpleknight_xlsx_report(file_path:str, evidence_top_k:int=EVIDENCE_TOP_K, timezone:str=DEFAULT_TIMEZONE) -> dict:
+
+    report = {
+        "tool": "purpleknight",
+        "format": "xlsx",
+        "path": file_path,
+        "datetime": None,
+        "domain": None,
+        "indicators": [],
+        "risk_ids": []
+    }
+
+    # Read the file, or the member of an archive, without extracting it on the disk
+    with archives.open_input(file_path, seekable=True) as file:
+
+        # Open the workbook once, in read-only mode to stream the rows instead of loading every cell and style
+        workbook = openpyxl.load_workbook(file, read_only=True, data_only=True)
+
+        try:
+            # Sheet "Assessment summary", cell B3: datetime of the assessment
+            # Columns A and B of the first rows: labels and values of the summary (forest, domains, ...)
+            sheet = workbook["Assessment summary"]
+            summary = {}
+            for row_index, row in enumerate(sheet.iter_rows(min_row=1, max_row=SUMMARY_MAX_ROW, min_col=1, max_col=2, values_only=True), start=1):
+                label, value = row[0], row[1]
+                if row_index == 3:
+                    report["datetime"] = get_iso_datetime(value, timezone)
+                elif isinstance(label, str) and isinstance(value, str):
+                    summary[label.strip().casefold()] = value.strip()
+            report["domain"] = get_domain_from_summary(summary)
+
+            # Sheet "Indicators results": category, name, severity, score, result and weight of each indicator
+            sheet = workbook["Indicators results"]
+            rows = sheet.iter_rows(values_only=True)
+            columns = get_indicator_columns(next(rows, ()))
+            for row in rows:
+                indicator = {key: get_cell(row, index) for key, index in columns.items()}
+                if indicator["status"] == FOUND_STATUS and indicator["name"]:
+                    indicator["risk_id"] = indicator.pop("name")
+                    indicator.update({"columns": [], "details": [], "details_count": 0})
+                    report["indicators"].append(indicator)
+                    report["risk_ids"].append(indicator["risk_id"])
+
+            # Detail sheets of the indicators found, named after their indicator and listing the affected objects
+            # The sheets of the other indicators are not read
+            indicators_by_sheet_title = get_indicators_by_sheet_title(report["indicators"], file_path)
+            for sheet in workbook.worksheets:
+                indicator = indicators_by_sheet_title.get(sheet.title.strip().casefold())
+                if indicator is not None:
+                    read_detail_sheet(sheet, indicator, evidence_top_k)
+
+        finally:
+            # The read-only mode keeps the file open until the workbook is closed
+            workbook.close()
+
+    if report["datetime"] is None:
+        logging.log(f'Impossible to find the datetime of the PurpleKnight XLSX report at "{file_path}". The file is skipped.', "error")
+
+    return report
+
+def get_indicator_columns(header:tuple) -> dict:
+
+    labels = [str(label).strip().casefold() if label is not None else "" for label in header]
+    columns = {}
+
+    # First column whose header contains one of the keywords, and not already used by a previous key
+    for key, (keywords, default_index) in INDICATOR_COLUMNS.items():
+        columns[key] = next((index for index, label in enumerate(labels) if any(keyword in label for keyword in keywords) and index not in columns.values()), None)
+
+    # Without a known header, the columns are at their usual position
+    if columns["name"] is None or columns["status"] is None:
+        return {key: default_index for key, (keywords, default_index) in INDICATOR_COLUMNS.items()}
+
+    return columns
+
+def get_cell(row:tuple, index:int):
+
+    if index is None or index >= len(row):
+        return None
+
+    # The values are saved in the cache, so they must be serializable in JSON
+    value = row[index]
+    if isinstance(value, str):
+        return value.strip()
+    return value if value is None or isinstance(value, (int, float)) else str(value)
+
+def get_sheet_title(indicator_name:str) -> str:
+
+    # "Domain trust to a third-party domain without quarantine" -> "domain trust to a third-party d"
+    return FORBIDDEN_SHEET_TITLE_CHARACTERS.sub("", indicator_name)[:SHEET_TITLE_MAX_LENGTH].strip().casefold()
+
+def get_indicators_by_sheet_title(indicators:list, file_path:str) -> dict:
+
+    indicators_by_sheet_title = {}
+    ambiguous_sheet_titles = set()
+
+    for indicator in indicators:
+        sheet_title = get_sheet_title(indicator["risk_id"])
+        if sheet_title in indicators_by_sheet_title:
+            ambiguous_sheet_titles.add(sheet_title)
+        indicators_by_sheet_title[sheet_title] = indicator
+
+    # The indicators whose truncated names are the same cannot be told apart, so their detail sheets are not read
+    for sheet_title in sorted(ambiguous_sheet_titles):
+        del indicators_by_sheet_title[sheet_title]
+        logging.log(f'Several indicators found in the PurpleKnight XLSX report at "{file_path}" have a detail sheet named "{sheet_title}". Their details are not read.', "warning")
+
+    return indicators_by_sheet_title
+
+def read_detail_sheet(sheet, indicator:dict, evidence_top_k:int) -> None:
+
+    # The first non-empty row is the header, the next ones are the affected objects
+    # Only the first objects in alphabetical order are kept, in a heap bounded to the top-K
+    details = []
+
+    for row in sheet.iter_rows(values_only=True):
+        values = ["" if value is None else str(value).strip() for value in row]
+        while values and not values[-1]:
+            values.pop()
+        if not values:
+            continue
+        if not indicator["columns"]:
+            indicator["columns"] = values
+            continue
+        indicator["details_count"] += 1
+        evidence.push(details, values, evidence_top_k)
+
+    indicator["details"] = evidence.get_sorted(details)
+
+def get_domain_from_summary(summary:dict) -> str:
+
+    # Prefer the audited domain, then the forest
+    for keyword in ["domain", "forest"]:
+        for label, value in summary.items():
+            if keyword in label and "." in value:
+                return value.split(",")[0].strip().lower()
+
+    return None
+
+def parse_datetime(value:str) -> datetime.datetime:
+
+    value = value.strip()
+    try:
+        return datetime.datetime.fromisoformat(value.replace("Z", "+00:00"))
+    except ValueError:
+        pass
+
+    for datetime_format in DATETIME_FORMATS:
+        try:
+            return datetime.datetime.strptime(value, datetime_format)
+        except ValueError:
+            continue
+
+    return None
+
+def get_iso_datetime(naive_datetime, timezone:str=DEFAULT_TIMEZONE) -> str:
+
+    # The datetime may be written as text in the cell
+    if isinstance(naive_datetime, str):
+        naive_datetime = parse_datetime(naive_datetime)
+
+    if not isinstance(naive_datetime, datetime.datetime):
+        return None
+
+    # Localize the datetime object to the timezone of the computer that ran PurpleKnight, with its daylight saving time at that date
+    if naive_datetime.tzinfo is not None:
+        localized_dt = naive_datetime
+    elif timezone == "local":
+        localized_dt = naive_datetime.astimezone()
+    else:
+        localized_dt = pytz.timezone(timezone).localize(naive_datetime)
+
+    # Convert to ISO 8601 format with the desired precision
+    iso_format = localized_dt.strftime("%Y-%m-%dT%H:%M:%S.%f%z")
+
+    # Format the timezone offset to include the colon
+    return iso_format[:-2] + ":" + iso_format[-2:]
+
 @logging.log_call
 def request_purpleknight_file_path() -> str:
     file_path = None
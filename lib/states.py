@@ -0,0 +1,187 @@
+import bisect
+import datetime
+import numpy
+
+# States of a risk in a snapshot, stored on one byte each
+POSITIVE = 1		# Found by the tool
+NEGATIVE = -1		# Tested by the tool but not found
+UNTESTED = 0		# Not tested by the tool of the snapshot
+
+# Transitions of a risk from its last snapshot tested to a snapshot, in the order of the bars of the history chart
+TRANSITIONS = ["New positive", "Positive, not retested", "Still positive", "Still negative", "Negative, not retested", "New negative"]
+NEW_POSITIVE, POSITIVE_NOT_RETESTED, STILL_POSITIVE, STILL_NEGATIVE, NEGATIVE_NOT_RETESTED, NEW_NEGATIVE = range(len(TRANSITIONS))
+NO_TRANSITION = -1	# Never tested at or before the snapshot
+
+# Changes of the risks between two snapshots, in the order of the chapters of the delta report
+DELTAS = ["new", "regressed", "fixed", "not_retested"]
+
+# Number of snapshots allocated at once when the matrix is full
+INITIAL_CAPACITY = 16
+
+def to_utc(timestamp) -> datetime.datetime:
+	# "2023-05-23T16:40:56.1234567+02:00" -> datetime(2023, 5, 23, 14, 40, 56, 123456, tzinfo=utc), the datetimes without a timezone being local
+	if isinstance(timestamp, str):
+		timestamp = datetime.datetime.fromisoformat(timestamp.replace("Z", "+00:00"))
+	return timestamp.astimezone(datetime.timezone.utc)
+
+class StateMatrix():
+
+	################################################################# SURCHARGE
+
+	def __init__(self, risk_uids:list=None) -> None:
+		self._risk_uids = []		# [12, 57, ...] UID of the risk of each row, in the order of the risks of the JSON database
+		self._rows = {}				# {12: 0, 57: 1, ...}
+		self._timestamps = []		# [datetime(2023, 5, 23, 14, 40, 56, tzinfo=utc), ...] UTC datetime of the snapshot of each column, in chronological order
+		self._states = numpy.zeros((0, INITIAL_CAPACITY), dtype=numpy.int8)
+		self._latest_tested = None	# Risks x snapshots, state of each risk in its last snapshot tested at or before each column, computed when needed
+
+		if risk_uids:
+			self.risk_uids = risk_uids
+
+	def __str__(self) -> str:
+		substrings = []
+		for attribute, value in vars(self).items():
+			substrings.append(f"{attribute}: {str(value)}")
+		return "\n".join(substrings)
+
+	def __len__(self) -> int:
+		return len(self._timestamps)
+
+	################################################################### GETTERS
+
+	@property
+	def risk_uids(self) -> list:
+		return self._risk_uids
+
+	@property
+	def timestamps(self) -> list:
+		return self._timestamps
+
+	@property
+	def states(self) -> numpy.ndarray:
+		# Risks x snapshots, without the columns allocated in advance
+		return self._states[:, :len(self._timestamps)]
+
+	@property
+	def latest_tested(self) -> numpy.ndarray:
+		# Forward fill of the states along the snapshots, the untested snapshots keeping the previous state tested
+		if self._latest_tested is None:
+			states = self.states
+			columns = numpy.where(states != UNTESTED, numpy.arange(states.shape[1]), 0)
+			numpy.maximum.accumulate(columns, axis=1, out=columns)
+			self._latest_tested = states[numpy.arange(states.shape[0])[:, None], columns]
+		return self._latest_tested
+
+	################################################################### SETTERS
+
+	@risk_uids.setter
+	def risk_uids(self, risk_uids:list) -> None:
+		self._risk_uids = list(risk_uids)
+		self._rows = {risk_uid: row for row, risk_uid in enumerate(self._risk_uids)}
+		self._timestamps = []
+		self._states = numpy.zeros((len(self._risk_uids), INITIAL_CAPACITY), dtype=numpy.int8)
+		self._latest_tested = None
+
+	################################################################### METHODS
+
+	def add_snapshot(self, timestamp) -> int:
+		# Column of the snapshot in the timeline, the snapshots of several tools at the same time sharing their column
+		timestamp = to_utc(timestamp)
+		column = bisect.bisect_left(self._timestamps, timestamp)
+		if column < len(self._timestamps) and self._timestamps[column] == timestamp:
+			return column
+		if len(self._timestamps) == self._states.shape[1]:
+			# Double the capacity, so that adding N snapshots copies the matrix O(log N) times
+			states = numpy.zeros((self._states.shape[0], self._states.shape[1] * 2), dtype=numpy.int8)
+			states[:, :self._states.shape[1]] = self._states
+			self._states = states
+		# A snapshot older than the last one shifts the next columns, the new column being untested
+		if column < len(self._timestamps):
+			self._states[:, column + 1:len(self._timestamps) + 1] = self._states[:, column:len(self._timestamps)].copy()
+			self._states[:, column] = UNTESTED
+		self._timestamps.insert(column, timestamp)
+		self._latest_tested = None
+		return column
+
+	def set_states(self, column:int, rows, state:int) -> None:
+		# rows: positions of the risks (list or array), or None for all the risks
+		if rows is None:
+			self._states[:, column] = state
+		else:
+			self._states[numpy.asarray(rows, dtype=numpy.intp), column] = state
+		self._latest_tested = None
+
+	def get_rows(self, risk_uids:list) -> numpy.ndarray:
+		return numpy.fromiter((self._rows[risk_uid] for risk_uid in risk_uids), dtype=numpy.intp, count=len(risk_uids))
+
+	def get_column(self, timestamp) -> int:
+		# Column of the last snapshot at or before a datetime, -1 before the first snapshot
+		return bisect.bisect_right(self._timestamps, to_utc(timestamp)) - 1
+
+	def get_history(self, risk_uid) -> numpy.ndarray:
+		# States of a risk in each snapshot, in chronological order
+		return self.states[self._rows[risk_uid]]
+
+	def get_states_at(self, timestamp, risk_uids:list=None) -> numpy.ndarray:
+		# State of the risks in their last snapshot tested at or before a datetime (UNTESTED if never tested), in the order of the UIDs given or of the rows
+		rows = self.get_rows(risk_uids) if risk_uids is not None else slice(None)
+		column = self.get_column(timestamp)
+		if column < 0:
+			return numpy.full(len(self._risk_uids) if risk_uids is None else len(risk_uids), UNTESTED, dtype=numpy.int8)
+		return self.latest_tested[rows, column]
+
+	def get_latest(self, risk_uids:list=None) -> numpy.ndarray:
+		# State of the risks in their last snapshot tested, whatever the tool of the last snapshot
+		if not self._timestamps:
+			return numpy.full(len(self._risk_uids) if risk_uids is None else len(risk_uids), UNTESTED, dtype=numpy.int8)
+		return self.get_states_at(self._timestamps[-1], risk_uids)
+
+	def count_latest(self, state:int, labels:numpy.ndarray, risk_uids:list=None) -> numpy.ndarray:
+		# Number of risks in a state in their last snapshot tested for each label (severity...), labels being given in the order of the UIDs or of the rows
+		# Example: count_latest(POSITIVE, [1, 3, 3, 2]) -> [0, 1, 0, 2] if the 3 last risks are positive
+		labels = numpy.asarray(labels, dtype=numpy.intp)
+		return numpy.bincount(labels[self.get_latest(risk_uids) == state], minlength=labels.max(initial=0) + 1)
+
+	def get_transitions(self, risk_uids:list=None) -> numpy.ndarray:
+		# Risks x snapshots, transition of each risk in each snapshot, computed for the whole history at once
+		# A risk positive again after being negative is a new positive, a risk negative after being positive is a new negative
+		rows = self.get_rows(risk_uids) if risk_uids is not None else slice(None)
+		current_states = self.states[rows]
+		latest_tested = self.latest_tested[rows]
+		# State of each risk in its last snapshot tested before each snapshot, shifted by one column
+		previous_states = numpy.zeros_like(latest_tested)
+		previous_states[:, 1:] = latest_tested[:, :-1]
+		transitions = numpy.full(current_states.shape, NO_TRANSITION, dtype=numpy.int8)
+		transitions[(current_states == POSITIVE) & (previous_states != POSITIVE)] = NEW_POSITIVE
+		transitions[(current_states == POSITIVE) & (previous_states == POSITIVE)] = STILL_POSITIVE
+		transitions[(current_states == UNTESTED) & (previous_states == POSITIVE)] = POSITIVE_NOT_RETESTED
+		transitions[(current_states == NEGATIVE) & (previous_states != NEGATIVE)] = NEW_NEGATIVE
+		transitions[(current_states == NEGATIVE) & (previous_states == NEGATIVE)] = STILL_NEGATIVE
+		transitions[(current_states == UNTESTED) & (previous_states == NEGATIVE)] = NEGATIVE_NOT_RETESTED
+		return transitions
+
+	def count_transitions(self, risk_uids:list=None) -> numpy.ndarray:
+		# Transitions x snapshots, number of risks of each transition in each snapshot
+		# Example: count_transitions()[STILL_POSITIVE] -> [0, 4, 3] if 4 risks positive in the first snapshot are positive in the second one...
+		transitions = self.get_transitions(risk_uids)
+		counts = numpy.zeros((len(TRANSITIONS), transitions.shape[1]), dtype=numpy.intp)
+		for transition in range(len(TRANSITIONS)):
+			counts[transition] = numpy.count_nonzero(transitions == transition, axis=0)
+		return counts
+
+	def get_delta(self, since_column:int, until_column:int=None, risk_uids:list=None) -> dict:
+		# Risks changed from their last snapshot tested at or before a column (-1 for none) to the last column, or to another one
+		# {"new": [False, True, ...], "regressed": [...], "fixed": [...], "not_retested": [...]} in the order of the UIDs given or of the rows
+		# new: positive, never tested before; regressed: positive, negative before; fixed: negative, positive before; not_retested: positive before, not tested by the next snapshots
+		until_column = len(self._timestamps) - 1 if until_column is None else until_column
+		rows = self.get_rows(risk_uids) if risk_uids is not None else slice(None)
+		latest_tested = self.latest_tested[rows]
+		before = latest_tested[:, since_column] if since_column >= 0 else numpy.full(latest_tested.shape[0], UNTESTED, dtype=numpy.int8)
+		after = latest_tested[:, until_column] if until_column >= 0 else numpy.full(latest_tested.shape[0], UNTESTED, dtype=numpy.int8)
+		retested = numpy.any(self.states[rows, since_column + 1:until_column + 1] != UNTESTED, axis=1)
+		return {
+			"new": (after == POSITIVE) & (before == UNTESTED),
+			"regressed": (after == POSITIVE) & (before == NEGATIVE),
+			"fixed": (after == NEGATIVE) & (before == POSITIVE),
+			"not_retested": (before == POSITIVE) & ~retested & (since_column < until_column)
+		}
@@ -1,23 +1,24 @@
 import argparse
+import concurrent.futures
 import copy
 import datetime
-import json
+import functools
+import importlib
+import lib.archives as archives
+import lib.cache as cache
 import lib.config as config
-import lib.docx_manager as docx_manager
-import lib.pingcastle as pingcastle
-import lib.purpleknight as purpleknight
+import lib.coverage as coverage
+import lib.dedup as dedup
+import lib.history as history
 import lib.logs as logging
+import lib.mapping as mapping
+import lib.parsers as parsers
 import locale
-import matplotlib
-import numpy
-import openpyxl
 import os
-import pandas
-import pprint
 import pytz
-import seaborn
+import re
 import shutil
-import xml
+import time
 
 ############################################################################### CONSTANTS
 
@@ -28,9 +29,29 @@ PATH_DIRECTORY = os.path.dirname(PATH_FILE)
 # FILES
 PATH_CONFIG = os.path.join(PATH_DIRECTORY, "config.txt")
 
+# LISTS OF EVIDENCE IN THE REPORTS OF EACH TOOL (RISK RULES OF PINGCASTLE, INDICATORS OF PURPLEKNIGHT)
+EVIDENCE_KEYS = {"pingcastle": "risk_rules", "purpleknight": "indicators"}
+
 # LOADED CONFIGURATION
 config = config.Config()
 
+# MODULES ONLY NEEDED TO BUILD THE REPORTS, IMPORTED BY import_report_modules()
+docx_manager = None
+matplotlib = None
+numpy = None
+pandas = None
+seaborn = None
+states = None
+
+# CACHE OF THE INPUT REPORTS
+reports_cache = cache.Cache()
+
+# SUMMARY OF THE LAST SORT OF THE INPUT FILES (DUPLICATES, COLLISIONS, PARSED AND CACHED FILES)
+run_summary = {}
+
+# DATABASE OF THE RISKS, LOADED ONCE AND SHARED BY THE PROCESSES BUILDING THE REPORTS
+shared_json_database = None
+
 ############################################################################### FILE SYSTEM
 
 #
@@ -208,46 +229,6 @@ def install_list_of_fonts_files(list_of_fonts_files:list) -> bool:
 	#
 	return True
 
-#
-# Convert formated data from XML to JSON
-#
-@logging.log_call
-def convert_xml_to_json(xml_file_path):
-	"""
-	Convert XML file to JSON.
-
-	Args:
-	xml_file_path (str): Path to the XML file.
-
-	Returns:
-	dict: JSON representation of the XML data.
-	"""
-	# Parse XML
-	tree = xml.etree.ElementTree.parse(xml_file_path)
-	root = tree.getroot()
-
-	# Convert XML to JSON
-	json_data = {}
-
-	# Convert XML tree to JSON recursively
-	def parse_element(element):
-		result = {}
-		for child in element:
-			if child:
-				if child.tag in result:
-					if isinstance(result[child.tag], list):
-						result[child.tag].append(parse_element(child))
-					else:
-						result[child.tag] = [result[child.tag], parse_element(child)]
-				else:
-					result[child.tag] = parse_element(child)
-			else:
-				result[child.tag] = child.text
-		return result
-
-	json_data[root.tag] = parse_element(root)
-	return json_data
-
 #
 # Install on the system the fonts from the template folder
 #
@@ -319,6 +300,14 @@ def load_config() -> None:
 	#
 	update_log_level()
 	#
+	# Check the timezone of the PurpleKnight workbooks before they are read by the processes extracting them
+	#
+	if not check_purpleknight_timezone():
+		#
+		# Exit the program, the snapshots would be placed at a wrong time in the history
+		#
+		exit()
+	#
 	# Install on the system the fonts from the template folder (if any)
 	#
 	install_template_fonts()
@@ -327,19 +316,16 @@ def load_config() -> None:
 # Get the data of risks from their PingCastle IDs
 #
 @logging.log_call
-def get_json_database() -> list:
+def get_json_database(force:bool=False) -> dict:
 	#
-	# File unifying the ID given by each tool for a same risk
+	# Load the compiled mapping of the risks, compiled again only when the JSON file has changed
+	# Example: ./assets/mapped risks/mapped_risks.json -> ./cache/mapped_risks.pickle
 	#
-	json_database_file = config.get("PATH_MAPPED_RISKS")
+	json_database = mapping.load(config.get("PATH_MAPPED_RISKS"), config.get("ENCODING_MAPPED_RISKS"), config.get("PATH_COMPILED_MAPPED_RISKS"), force)
 	#
-	# Open the file mapping the IDs of the referentials (PingCastle, ANSSI, ...)
+	# Return the JSON database (None if the mapping is invalid)
 	#
-	with open(json_database_file, 'r', encoding=config.get("ENCODING_MAPPED_RISKS")) as json_database_fd:
-		#
-		# Convert the JSON text in a JSON object
-		#
-		return json.load(json_database_fd)
+	return json_database
 
 #
 # Parse the arguments given to the program
@@ -352,66 +338,74 @@ def parse_arguments() -> None:
 	parser = argparse.ArgumentParser()
 	#
 	# Define the arguments that can be passed to the program
-	# 
-	parser.add_argument('-pc', '--pingcastle', type=str, default=f'{config.get("PATH_INPUT_PINGCASTLE")}/ad_hc_*.xml', help='Path to the PingCastle XML file.')
 	#
-	# Define the arguments that can be passed to the program
-	# 
-	parser.add_argument('-pk', '--purpleknight', type=str, default=f'{config.get("PATH_INPUT_PURPLEKNIGHT")}/Security_Assessment_Report_*.xlsx', help='Path to the PurpleKnight XLSX file.')
+	parser.add_argument('-j', '--jobs', type=int, default=None, help='Number of processes used to extract the input files (0 for one per processor). Overrides "JOBS" from the configuration file.')
+	parser.add_argument('-w', '--watch', action='store_true', help='Keep running and rebuild the reports each time new input files are added.')
+	parser.add_argument('-c', '--cache', type=str, choices=["info", "clear"], default=None, help='Print the content of the cache of the input reports ("info") or empty it ("clear"), then quit.')
+	parser.add_argument('--compile-mapping', action='store_true', help='Validate and compile the mapping of the risks again, even if it has not changed, then quit.')
+	parser.add_argument('-s', '--since', type=str, default=None, help='Build a compact report with only the risks changed since the last snapshot taken at or before this date ("2024-05-01" or "2024-05-01T14:00"), instead of the full report.')
 	#
 	# Get the arguments passed to the program
 	#
 	args = parser.parse_args()
 	#
-	# If the path to the PingCastle file has been passed to the program
+	# If the date of the snapshot to compare with is not a valid date
 	#
-	if hasattr(args, 'pingcastle') and args.pingcastle is not None:
+	if args.since and get_since_datetime(args.since) is None:
 		#
-		# Save the path to the PingCastle file
+		# Write the usage and quit the program
 		#
-		config.set("pingcastle_file_path", args.pingcastle) 
+		parser.error(f'invalid date for --since: "{args.since}" (expected "2024-05-01" or "2024-05-01T14:00")')
 	#
-	# Else, if the path to the PingCastle file has not been passed to the program
+	# If the number of processes has been passed to the program
 	#
-	else:
+	if args.jobs is not None:
 		#
-		# Try to request it from the user
+		# Replace the one of the configuration file
 		#
-		try:
-			config.set("pingcastle_file_path", pingcastle.request_pingcastle_file_path())
-		#
-		# If it fails
-		#
-		except KeyboardInterrupt:
-			#
-			# Quit the program
-			#
-			return
+		config.set("JOBS", str(args.jobs))
 	#
-	# If the path to the PurpleKnight file has been passed to the program
+	# Save if the program must keep watching the input files
 	#
-	if hasattr(args, 'purpleknight') and args.purpleknight is not None:
-		#
-		# Save the path to the PurpleKnight file
-		#
-		config.set("purpleknight_file_path", args.purpleknight) 
+	config.set("watch", "1" if args.watch else "")
 	#
-	# Else, if the path to the PurpleKnight file has not been passed to the program
+	# Save the command to run on the cache of the input reports (if any)
 	#
-	else:
-		#
-		# Try to request it from the user
-		#
-		try:
-			config.set("purpleknight_file_path", purpleknight.request_pingcastle_file_path())
+	config.set("cache_command", args.cache if args.cache else "")
+	#
+	# Save if the mapping of the risks must only be compiled
+	#
+	config.set("compile_mapping", "1" if args.compile_mapping else "")
+	#
+	# Save the date of the snapshot to compare with, if only the changes must be reported
+	#
+	config.set("since", args.since if args.since else "")
+
+#
+# Get the datetime until which the snapshots are taken as the reference of the delta report
+# Example: "2024-05-01" -> datetime(2024, 5, 1, 23, 59, 59, 999999), so that the snapshots of the day are included
+#
+@logging.log_call
+def get_since_datetime(since:str) -> datetime.datetime:
+	#
+	# Read the date, None if it is not valid
+	#
+	try:
+		since_datetime = datetime.datetime.fromisoformat(since)
+	except ValueError:
+		return None
+	#
+	# If only the day has been given
+	#
+	if re.fullmatch(r"\d{4}-\d{2}-\d{2}", since):
 		#
-		# If it fails
+		# Take the end of the day
 		#
-		except KeyboardInterrupt:
-			#
-			# Quit the program
-			#
-			return
+		since_datetime += datetime.timedelta(days=1, microseconds=-1)
+	#
+	# Return the datetime, local if no timezone has been given
+	#
+	return since_datetime
 
 #
 # Update the level of logs from which the logs should be printed
@@ -428,396 +422,967 @@ def update_log_level() -> None:
 		#
 		logging.log(f'Unable to update the log level to "{config.get("LOG_LEVEL")}". Default log level used.', "warning")
 
-############################################################################### INPUT FILES
-
 #
-# Get the list of files in the input folder
+# Check that the timezone of the PurpleKnight workbooks is known
 #
 @logging.log_call
-def get_input_files() -> list:
+def check_purpleknight_timezone() -> bool:
+	#
+	# Get the timezone from the configuration
+	# Example: "Europe/Berlin", or "local" for the timezone of this computer
+	#
+	timezone = config.get("PURPLEKNIGHT_TIMEZONE")
+	#
+	# If it is neither the timezone of this computer nor a timezone of the tz database
+	#
+	if timezone != "local" and timezone not in pytz.all_timezones_set:
+		#
+		# Write it in the console
+		#
+		logging.log(f'Unknown PurpleKnight timezone "{timezone}" (PURPLEKNIGHT_TIMEZONE). Use "local" or a name of the tz database, such as "Europe/Berlin". Exiting the program...', "error")
+		#
+		# Quit the function with a failure code
+		#
+		return False
 	#
-	# Return the list of files in the input folder
+	# Quit the function with a success code
 	#
-	return find_files(config.get("PATH_INPUTS"))
+	return True
+
+############################################################################### CACHE
 
 #
-# Filter the PingCastle files from a list of files
+# Load the cache of the reports already extracted from the input files
 #
 @logging.log_call
-def filter_pingcastle_files(files: list) -> list:
+def load_cache() -> None:
 	#
-	# Filter out the input files without a XML extension
+	# Load the cache file defined in the configuration
+	# Example: "./cache/input_reports.json"
 	#
-	return filter_files_by_extension(files, "xml")
+	reports_cache.load(config.get("PATH_CACHE"))
 
 #
-# Filter the PurpleKnight files from a list of files
+# Remove the entries of the deleted or outdated files and save the cache
 #
 @logging.log_call
-def filter_purpleknight_files(files: list) -> list:
+def save_cache() -> None:
 	#
-	# Filter out the input files without a XLSX extension
+	# Evict the entries of the input files that do not exist anymore
 	#
-	return filter_files_by_extension(files, "xlsx")
+	reports_cache.evict_stale()
+	#
+	# Write the cache on the disk
+	#
+	reports_cache.save()
 
 #
-# Get the datetime of the PingCastle report
+# Run the command passed to the program on the cache ("info" or "clear")
 #
 @logging.log_call
-def get_pingcastle_report_datetime(file_path:str) -> str:
+def run_cache_command(command:str) -> None:
 	#
-	# Get the content of the report
+	# If the content of the cache is requested
 	#
-	report = convert_xml_to_json(file_path)
+	if command == "info":
+		#
+		# Print the entries of the cache
+		#
+		reports_cache.print_entries()
 	#
-	# Return the datetime of the report
+	# Else, if the cache must be emptied
 	#
-	return report["HealthcheckData"]["GenerationDate"]
+	elif command == "clear":
+		#
+		# Remove all the entries and save the empty cache
+		#
+		reports_cache.clear()
+		reports_cache.save()
 
 #
-# Get the datetime of the PurpleKnight report
+# Get the options of the extraction of a format, which the cached reports must have been extracted with
 #
 @logging.log_call
-def get_purpleknight_report_datetime(file_path:str) -> str:
-	# Open the workbook
-	workbook = openpyxl.load_workbook(file_path)
-	
-	# Select the specified sheet
-	sheet = workbook["Assessment summary"]
-	
-	# Extract data from the specified column
-	dt = sheet["B3"].value
-
-	# Define the default timezone (UTC+2)
-	default_timezone = pytz.timezone("Europe/Berlin")
-
-	# Localize the datetime object to the specified timezone
-	localized_dt = default_timezone.localize(dt)
+def get_extract_options(tool:str, file_format:str) -> dict:
+	#
+	# If the reports list the objects affected by the risks (PingCastle XML reports, PurpleKnight workbooks)
+	#
+	if (tool, file_format) == ("pingcastle", "xml"):
+		#
+		# Return the number of objects kept for each risk
+		#
+		return {"evidence_top_k": int(config.get("EVIDENCE_TOP_K"))}
+	#
+	# If the reports also write their datetime without a timezone (PurpleKnight workbooks)
+	#
+	if (tool, file_format) == ("purpleknight", "xlsx"):
+		#
+		# Return the number of objects kept for each risk and the timezone of the datetime
+		#
+		return {"evidence_top_k": int(config.get("EVIDENCE_TOP_K")), "timezone": config.get("PURPLEKNIGHT_TIMEZONE")}
+	#
+	# Else, there is no option
+	#
+	return {}
 
-	# Convert to ISO 8601 format with the desired precision
-	iso_format = localized_dt.strftime("%Y-%m-%dT%H:%M:%S.%f%z")
+#
+# Get the content of the reports from the cache, and extract only the new or changed files
+#
+@logging.log_call
+def get_reports(file_paths:list, tool:str, file_format:str, executor:concurrent.futures.ProcessPoolExecutor=None) -> list:
+	#
+	# Reports found, indexed by the path of their file
+	#
+	reports = {}
+	#
+	# Files that are not in the cache yet
+	#
+	missing_file_paths = []
+	#
+	# Get the options of the extraction of this format
+	#
+	extract_options = get_extract_options(tool, file_format)
+	#
+	# Go through all the files
+	#
+	for file_path in file_paths:
+		#
+		# Look for the report in the cache
+		#
+		report = reports_cache.get(file_path)
+		#
+		# If the file is new, has changed since it was cached, or was extracted with other options
+		#
+		if report is None or report.get("options", {}) != extract_options:
+			#
+			# Extract it later with the other missing files
+			#
+			missing_file_paths.append(file_path)
+			#
+			# Go to the next file
+			#
+			continue
+		#
+		# The same content may have been cached under another path (renamed or copied file)
+		#
+		report["path"] = file_path
+		reports[file_path] = report
+		run_summary["cached"] += 1
+	#
+	# If all the files are in the cache
+	#
+	if not missing_file_paths:
+		#
+		# Return the reports without importing the parser of the tool
+		#
+		return [reports[file_path] for file_path in file_paths]
+	#
+	# Get the function extracting the reports of this format, importing the parser of the tool
+	#
+	extract_function = functools.partial(parsers.get_extract_function(tool, file_format), **extract_options)
+	#
+	# Go through the reports extracted from the missing files
+	#
+	for file_path, report in zip(missing_file_paths, extract_reports(missing_file_paths, extract_function, executor)):
+		#
+		# If the file could not be read (truncated file, file still being copied...)
+		#
+		if report is None:
+			#
+			# Skip it without caching it, so that it is read again once it has changed
+			#
+			run_summary["unreadable"].append(file_path)
+			continue
+		#
+		# Save the report in the cache for the next runs
+		#
+		if extract_options:
+			report["options"] = extract_options
+		reports_cache.set(file_path, report)
+		reports[file_path] = report
+		run_summary["parsed"] += 1
+	#
+	# Return the reports in the order of the files, without the unreadable ones
+	#
+	return [reports[file_path] for file_path in file_paths if file_path in reports]
 
-	# Format the timezone offset to include the colon
-	iso_format = iso_format[:-2] + ":" + iso_format[-2:]
+############################################################################### INPUT FILES
 
-	# Return the formated datetime
-	return iso_format
+#
+# Get the list of files in the input folder
+#
+@logging.log_call
+def get_input_files() -> list:
+	#
+	# Return the list of files in the input folder, with the files inside the archives
+	# Example: ["./input/ad_hc_contoso.local.xml", "./input/2023-05.zip::ad_hc_contoso.local.xml", ...]
+	#
+	return archives.expand_input_files(find_files(config.get("PATH_INPUTS")))
 
 #
-# Sort the PingCastle files by datetime
+# Get the number of processes used to extract the input files
 #
 @logging.log_call
-def sort_pingcastle_files_by_datetime(pingcastle_files:list) -> dict:
+def get_jobs() -> int:
 	#
-	# Create the sorted PingCastle files
+	# Get the number of processes from the configuration or the arguments
+	# Example: "4", or "0" for one process per processor
 	#
-	sorted_pingcastle_files = {}
+	try:
+		jobs = int(config.get("JOBS"))
 	#
-	# Go through all the PingCastle files
+	# If it is not a number
 	#
-	for path in pingcastle_files:
+	except (TypeError, ValueError):
+		#
+		# Write it in the console
 		#
-		# Index the PingCastle file with its datetime
+		logging.log(f'Invalid number of jobs "{config.get("JOBS")}". A single process is used.', "warning")
 		#
-		sorted_pingcastle_files[get_pingcastle_report_datetime(path)] = path
+		# Use a single process
+		#
+		return 1
 	#
-	# Return the sorted PingCastle files
+	# Return the number of processes, one per processor by default
 	#
-	return sorted_pingcastle_files
+	return jobs if jobs > 0 else (os.cpu_count() or 1)
 
 #
-# Sort the PurpleKnight files by datetime
+# Extract the content of an input file, None if it cannot be read
 #
 @logging.log_call
-def sort_purpleknight_files_by_datetime(purpleknight_files:list) -> dict:
+def extract_report(extract_function, file_path:str) -> dict:
 	#
-	# Create the sorted PingCastle files
+	# Try to extract the content of the file
 	#
-	sorted_purpleknight_files = {}
+	try:
+		return extract_function(file_path)
 	#
-	# Go through all the PingCastle files
+	# If the file cannot be read (truncated file, file still being copied...)
 	#
-	for path in purpleknight_files:
+	except Exception as e:
 		#
-		# Index the PingCastle file with its datetime
+		# Write it in the console
 		#
-		sorted_purpleknight_files[get_purpleknight_report_datetime(path)] = path
-	#
-	# Return the sorted PingCastle files
-	#
-	return sorted_purpleknight_files
+		logging.log(f'Unable to read the input file "{file_path}", skipped : {e}', "error")
+		#
+		# Quit the function without a report
+		#
+		return None
 
 #
-# Sort the list of input files by tool and datetime
+# Extract the content of a list of input files, in parallel when several processes are allowed
 #
 @logging.log_call
-def sort_input_files(input_files:list) -> dict:
+def extract_reports(file_paths:list, extract_function, executor:concurrent.futures.ProcessPoolExecutor=None) -> list:
 	#
-	# Create the sorted list
+	# Extract each file on its own, so that an unreadable file does not stop the extraction of the others
 	#
-	sorted_input_files = {
-		"pingcastle": sort_pingcastle_files_by_datetime(filter_pingcastle_files(input_files)),
-		"purpleknight": sort_purpleknight_files_by_datetime(filter_purpleknight_files(input_files))
-	}
+	extract_function = functools.partial(extract_report, extract_function)
 	#
-	# Return the sorted input files
+	# Limit the number of processes to the number of files
 	#
-	return sorted_input_files
+	jobs = min(get_jobs(), len(file_paths))
+	#
+	# If a single process is enough
+	#
+	if jobs <= 1:
+		#
+		# Extract the files one after the other in the current process
+		#
+		return [extract_function(file_path) for file_path in file_paths]
+	#
+	# Write it in the console
+	#
+	logging.log(f'Extracting {len(file_paths)} input files with {jobs} processes.', "info")
+	#
+	# If the processes of the program are already running (watch mode)
+	#
+	if executor is not None:
+		#
+		# Return the reports in the order of the files, whatever the order in which the processes end
+		#
+		return list(executor.map(extract_function, file_paths))
+	#
+	# Extract the files in a pool of processes, with the log level of the program
+	#
+	with concurrent.futures.ProcessPoolExecutor(max_workers=jobs, initializer=logging.update_log_level, initargs=(logging.LOG_LEVEL,)) as executor:
+		#
+		# Return the reports in the order of the files, whatever the order in which the processes end
+		#
+		return list(executor.map(extract_function, file_paths))
 
 #
-# Process the tools input files
+# Sort reports indexed by their datetime or their snapshot in chronological order
 #
 @logging.log_call
-def process_input_files(json_database, sorted_input_files:dict) -> dict:
+def sort_reports_by_datetime(reports:dict) -> dict:
 	#
-	# Process the JSON database with the PingCastle data
+	# Compare the datetimes of the reports as dates rather than as texts, as the tools use different formats
 	#
-	json_database = process_pingcastle_files(json_database, sorted_input_files["pingcastle"])
+	return dict(sorted(reports.items(), key=lambda item: datetime.datetime.fromisoformat(item[1]["datetime"])))
+
+#
+# Get the domain and the generation time (UTC, to the second) of the snapshot described by a report
+#
+@logging.log_call
+def get_snapshot_key(report:dict) -> tuple:
 	#
-	# Process the JSON database with the PurpleKnight data
+	# The XML and HTML versions of a same PingCastle report do not write the generation time in the same format
+	# Example: "2023-05-23T16:40:56.1234567+02:00" and "2023-05-23 14:40:56Z"
 	#
-	json_database = process_purpleknight_files(json_database, sorted_input_files["purpleknight"])
+	generation_time = datetime.datetime.fromisoformat(report["datetime"]).astimezone(datetime.timezone.utc).replace(microsecond=0)
 	#
-	# Return the processed database
+	# Return the snapshot key
 	#
-	return json_database
+	return (str(report["domain"]).lower(), generation_time)
 
-############################################################################### PING CASTLE
+#
+# Classify the input files by tool and format, from their content and not from their extension
+#
+@logging.log_call
+def classify_input_files(files: list) -> dict:
+	#
+	# Sniff the first bytes of the files, except the ones whose tool and format are already in the cache
+	#
+	return parsers.classify_files(files, reports_cache.get_format)
 
 #
-# Mark the risks found in the PingCastle file
+# Sort the PingCastle files by datetime
 #
 @logging.log_call
-def mark_risks_found(json_database:list, datetime:str, ids_of_risks_to_mark:list, key_of_list_of_ids:str) -> list:
+def sort_pingcastle_files_by_datetime(pingcastle_files:dict, executor:concurrent.futures.ProcessPoolExecutor=None) -> dict:
+	#
+	# Create the PingCastle snapshots, indexed by domain and generation time
+	#
+	snapshots = {}
+	#
+	# Get the content of all the PingCastle files, streamed once per new or changed file
+	#
+	reports = []
+	for file_format, file_paths in pingcastle_files.items():
+		reports += get_reports(file_paths, "pingcastle", file_format, executor)
 	#
-	# Go through all the risks in the JSON database
+	# Go through the PingCastle reports
 	#
-	for current_risk_index, current_risk in enumerate(json_database["risks"]):
-		# TEST MODE #
-		#current_risk["found"][datetime] = True
-		#continue
-		# TEST MODE #
+	for report in reports:
 		#
-		# If the current risk does not have a PingCastle or PurpleKnight ID
+		# If the datetime of the report is unknown
 		#
-		if key_of_list_of_ids not in current_risk["frameworks"].keys():
+		if report["datetime"] is None:
 			#
-			# Mark the risk as found in the PingCastle file
-			#
-			current_risk["found"][datetime] = None
-			#
-			# Go to the next risk
+			# Go to the next PingCastle file
 			#
 			continue
 		#
-		# Mark the risk as found in the PingCastle file
+		# Get the snapshot described by the report
 		#
-		json_database["risks"][current_risk_index]["found"][datetime] = False
+		snapshot = get_snapshot_key(report)
 		#
-		# Go through all the PingCastle or PurpleKnight IDs of the current risk
+		# If another file of the same format describes the same snapshot with a different content
 		#
-		for current_pingcastle_id in current_risk["frameworks"][key_of_list_of_ids]:
-			#
-			# If the current PingCastle ID is not in the list of found IDs
-			#
-			if current_pingcastle_id not in ids_of_risks_to_mark:
-				#
-				# Go to the next PingCastle ID
-				#
-				continue
+		if snapshot in snapshots and snapshots[snapshot]["format"] == report["format"]:
 			#
-			# Mark the risk as found in the PingCastle file
+			# Keep the first file, instead of letting the last one overwrite it
 			#
-			json_database["risks"][current_risk_index]["found"][datetime] = True
+			record_collision(report["path"], snapshots[snapshot]["path"])
+			continue
+		#
+		# If the XML version of the same snapshot has already been found
+		#
+		if snapshot in snapshots and snapshots[snapshot]["format"] == "xml":
 			#
-			# Go to the next risk
+			# Keep the XML version, which is more detailed than the HTML one
 			#
-			break
+			continue
+		#
+		# Index the PingCastle report with its snapshot
+		#
+		snapshots[snapshot] = report
 	#
-	# Return the list of unified risks
+	# Return the PingCastle files in chronological order, still indexed by their snapshot since several domains can be audited at the same time
 	#
-	return json_database
+	return sort_reports_by_datetime(snapshots)
 
 #
-# Process the JSON database with the PingCastle input files
+# Sort the PurpleKnight files by datetime
 #
 @logging.log_call
-def process_pingcastle_files(json_database:dict, sorted_pingcastle_files:dict) -> dict:
+def sort_purpleknight_files_by_datetime(purpleknight_files:list, executor:concurrent.futures.ProcessPoolExecutor=None) -> dict:
+	#
+	# Create the sorted PingCastle files
 	#
-	# Go through all the PingCastle sorted files
+	sorted_purpleknight_files = {}
+	#
+	# Go through the content of all the PurpleKnight files, opened once per new or changed file
 	#
-	for datetime, file_path in sorted_pingcastle_files.items():
+	for report in get_reports(purpleknight_files, "purpleknight", "xlsx", executor):
+		#
+		# If the datetime of the report is unknown
+		#
+		if report["datetime"] is None:
+			#
+			# Go to the next PurpleKnight file
+			#
+			continue
+		#
+		# Get the snapshot described by the report, several domains being possibly audited at the same time
+		#
+		snapshot = get_snapshot_key(report)
+		#
+		# If another file with a different content describes the same domain at the same time
+		#
+		if snapshot in sorted_purpleknight_files:
+			#
+			# Keep the first file, instead of letting the last one overwrite it
+			#
+			record_collision(report["path"], sorted_purpleknight_files[snapshot]["path"])
+			continue
 		#
-		# Process the current PingCastle file
+		# Index the PurpleKnight report with its snapshot
 		#
-		json_database = process_pingcastle_file(json_database, datetime, file_path)
+		sorted_purpleknight_files[snapshot] = report
 	#
-	# Return the processed database
+	# Return the PurpleKnight files in chronological order
 	#
-	return json_database
+	return sort_reports_by_datetime(sorted_purpleknight_files)
 
 #
-# Process the JSON database with the PingCastle data
+# Sort the ANSSI files by datetime
 #
 @logging.log_call
-def process_pingcastle_file(json_database:list, datetime:str, file_path:str) -> list:
+def sort_anssi_files_by_datetime(anssi_files:list, executor:concurrent.futures.ProcessPoolExecutor=None) -> dict:
 	#
-	# Get the ID of all the risks listed in the PingCastle file
+	# Create the sorted ANSSI files
 	#
-	risk_ids_from_pingcastle_file = pingcastle.get_risk_ids_from_pingcastle_file(file_path)
+	sorted_anssi_files = {}
 	#
-	# Get the unified ID for all the PingCastle risks ID
+	# Go through the content of all the ANSSI exports, streamed once per new or changed file
 	#
-	json_database = mark_risks_found(json_database, datetime, risk_ids_from_pingcastle_file, "pingcastle")
+	for report in get_reports(anssi_files, "anssi", "csv", executor):
+		#
+		# If the export could not be read (no status column)
+		#
+		if report["datetime"] is None:
+			#
+			# Go to the next ANSSI file
+			#
+			continue
+		#
+		# Get the snapshot described by the report, several domains being possibly audited at the same time
+		#
+		snapshot = get_snapshot_key(report)
+		#
+		# If another file with a different content describes the same domain at the same time
+		#
+		if snapshot in sorted_anssi_files:
+			#
+			# Keep the first file, instead of letting the last one overwrite it
+			#
+			record_collision(report["path"], sorted_anssi_files[snapshot]["path"])
+			continue
+		#
+		# Index the ANSSI report with its snapshot
+		#
+		sorted_anssi_files[snapshot] = report
 	#
-	# Return the filtered JSON database
+	# Return the ANSSI files in chronological order
 	#
-	return json_database
+	return sort_reports_by_datetime(sorted_anssi_files)
 
-############################################################################### PURPLE KNIGHT
+#
+# Start a new summary of the input files
+#
+@logging.log_call
+def reset_run_summary(input_files:list) -> None:
+	#
+	# Reset the counters and the lists of skipped files
+	#
+	run_summary.clear()
+	run_summary.update({
+		"input_files": len(input_files),
+		"duplicates": {},	# {"./input/copy/ad_hc_contoso.local.xml": "./input/ad_hc_contoso.local.xml", ...}
+		"collisions": {},	# {"./input/ad_hc_contoso.local_2.xml": "./input/ad_hc_contoso.local.xml", ...}
+		"unreadable": [],	# ["./input/ad_hc_contoso.local_3.xml", ...]
+		"parsed": 0,
+		"cached": 0
+	})
 
 #
-# Process the JSON database with the PurpleKnight input files
+# Remove the copies of the same input files (renamed files, same files in several folders or archives)
 #
 @logging.log_call
-def process_purpleknight_files(json_database:dict, sorted_purpleknight_files:dict) -> dict:
+def deduplicate_input_files(input_files:list) -> list:
 	#
-	# Go through all the PurpleKnight sorted files
+	# Find the files with the same content, comparing their sizes and their first bytes before hashing them, and reusing the hashes of the cache
 	#
-	for datetime, file_path in sorted_purpleknight_files.items():
+	duplicates = dedup.find_duplicates(input_files, reports_cache.get_hash)
+	#
+	# Go through the duplicates
+	#
+	for duplicate_path, original_path in sorted(duplicates.items()):
 		#
-		# Process the current PurpleKnight file
+		# Write it in the console
 		#
-		json_database = process_purpleknight_file(json_database, datetime, file_path)
+		logging.log(f'Input file "{duplicate_path}" skipped, same content as "{original_path}".', "debug")
 	#
-	# Return the processed database
+	# Keep them in the summary
 	#
-	return json_database
+	run_summary["duplicates"].update(duplicates)
+	#
+	# Return the input files without the duplicates
+	#
+	return [file_path for file_path in input_files if file_path not in duplicates]
 
 #
-# Process the JSON database with the PurpleKnight data
+# Keep a file describing the same snapshot as another one, with a different content, out of the timeline
 #
 @logging.log_call
-def process_purpleknight_file(json_database:list, datetime:str, file_path:str) -> list:
+def record_collision(file_path:str, kept_file_path:str) -> None:
 	#
-	# Get the ID of all the risks listed in the PurpleKnight file
+	# Write it in the console
 	#
-	risk_ids_from_purpleknight_file = purpleknight.get_risk_ids_from_purpleknight_file(file_path)
+	logging.log(f'Input file "{file_path}" skipped, same domain and generation time as "{kept_file_path}" but a different content.', "warning")
 	#
-	# Get the unified ID for all the PurpleKnight risks ID
+	# Keep it in the summary
 	#
-	json_database = mark_risks_found(json_database, datetime, risk_ids_from_purpleknight_file, "purpleknight")
+	run_summary["collisions"][file_path] = kept_file_path
+
+#
+# Remove the PingCastle XML files describing the same snapshot as a previous file, before parsing them
+#
+@logging.log_call
+def remove_colliding_pingcastle_files(pingcastle_files:dict) -> dict:
 	#
-	# Return the filtered JSON database
+	# Create the list of files to parse, and the snapshots already found
 	#
-	return json_database
-
-############################################################################### CHARTS
-
-def create_stacked_bar_chart(risks_data) -> None:
-
-	datetimes = list(risks_data[0]["found"].keys())
+	kept_files = []
+	snapshots = {}
+	#
+	# Go through the PingCastle XML files, in the order of their paths
+	#
+	for file_path in sorted(pingcastle_files["xml"]):
+		#
+		# Read the domain and the generation time at the top of the XML reports, without parsing them
+		#
+		snapshot = dedup.sniff_pingcastle_xml_snapshot(file_path)
+		#
+		# If another XML file describes the same snapshot
+		#
+		if snapshot is not None and snapshot in snapshots:
+			#
+			# Skip this file
+			#
+			record_collision(file_path, snapshots[snapshot])
+			continue
+		#
+		# Keep the file
+		#
+		if snapshot is not None:
+			snapshots[snapshot] = file_path
+		kept_files.append(file_path)
+	#
+	# Return the files to parse
+	#
+	return dict(pingcastle_files, xml=kept_files)
 
-	# Create a DataFrame from the input data
-	data = {
-		"Datetime": datetimes,
-		"New positive": [0] * len(datetimes),
-		"Positive, not retested": [0] * len(datetimes),
-		"Still positive": [0] * len(datetimes),
-		"Still negative": [0] * len(datetimes),
-		"Negative, not retested": [0] * len(datetimes),
-		"New negative": [0] * len(datetimes)
+#
+# Write the summary of the input files in the console
+#
+@logging.log_call
+def log_run_summary() -> None:
+	#
+	# Write the counters
+	#
+	logging.log(f'{run_summary["input_files"]} input files found: {run_summary["parsed"]} parsed, {run_summary["cached"]} read from the cache, {len(run_summary["duplicates"])} duplicates, {len(run_summary["collisions"])} collisions and {len(run_summary["unreadable"])} unreadable files skipped.', "info")
+	#
+	# Write the skipped files
+	#
+	for duplicate_path, original_path in sorted(run_summary["duplicates"].items()):
+		logging.log(f'Duplicate: "{duplicate_path}" -> "{original_path}"', "info")
+	for file_path, kept_file_path in sorted(run_summary["collisions"].items()):
+		logging.log(f'Collision: "{file_path}" -> "{kept_file_path}"', "info")
+	for file_path in sorted(run_summary["unreadable"]):
+		logging.log(f'Unreadable: "{file_path}"', "info")
+
+#
+# Sort the list of input files by tool and datetime
+#
+@logging.log_call
+def sort_input_files(input_files:list, executor:concurrent.futures.ProcessPoolExecutor=None) -> dict:
+	#
+	# Start a new summary of the input files
+	#
+	reset_run_summary(input_files)
+	#
+	# Remove the copies of the same files, before parsing anything
+	#
+	input_files = deduplicate_input_files(input_files)
+	#
+	# Recognize the tool and the format of each file
+	#
+	classified_input_files = classify_input_files(input_files)
+	#
+	# Create the sorted list, without the PingCastle XML files colliding with another snapshot
+	#
+	sorted_input_files = {
+		"pingcastle": sort_pingcastle_files_by_datetime(remove_colliding_pingcastle_files(classified_input_files["pingcastle"]), executor),
+		"purpleknight": sort_purpleknight_files_by_datetime(classified_input_files["purpleknight"]["xlsx"], executor),
+		"anssi": sort_anssi_files_by_datetime(classified_input_files["anssi"]["csv"], executor)
 	}
+	#
+	# Close the archives opened to read their members, now that all the input files are read
+	#
+	archives.close_archives()
+	#
+	# Return the sorted input files
+	#
+	return sorted_input_files
+
+#
+# Group the sorted input files by the domain they audit
+#
+@logging.log_call
+def group_input_files_by_domain(sorted_input_files:dict) -> dict:
+	#
+	# Create the groups of input files, indexed by domain
+	# Example: {"contoso.local": {"pingcastle": {...}, "purpleknight": {...}}, ...}
+	#
+	input_files_by_domain = {}
+	#
+	# Create the group of input files without a domain
+	#
+	input_files_without_domain = {tool: {} for tool in sorted_input_files.keys()}
+	#
+	# Go through the sorted input files of all the tools, indexed by their datetime once grouped by domain
+	#
+	for tool, sorted_reports in sorted_input_files.items():
+		for report in sorted_reports.values():
+			report_datetime = report["datetime"]
+			#
+			# If the domain of the report is unknown
+			#
+			if not report["domain"]:
+				#
+				# Keep it apart
+				#
+				input_files_without_domain[tool][report_datetime] = report
+				#
+				# Go to the next report
+				#
+				continue
+			#
+			# Add the report to the group of its domain
+			#
+			domain = report["domain"].lower()
+			input_files_by_domain.setdefault(domain, {tool: {} for tool in sorted_input_files.keys()})
+			input_files_by_domain[domain][tool][report_datetime] = report
+	#
+	# If some reports do not have a domain
+	#
+	if any(input_files_without_domain.values()):
+		#
+		# If all the other reports audit the same domain
+		#
+		if len(input_files_by_domain) == 1:
+			#
+			# Add the reports without a domain to this domain
+			#
+			for domain_input_files in input_files_by_domain.values():
+				for tool, sorted_reports in input_files_without_domain.items():
+					domain_input_files[tool] = sort_reports_by_datetime({**domain_input_files[tool], **sorted_reports})
+		#
+		# Else, if the domain of these reports cannot be guessed
+		#
+		else:
+			#
+			# Write it in the console
+			#
+			logging.log(f'The domain of some input files is unknown. They are gathered in a report for the domain "unknown".', "warning")
+			#
+			# Keep them in their own group
+			#
+			input_files_by_domain["unknown"] = input_files_without_domain
+	#
+	# Return the groups of input files, in the alphabetical order of the domains
+	#
+	return dict(sorted(input_files_by_domain.items()))
 
-	previous_datetime = None
+############################################################################### HISTORY
 
-	for risk_data in risks_data:
-		for index, datetime in enumerate(risk_data["found"]):
-			if index == 0:
-				if (risk_data["found"][datetime] == True):
-					data["New positive"][index] += 1
-				elif (risk_data["found"][datetime] == False):
-					data["New negative"][index] -= 1
-			else:
+#
+# Get the state of the risks tested by a tool in one of its reports
+# Example: [(12, 1), (57, -1), ...] -> risk 12 found, risk 57 tested but not found
+#
+@logging.log_call
+def get_observations(json_database:dict, tool:str, risk_ids:list, untested_ids:list=()) -> list:
+	#
+	# Get the risks indexed with the IDs of the tool
+	#
+	framework_index = json_database["index"].get(tool, {"ids": {}, "names": {}, "aliases": {}, "risks": []})
+	#
+	# Get the positions of the risks found with the IDs of the report, once each
+	#
+	found_risk_indexes = {current_risk_index for current_id in set(risk_ids) for current_risk_index in mapping.get_risk_indexes(framework_index, tool, current_id)}
+	#
+	# Get the positions of the risks whose checks have not been run (ANSSI checks without a status), left out of the snapshot
+	#
+	untested_risk_indexes = {current_risk_index for current_id in set(untested_ids) for current_risk_index in mapping.get_risk_indexes(framework_index, tool, current_id)} - found_risk_indexes
+	#
+	# Return the state of each risk with an ID of the tool
+	#
+	return [(json_database["risks"][current_risk_index]["uid"], states.POSITIVE if current_risk_index in found_risk_indexes else states.NEGATIVE) for current_risk_index in framework_index["risks"] if current_risk_index not in untested_risk_indexes]
+
+#
+# Record in the history of the audits the snapshots not recorded yet, or recorded with a previous mapping of the risks
+#
+@logging.log_call
+def record_snapshots(json_database:dict, input_files_by_domain:dict) -> None:
+	#
+	# Import the module of the states of the risks, without the modules building the reports (DOCX and charts)
+	#
+	global states
+	states = importlib.import_module("lib.states")
+	#
+	# Open the history of the audits
+	# Example: "./cache/history.sqlite3"
+	#
+	history_store = history.History(config.get("PATH_HISTORY"))
+	#
+	# Count the new snapshots
+	#
+	recorded_snapshots = 0
+	#
+	# Go through the reports of each domain
+	#
+	for domain, domain_input_files in input_files_by_domain.items():
+		for tool, sorted_reports in domain_input_files.items():
+			for report in sorted_reports.values():
 				#
-				if risk_data["found"][datetime] == True:
-					#
-					if len([value for value in list(risk_data["found"].values())[:index] if value != None]) == 0:
-						#
-						data["New positive"][index] += 1
-					#
-					elif risk_data["found"][previous_datetime] == True:
-						#
-						data["Still positive"][index] += 1
+				# If the snapshot is already recorded, with the same mapping of the risks
 				#
-				elif risk_data["found"][datetime] == False:
+				if history_store.has_snapshot(config.get("COMPANY_NAME"), domain, report, json_database["hash"]):
 					#
-					if len([value for value in list(risk_data["found"].values())[:index] if value != None]) == 0:
-						#
-						data["New negative"][index] -= 1
+					# Go to the next report
 					#
-					elif risk_data["found"][previous_datetime] == False:
-						#
-						data["Still negative"][index] += 1
+					continue
 				#
-				elif risk_data["found"][datetime] == None:
-					#
-					if risk_data["found"][previous_datetime] == True:
-						#
-						data["Positive, not retested"][index] += 1
-					#
-					elif risk_data["found"][previous_datetime] == False:
-						#
-						data["Negative, not retested"][index] -= 1
+				# Record the states of the risks tested by the tool and the evidence of the report (risk rules of PingCastle, indicators of PurpleKnight)
+				#
+				history_store.add_snapshot(config.get("COMPANY_NAME"), domain, report, json_database["hash"], get_observations(json_database, tool, report["risk_ids"], report.get("untested_ids", [])), report.get(EVIDENCE_KEYS.get(tool), []))
+				recorded_snapshots += 1
+	#
+	# Close the history of the audits, the processes building the reports opening their own connection
+	#
+	history_store.close()
+	#
+	# Write it in the console
+	#
+	logging.log(f'{recorded_snapshots} new snapshots recorded in the history of the audits at "{config.get("PATH_HISTORY")}".', "info")
+
+#
+# Add the evidence of a report (risk rules of PingCastle, indicators of PurpleKnight) to the risks of the JSON database
+#
+@logging.log_call
+def add_evidence(json_database:dict, key_of_list_of_ids:str, evidence_records:list) -> dict:
+	#
+	# Get the risks indexed with the IDs of the tool
+	#
+	framework_index = json_database["index"].get(key_of_list_of_ids, {"ids": {}, "names": {}, "aliases": {}, "risks": []})
+	#
+	# Remove the evidence of the previous reports from the risks with IDs of this tool
+	# Example: {"pingcastle": [{"risk_id": "A-Krbtgt", "points": 50, "rationale": "...", "details": [...], "details_count": 1}], "purpleknight": [...]}
+	#
+	for current_risk_index in framework_index["risks"]:
+		json_database["risks"][current_risk_index].setdefault("evidence", {})[key_of_list_of_ids] = []
+	#
+	# Go through the evidence of the report
+	#
+	for evidence_record in evidence_records:
+		#
+		# Add it to the risks with this ID
+		#
+		for current_risk_index in mapping.get_risk_indexes(framework_index, key_of_list_of_ids, evidence_record["risk_id"]):
+			json_database["risks"][current_risk_index]["evidence"][key_of_list_of_ids].append(evidence_record)
+	#
+	# Return the JSON database
+	#
+	return json_database
+
+#
+# Mark the risks found in a snapshot
+#
+@logging.log_call
+def mark_risks_found(json_database:dict, datetime:str, observations:list) -> dict:
+	#
+	# Add the snapshot to the timeline of the states of the risks, all the risks being untested until they are observed
+	# The snapshots of several tools generated at the same time share their column
+	#
+	column = json_database["states"].add_snapshot(datetime)
+	# TEST MODE #
+	#json_database["states"].set_states(column, None, states.POSITIVE)
+	#return json_database
+	# TEST MODE #
+	#
+	# Mark the risks tested by the tool as found or not found
+	#
+	for state in [states.NEGATIVE, states.POSITIVE]:
+		json_database["states"].set_states(column, json_database["states"].get_rows([risk_uid for risk_uid, observed_state in observations if observed_state == state]), state)
+	#
+	# Return the list of unified risks
+	#
+	return json_database
+
+#
+# Process the snapshots of a domain recorded in the history of the audits, including the ones whose input files have been archived
+#
+@logging.log_call
+def process_input_files(json_database:dict, domain:str) -> dict:
+	#
+	# Create the timeline of the states of the risks in each snapshot, its rows following the order of the risks
+	#
+	json_database["states"] = states.StateMatrix([risk["uid"] for risk in json_database["risks"]])
+	json_database["domain"] = domain
+	#
+	# Read the snapshots of the domain and the states of the risks observed in each of them
+	#
+	history_store = history.History(config.get("PATH_HISTORY"))
+	snapshots = history_store.get_snapshots(config.get("COMPANY_NAME"), domain)
+	observations = history_store.get_observations(config.get("COMPANY_NAME"), domain)
+	#
+	# Go through the snapshots of all the tools in chronological order (UTC)
+	#
+	last_snapshots = {}
+	for snapshot in snapshots:
+		json_database = mark_risks_found(json_database, snapshot["timestamp"], observations.get(snapshot["id"], []))
+		last_snapshots[snapshot["tool"]] = snapshot
+	#
+	# Keep the evidence of the last snapshot of each tool (rationale, points, score, affected objects...)
+	#
+	for tool, snapshot in last_snapshots.items():
+		if tool in EVIDENCE_KEYS:
+			json_database = add_evidence(json_database, tool, history_store.get_evidence(snapshot["id"]))
+	#
+	# Close the history of the audits
+	#
+	history_store.close()
+	#
+	# Return the processed database
+	#
+	return json_database
+
+############################################################################### COVERAGE
+
+#
+# Write which IDs reported by the tools are missing from the mapping of the risks, and which mapped IDs are never reported
+#
+@logging.log_call
+def export_mapping_coverage(json_database:dict) -> None:
+	#
+	# Read the IDs reported in all the snapshots recorded in the history of the audits, including the snapshots of the archived input files
+	#
+	history_store = history.History(config.get("PATH_HISTORY"))
+	reported_ids = history_store.get_reported_ids(config.get("COMPANY_NAME"))
+	history_store.close()
+	#
+	# Compare the IDs of all the snapshots, of all the domains, with the IDs indexed in the mapping, for every tool
+	#
+	mapping_coverage = coverage.compute_coverage(json_database["index"], {tool: reported_ids.get(tool, []) for tool in parsers.PARSERS})
+	#
+	# Save it in a JSON file
+	# Example: "./output/coverage.json"
+	#
+	if not coverage.save_coverage(mapping_coverage, config.get("PATH_OUTPUT_COVERAGE")):
+		return
+	#
+	# Write the number of unmapped IDs of each tool in the console
+	#
+	for tool, tool_coverage in mapping_coverage["tools"].items():
+		#
+		# If the tool reported IDs that no risk is mapped to
+		#
+		if tool_coverage["unmapped_ids"]:
+			#
+			# Write it in the console, since these findings do not appear in the reports
 			#
-			previous_datetime = datetime
+			logging.log(f'{len(tool_coverage["unmapped_ids"])} IDs reported by {tool} are not mapped to any risk (see "{config.get("PATH_OUTPUT_COVERAGE")}").', "warning")
 
-	data = pandas.DataFrame(data)
+############################################################################### CHARTS
 
-	# Melt the DataFrame to long format for seaborn
-	data_melted = pandas.melt(data, id_vars='Datetime', var_name='Category', value_name='Value')
-	
-	#print(data_melted)
-
-	# Set up the matplotlib figure
-	matplotlib.pyplot.figure(figsize=(12, 8))
-
-	palette = {
-		"New positive": "blue",
-		"Positive, not retested": "red",
-		"Still positive": "yellow",
-		"Still negative": "green",
-		"Negative, not retested": "purple",
-		"New negative": "orange"
+#
+# Create and export a stacked bar chart with the transitions of the risks in each snapshot
+#
+@logging.log_call
+def create_history_chart(state_matrix, risk_uids:list, export_path:str) -> None:
+	#
+	# Legend and color of each transition, the positive risks being stacked above the axis and the negative ones below
+	#
+	transitions_style = {
+		states.NEW_POSITIVE: {"legend": "Nouveaux risques détectés", "color": "#D05252", "sign": 1},
+		states.STILL_POSITIVE: {"legend": "Risques toujours détectés", "color": "#E08C8C", "sign": 1},
+		states.POSITIVE_NOT_RETESTED: {"legend": "Risques détectés, non testés à nouveau", "color": "#F0C6C6", "sign": 1},
+		states.NEW_NEGATIVE: {"legend": "Nouveaux risques non détectés", "color": "#60AD5E", "sign": -1},
+		states.STILL_NEGATIVE: {"legend": "Risques toujours non détectés", "color": "#96C995", "sign": -1},
+		states.NEGATIVE_NOT_RETESTED: {"legend": "Risques non détectés, non testés à nouveau", "color": "#CBE4CA", "sign": -1}
 	}
-	
-	# Create the bar plot
-	ax = seaborn.barplot(x='Datetime', y='Value', hue='Category', data=data_melted, palette=palette, dodge=False)
-	
-	# Set the title and labels
-	ax.set_title(None)
-	ax.set_xlabel(None)
-	ax.set_ylabel(None)
-	
-	# Rotate x-tick labels for better readability
-	matplotlib.pyplot.xticks(rotation=45)
-	
-	# Show the plot
+	#
+	# Count the transitions of all the risks in all the snapshots at once
+	# Example: counts[states.STILL_POSITIVE] -> [0, 4, 3]
+	#
+	counts = state_matrix.count_transitions(risk_uids)
+	snapshots = numpy.arange(counts.shape[1])
+	#
+	# Font
+	#
+	seaborn.set(font=config.get("FONT_NAME"))
+	seaborn.set_style("white")
+	#
+	# Plot
+	#
+	matplotlib.pyplot.figure(figsize=(12, 8), facecolor="white")
+	#
+	# Stack the bars of each snapshot from the axis, upwards for the positive risks and downwards for the negative ones
+	#
+	bottoms = {1: numpy.zeros(len(snapshots)), -1: numpy.zeros(len(snapshots))}
+	for transition, style in transitions_style.items():
+		values = style["sign"] * counts[transition]
+		matplotlib.pyplot.bar(snapshots, values, bottom=bottoms[style["sign"]], color=style["color"], label=style["legend"], width=0.8)
+		bottoms[style["sign"]] += values
+	#
+	# Label the snapshots with their date, skipping some labels when there are too many snapshots to read them
+	#
+	step = max(1, -(-len(snapshots) // 12))
+	dates = [timestamp.astimezone().strftime("%d/%m/%Y") for timestamp in state_matrix.timestamps]
+	matplotlib.pyplot.xticks(snapshots[::step], dates[::step], rotation=45, size=config.get("FONT_SIZE"), color=config.get("CHART_LEGEND_COLOR"))
+	matplotlib.pyplot.yticks([])
+	matplotlib.pyplot.axhline(0, color=config.get("CHART_LEGEND_COLOR"), linewidth=0.5)
+	matplotlib.pyplot.xlabel(None)
+	matplotlib.pyplot.ylabel(None)
+	matplotlib.pyplot.title(None)
+	#
+	# Place the legend under the chart
+	#
+	legend = matplotlib.pyplot.legend(frameon=False, fontsize=config.get("FONT_SIZE"), loc="upper center", bbox_to_anchor=(0.5, -0.15), ncol=2)
+	for text in legend.get_texts():
+		text.set_color(config.get("CHART_LEGEND_COLOR"))
+	#
+	# Remove the grid from the chart
+	#
+	seaborn.despine(left=True)
 	matplotlib.pyplot.tight_layout()
-	#matplotlib.pyplot.show()
-	#exit()
-
 	#
 	# Export the chart
 	#
-	#matplotlib.pyplot.savefig(chart_data["export"]["path"], format=chart_data["export"]["format"], transparent=chart_data["export"]["keep_transparency"])
-
+	matplotlib.pyplot.savefig(export_path, format="tiff", transparent=True)
+	matplotlib.pyplot.close()
 
-def export_risk_history_graph(risk_data):
+def export_risk_history_graph(risk_data, state_matrix, risk_history):
 
-	#
-	dates = [datetime.datetime.fromisoformat(str_datetime).strftime("%d %B %Y") for str_datetime in risk_data["found"].keys()]
-	values = list(risk_data["found"].values())
+	# States of the risk read from the history of the audits, placed in the snapshots of all the tools
+	dates = [timestamp.astimezone().strftime("%d %B %Y") for timestamp in state_matrix.timestamps]
+	values = [states.UNTESTED] * len(dates)
+	for timestamp, state in risk_history:
+		values[state_matrix.get_column(timestamp)] = state
 
 	# Create a DataFrame from the input data
 	data = pandas.DataFrame({'Datetime': dates, 'Still positive': values})
@@ -839,11 +1404,11 @@ def export_risk_history_graph(risk_data):
 	
 	# Change marker colors
 	for date, value in zip(dates, values):
-		if value == None:
+		if value == states.UNTESTED:
 			continue
-		elif value == True:
+		elif value == states.POSITIVE:
 			ax.plot(date, 1, 'o', color='#D05252')
-		elif value == False:
+		elif value == states.NEGATIVE:
 			ax.plot(date, 1, 'o', color='#60AD5E')
 
 	#matplotlib.pyplot.xticks(rotation=90)
@@ -1113,59 +1678,24 @@ def create_line_chart(chart_data) -> None:
 @logging.log_call
 def order_risks_by_severity(json_database):
 	#
-	# Create a copy of the json database
+	# Create a shallow copy of the json database, sharing the risks instead of copying their history
 	#
-	ordered_json_database = copy.deepcopy(json_database)
+	ordered_json_database = dict(json_database)
 	#
-	# Delete the list of risks from the copied database
+	# List the risks severity by severity, each severity keeping the risks in their original order
+	# Example: {1: [0, 4, ...], 2: [...], ...} -> [risk 0, risk 4, ...]
 	#
-	ordered_json_database["risks"] = []
+	ordered_json_database["risks"] = [json_database["risks"][risk_index] for severity in sorted(json_database["severities"]) for risk_index in json_database["severities"][severity]]
 	#
-	# Go through the severities from 1 to 5
+	# Drop the index and the buckets of the compiled mapping, which point to the risks by their position in the original list
 	#
-	for current_severity in range(1, 10):
-		#
-		# Go through all the risks in the json database
-		#
-		for current_risk in json_database["risks"]:
-			#
-			# If the current risk does not have a severity
-			#
-			if "severity" not in current_risk.keys():
-				#
-				# Log the error
-				#
-				logging.log(f'The risk \"{current_risk["uid"]}\" does not have a severity score and cannot be processed.', "error")
-				#
-				# Go to the next risk
-				#
-				continue
-			#
-			# If the severity of the risk match the one being listed
-			#
-			if current_risk["severity"] == current_severity:
-				#
-				# Add the current risk to the list
-				#
-				ordered_json_database["risks"].append(current_risk)
+	ordered_json_database.pop("index", None)
+	ordered_json_database.pop("severities", None)
 	#
 	# Return the ordered list
 	#
 	return ordered_json_database
 
-#
-# Get the name of the concepts necessary to understand the documentation
-#
-@logging.log_call
-def get_concepts_from_documentations(json_database, documentation_id: str, concepts: list) -> list:
-
-	for new_concept in json_database["documentations"][documentation_id]["concepts"]:
-		if new_concept not in json_database["documentations"].keys():
-			continue
-		concepts = get_concepts_from_documentations(json_database, new_concept, concepts)
-		concepts.append(new_concept)
-	return concepts
-
 #
 # Build the DOCX report page by page
 #
@@ -1197,10 +1727,6 @@ def build_docx_document(sorted_input_files:dict, json_database:dict) -> None:
 	#
 	my_docx_manager.break_page()
 	#
-	# Import the PingCastle data
-	#
-	pingcastle_data = convert_xml_to_json(list(sorted_input_files["pingcastle"].values())[-1])
-	#
 	# Create the base properties of the chart
 	#
 	chart_data = {
@@ -1381,195 +1907,32 @@ def build_docx_document(sorted_input_files:dict, json_database:dict) -> None:
 		]
 	}
 	#
-	# Go through all the risks of the PingCastle report
+	# Count the risks found and not found in the last snapshot, by severity
+	# Example: [0, 3, 0, 5, 1, 2] -> 3 risks of severity 1 found, 5 of severity 3...
+	#
+	severities = [current_risk["severity"] for current_risk in json_database["risks"]]
+	risk_uids = [current_risk["uid"] for current_risk in json_database["risks"]]
+	found_counts = json_database["states"].count_latest(states.POSITIVE, severities, risk_uids)
+	not_found_counts = json_database["states"].count_latest(states.NEGATIVE, severities, risk_uids)
 	#
-	for current_risk in json_database["risks"]:
+	# Go through the severities of the chart
+	#
+	for current_severity in range(1, min(len(found_counts), 6)):
 		#
-		if list(current_risk["found"].values())[-1] == True:
-			#
-			# Increase the count of risks of the current category found
-			#
-			chart_data["stacked_bars"][0]["categories"][f'Niveau {current_risk["severity"]}']["value"] += 1
-			chart_data["stacked_bars"][0]["categories"][f'Niveau {current_risk["severity"]}']["label"]["value"] += 1
+		# Set the count of risks of the current category found
 		#
-		elif list(current_risk["found"].values())[-1] == False:
-			#
-			# Decrease the count of risks of the current category not found
-			#
-			chart_data["stacked_bars"][1]["categories"][f'Niveau {current_risk["severity"]}']["value"] -= 1 # The value is already negative, so we add instead of substract
-			chart_data["stacked_bars"][1]["categories"][f'Niveau {current_risk["severity"]}']["label"]["value"] -= 1 # The label is positive, to get rid of the minus sign
+		chart_data["stacked_bars"][0]["categories"][f'Niveau {current_severity}']["value"] += int(found_counts[current_severity])
+		chart_data["stacked_bars"][0]["categories"][f'Niveau {current_severity}']["label"]["value"] += int(found_counts[current_severity])
+		#
+		# Set the count of risks of the current category not found
+		#
+		chart_data["stacked_bars"][1]["categories"][f'Niveau {current_severity}']["value"] -= int(not_found_counts[current_severity]) # The value is already negative, so we add instead of substract
+		chart_data["stacked_bars"][1]["categories"][f'Niveau {current_severity}']["label"]["value"] -= int(not_found_counts[current_severity]) # The label is positive, to get rid of the minus sign
 	#
 	# Create a bar chart with the risks found compared to the total in each category
 	#
 	create_bar_chart(chart_data)
 
-	# #
-	# # Create the base properties of the chart
-	# #
-	# chart_data = {
-	# 	"style": {
-	# 		"font": config.get("FONT_NAME"),
-	# 		"background_color": None,
-	# 		"width": 12,
-	# 		"height": 8,
-	# 		"legend": {
-	# 			"show": True,
-	# 			"columns": 1,
-	# 			"x_position_ratio": -0.2,
-	# 			"y_position_ratio": 1,
-	# 			"font_color" : config.get("CHART_LEGEND_COLOR"),
-	# 			"font_size": config.get("FONT_SIZE"),
-	# 			"transparent": True
-	# 		},
-	# 		"axis": False,
-	# 		"grid": False
-	# 	},
-	# 	"export": {
-	# 		"format": "tiff",
-	# 		"keep_transparency": True,
-	# 		"path": os.path.join(config.get("CHARTS_FOLDER"), f"risks_history.tiff")
-	# 	},
-	# 	"categories": {
-	# 	},
-	# 	"stacked_bars": [
-	# 		{
-	# 			"legend": "Niveau 5",
-	# 			"width_ratio": 0.2,
-	# 			"background_color": "#D5C1EB",
-	# 			"categories": {}
-	# 		},
-	# 		{
-	# 			"legend": "Niveau 4",
-	# 			"width_ratio": 0.2,
-	# 			"background_color": "#B592DD",
-	# 			"categories": {}
-	# 		},
-	# 		{
-	# 			"legend": "Niveau 3",
-	# 			"width_ratio": 0.2,
-	# 			"background_color": "#9564CE",
-	# 			"categories": {}
-	# 		},
-	# 		{
-	# 			"legend": "Niveau 2",
-	# 			"width_ratio": 0.2,
-	# 			"background_color": "#763BBA",
-	# 			"categories": {}
-	# 		},
-	# 		{
-	# 			"legend": "Niveau 1",
-	# 			"width_ratio": 0.2,
-	# 			"background_color": "#592C8C",
-	# 			"categories": {}
-	# 		},
-	# 		{
-	# 			"legend": "Niveau 5 X",
-	# 			"width_ratio": 0.2,
-	# 			"background_color": "#E5D6B3",
-	# 			"categories": {}
-	# 		},
-	# 		{
-	# 			"legend": "Niveau 4 X",
-	# 			"width_ratio": 0.2,
-	# 			"background_color": "#D5BD85",
-	# 			"categories": {}
-	# 		},
-	# 		{
-	# 			"legend": "Niveau 3 X",
-	# 			"width_ratio": 0.2,
-	# 			"background_color": "#C19D4C",
-	# 			"categories": {}
-	# 		},
-	# 		{
-	# 			"legend": "Niveau 2 X",
-	# 			"width_ratio": 0.2,
-	# 			"background_color": "#A78639",
-	# 			"categories": {}
-	# 		},
-	# 		{
-	# 			"legend": "Niveau 1 X",
-	# 			"width_ratio": 0.2,
-	# 			"background_color": "#7A622A",
-	# 			"categories": {}
-	# 		}
-	# 	]
-	# }
-	# #
-	# #
-	# #
-	# for current_risk in json_database["risks"]:
-	# 	#
-	# 	#
-	# 	#
-	# 	for current_datetime, current_state in current_risk["found"].items():
-	# 		#
-	# 		#
-	# 		#
-	# 		if current_datetime not in chart_data["categories"].keys():
-	# 			#
-	# 			#
-	# 			#
-	# 			chart_data["categories"][current_datetime] = {
-	# 				"id": current_datetime,
-	# 				"text": current_datetime[:10],
-	# 				"alignment": "center",
-	# 				"font_size": config.get("FONT_SIZE"),
-	# 				"font_color": config.get("CHART_LEGEND_COLOR")
-	# 			}
-	# 		#
-	# 		#
-	# 		#
-	# 		for current_severity in chart_data["stacked_bars"]:
-	# 			#
-	# 			#
-	# 			#
-	# 			if current_datetime not in current_severity["categories"].keys():
-	# 				#
-	# 				#
-	# 				#
-	# 				current_severity["categories"][current_datetime] = {
-	# 					"id": current_datetime,
-	# 					"value": 0,
-	# 					"label": {
-	# 						"value": 0,
-	# 						"alignment": "center",
-	# 						"font_size": config.get("FONT_SIZE"),
-	# 						"font_color": "#ffffff"
-	# 					}
-	# 				}
-	# 			#
-	# 			#
-	# 			#
-	# 			if (current_state == True) and (current_severity["legend"] == f'Niveau {current_risk["severity"]}'):
-	# 				#
-	# 				#
-	# 				#
-	# 				current_severity["categories"][current_datetime]["value"] += 1
-	# 				#
-	# 				#
-	# 				#
-	# 			elif (current_state == False) and (current_severity["legend"] == f'Niveau {current_risk["severity"]} X'):
-	# 				#
-	# 				#
-	# 				#
-	# 				current_severity["categories"][current_datetime]["value"] -= 1
-	# 				#
-	# 				#
-	# 				#
-	# 			elif (current_state == None) and (current_severity["legend"] == f'Niveau {current_risk["severity"]} X'):
-	# 				#
-	# 				#
-	# 				#
-	# 				current_severity["categories"][current_datetime]["value"] += 1
-
-	# pp = pprint.PrettyPrinter(indent=4)
-	# #pp.pprint(json_database)
-	# #pp.pprint(chart_data)
-	# #
-	# # Create a bar chart with the history of the risks found in each severity
-	# #
-	#create_stacked_bar_chart(json_database["risks"])
-
 	#
 	# Add the title of the chart
 	#
@@ -1594,19 +1957,40 @@ def build_docx_document(sorted_input_files:dict, json_database:dict) -> None:
 	#
 	my_docx_manager.break_page(anchor=None)
 	#
-	# Create the base structure of the line chart
+	# Create a stacked bar chart with the transitions of the risks in each snapshot
 	#
-	chart_data = {		
-		"style": {
-			"font": config.get("FONT_NAME"),
-			"background_color": None,
-			"width": 12,
-			"height": 8,
-			"legend": {
-				"show": True,
-				"columns": 1,
-				"x_position_ratio": -0.1,
-				"y_position_ratio": 0.4,
+	history_chart_path = os.path.join(config.get("CHARTS_FOLDER"), f"risks_history.tiff")
+	create_history_chart(json_database["states"], [current_risk["uid"] for current_risk in json_database["risks"]], history_chart_path)
+	#
+	# Add the title of the chart
+	#
+	my_docx_manager.title(text="Historique des risques détectés", level=1, anchor=None)
+	#
+	# Add the description of the chart
+	#
+	my_docx_manager.add_text(text=f"Les {len(json_database['states'])} audits de ce domaine sont classés par date. Pour chacun d'entre eux, les risques détectés sont représentés au-dessus de l'axe et les risques non détectés en-dessous, selon leur état lors du dernier audit les ayant testés.", anchor=None)
+	#
+	# Add the chart to the report
+	#
+	my_docx_manager.add_image(path=history_chart_path, width=16, caption="Historique des risques détectés", alignment="center", anchor=None)
+	#
+	# Go to the next page of the DOCX report
+	#
+	my_docx_manager.break_page(anchor=None)
+	#
+	# Create the base structure of the line chart
+	#
+	chart_data = {		
+		"style": {
+			"font": config.get("FONT_NAME"),
+			"background_color": None,
+			"width": 12,
+			"height": 8,
+			"legend": {
+				"show": True,
+				"columns": 1,
+				"x_position_ratio": -0.1,
+				"y_position_ratio": 0.4,
 				"font_color" : config.get("CHART_LEGEND_COLOR"),
 				"font_size": config.get("FONT_SIZE"),
 				"transparent": True
@@ -1721,7 +2105,8 @@ def build_docx_document(sorted_input_files:dict, json_database:dict) -> None:
 		#
 		#
 		#
-		risks_to_solve = [risk for risk in ordered_json_database["risks"] if list(risk["found"].values())[-1] == True]
+		latest_states = ordered_json_database["states"].get_latest([risk["uid"] for risk in ordered_json_database["risks"]])
+		risks_to_solve = [risk for risk, latest_state in zip(ordered_json_database["risks"], latest_states) if latest_state == states.POSITIVE]
 		#
 		# As long as there are risks to solve
 		#
@@ -1823,9 +2208,10 @@ def build_docx_document(sorted_input_files:dict, json_database:dict) -> None:
 	#
 	my_docx_manager.title(text="Notions abordées", level=1, anchor=None)
 	#
-	# 
+	# List the concepts of the risks once each, after the concepts needed to understand them (resolved when the mapping was compiled)
+	# Example: {"ntlm": None, "kerberos": None, ...}, a dict keeping the order of insertion
 	#
-	concepts = []
+	concepts = {}
 	#
 	for risk in json_database["risks"]:
 		if "concepts" not in risk.keys():
@@ -1835,8 +2221,8 @@ def build_docx_document(sorted_input_files:dict, json_database:dict) -> None:
 			if risk_concept in concepts:
 				continue
 
-			concepts = get_concepts_from_documentations(json_database, risk_concept, concepts)				
-			concepts.append(risk_concept)
+			concepts.update(dict.fromkeys(json_database["concept_closures"][risk_concept]))
+			concepts[risk_concept] = None
 	#
 	#
 	#
@@ -1870,13 +2256,21 @@ def build_docx_document(sorted_input_files:dict, json_database:dict) -> None:
 	#
 	my_docx_manager.title(text="Détails des risques détectés", level=1, anchor=None)
 	#
+	# Open the history of the audits, to read the last state and the history of each risk through its index
+	#
+	history_store = history.History(config.get("PATH_HISTORY"))
+	#
+	# Get the state of each risk in its last snapshot tested
+	#
+	latest_states = history_store.get_latest_states(config.get("COMPANY_NAME"), json_database["domain"], [risk["uid"] for risk in json_database["risks"]])
+	#
 	# Go through all the unified risks
 	#
 	for index, mapped_risk in enumerate(json_database["risks"]):
 		#
-		# If the "found" flag has not been added to the current risk
+		# If the risk has not been found in the last snapshot
 		#
-		if list(mapped_risk["found"].values())[-1] != True:
+		if latest_states.get(mapped_risk["uid"]) != states.POSITIVE:
 			#
 			# Write it in the console
 			#
@@ -1904,54 +2298,61 @@ def build_docx_document(sorted_input_files:dict, json_database:dict) -> None:
 			#
 			my_docx_manager.title("Historique", title_level +1)
 			#
-			export_path = export_risk_history_graph(mapped_risk)
+			export_path = export_risk_history_graph(mapped_risk, json_database["states"], history_store.get_risk_history(config.get("COMPANY_NAME"), json_database["domain"], mapped_risk["uid"]))
 			#
 			my_docx_manager.add_image(path=export_path, width=16, caption=None, alignment="center", anchor=None)
 			#
-			my_docx_manager.title("Référentiels", title_level +1)
+			# If the tools gave the details of the risk
 			#
-			for line_index, framework_id in enumerate(mapped_risk["frameworks"].keys()):
+			if any((mapped_risk.get("evidence") or {}).values()):
 				#
-				my_docx_manager.add_text(json_database["frameworks"][framework_id]["name"], "Strong Paragraph")
+				my_docx_manager.title("Éléments détectés", title_level +1)
 				#
-				for current_index, current_id in enumerate(mapped_risk["frameworks"][framework_id]):
+				for risk_rule in mapped_risk["evidence"].get("pingcastle", []):
 					#
-					current_link = ""
+					points = f' ({risk_rule["points"]} points)' if risk_rule.get("points") is not None else ""
 					#
-					if framework_id == "pingcastle":
-						#
-						current_link = "https://pingcastle.com/PingCastleFiles/ad_hc_rules_list.html"
-					#
-					elif framework_id == "purpleknight":
-						#
-						current_link = "https://www.semperis.com/purple-knight/security-indicators/"
+					my_docx_manager.add_text(f'PingCastle {risk_rule["risk_id"]}{points}', "Strong Paragraph")
 					#
-					elif framework_id == "anssi":
+					if risk_rule.get("rationale"):
 						#
-						current_id = current_id[:4] + current_id[5:]
-						#
-						current_link = f'https://www.cert.ssi.gouv.fr/uploads/ad_checklist.html#{current_id}'
+						my_docx_manager.add_text(risk_rule["rationale"])
 					#
-					elif framework_id == "mitre_att&ck":
+					if risk_rule.get("details"):
 						#
-						if '.' in current_id:
-							major_id, minor_id = current_id.split('.')
+						my_docx_manager.add_table([[detail] for detail in risk_rule["details"]], header=["Objet"])
 						#
-						else:
-							major_id = current_id
-							minor_id = None
+						# If some objects have not been kept
 						#
-						if current_id[0] == "M":
+						if risk_rule["details_count"] > len(risk_rule["details"]):
 							#
-							current_link = f'https://attack.mitre.org/mitigations/{major_id}'
+							my_docx_manager.add_text(f'{len(risk_rule["details"])} objets affichés sur {risk_rule["details_count"]}.')
+				#
+				for indicator in mapped_risk["evidence"].get("purpleknight", []):
+					#
+					my_docx_manager.add_text(f'PurpleKnight {indicator["risk_id"]}', "Strong Paragraph")
+					#
+					my_docx_manager.add_text(f'Sévérité : {indicator.get("severity")}, score : {indicator.get("score")}, poids : {indicator.get("weight")}')
+					#
+					if indicator.get("details"):
 						#
-						elif current_id[0] == "T":
-							#
-							current_link = f'https://attack.mitre.org/techniques/{major_id}'
+						my_docx_manager.add_table(indicator["details"], header=indicator["columns"])
 						#
-						if minor_id:
+						# If some objects have not been kept
+						#
+						if indicator["details_count"] > len(indicator["details"]):
 							#
-							current_link += f'/{minor_id}'
+							my_docx_manager.add_text(f'{len(indicator["details"])} objets affichés sur {indicator["details_count"]}.')
+			#
+			my_docx_manager.title("Référentiels", title_level +1)
+			#
+			for line_index, framework_id in enumerate(mapped_risk["frameworks"].keys()):
+				#
+				my_docx_manager.add_text(json_database["frameworks"][framework_id]["name"], "Strong Paragraph")
+				#
+				# Links to the references, built when the mapping of the risks was compiled
+				#
+				for current_id, current_link in mapped_risk["references"][framework_id]:
 					#
 					my_docx_manager.add_link(current_id, current_link, "List Bullet")
 			#
@@ -1983,6 +2384,10 @@ def build_docx_document(sorted_input_files:dict, json_database:dict) -> None:
 			#
 			logging.log(f'Documentation not found at "{file_path}".', "error")
 	#
+	# Close the history of the audits
+	#
+	history_store.close()
+	#
 	# DOCX footer file for the report
 	# Example: "./assets/templates/MyFirstTemplate/footer.docx"
 	#
@@ -2018,6 +2423,546 @@ def build_docx_document(sorted_input_files:dict, json_database:dict) -> None:
 	#
 	my_docx_manager.open_export()
 
+#
+# Build a compact DOCX report with only the risks changed since a previous snapshot
+#
+@logging.log_call
+def build_delta_docx_document(sorted_input_files:dict, json_database:dict) -> None:
+	#
+	# Legend of each change of the risks, in the order of the chapters
+	#
+	delta_legends = {
+		"new": "Nouveaux risques détectés",
+		"regressed": "Risques détectés à nouveau",
+		"fixed": "Risques corrigés",
+		"not_retested": "Risques détectés, non testés à nouveau"
+	}
+	#
+	# Create the DOCX Manager object, with the same template and outputs as the full report
+	#
+	my_docx_manager = docx_manager.DocxManager()
+	my_docx_manager.header_file = os.path.join(config.get("PATH_TEMPLATE"), "header.docx")
+	my_docx_manager.path = config.get("PATH_OUTPUT_DOCX")
+	my_docx_manager.export_path = config.get("PATH_OUTPUT_PDF")
+	#
+	# Go to the next page of the DOCX report
+	#
+	my_docx_manager.break_page()
+	#
+	# Order the risks by severity, so that the worst changes come first in each chapter
+	#
+	ordered_risks = order_risks_by_severity(json_database)["risks"]
+	#
+	# Find the snapshot to compare with, the last one taken at or before the date given (-1 if there is none)
+	#
+	state_matrix = json_database["states"]
+	since_column = state_matrix.get_column(get_since_datetime(config.get("since")))
+	#
+	# Compare the last state tested of each risk in this snapshot and in the last one, for all the risks at once
+	# Example: {"new": [False, True, ...], "fixed": [...], ...}
+	#
+	deltas = state_matrix.get_delta(since_column, risk_uids=[risk["uid"] for risk in ordered_risks])
+	#
+	# Add the title of the report
+	#
+	my_docx_manager.title(text="Évolution des risques", level=1, anchor=None)
+	#
+	# Add the description of the report, depending on the snapshot found
+	#
+	until_date = state_matrix.timestamps[-1].astimezone().strftime("%d/%m/%Y") if len(state_matrix) else None
+	if since_column < 0:
+		my_docx_manager.add_text(text=f"Aucun audit n'a été réalisé avant le {config.get('since')}. Les risques détectés lors des audits suivants, jusqu'au {until_date}, sont donc tous nouveaux.", anchor=None)
+	elif since_column == len(state_matrix) - 1:
+		logging.log(f'No snapshot taken after the {config.get("since")}, the delta report is empty.', "warning")
+		my_docx_manager.add_text(text=f"Aucun audit n'a été réalisé après le {config.get('since')}.", anchor=None)
+	else:
+		since_date = state_matrix.timestamps[since_column].astimezone().strftime("%d/%m/%Y")
+		my_docx_manager.add_text(text=f"Ce rapport présente uniquement les risques dont l'état a changé entre l'audit du {since_date} et celui du {until_date}, selon le dernier audit les ayant testés.", anchor=None)
+	#
+	# Add the number of risks of each change
+	#
+	my_docx_manager.add_table([[legend, str(int(deltas[delta].sum()))] for delta, legend in delta_legends.items()], header=["Évolution", "Risques"])
+	#
+	# Go through the changes of the risks
+	#
+	for delta, legend in delta_legends.items():
+		#
+		# If no risk has changed this way
+		#
+		if not deltas[delta].any():
+			#
+			# Go to the next change
+			#
+			continue
+		#
+		# Add the risks of the change, without their documentation
+		#
+		my_docx_manager.title(text=legend, level=2, anchor=None)
+		my_docx_manager.add_table(
+			[[str(risk["uid"]).zfill(3), risk["title"], str(risk["severity"])] for risk, changed in zip(ordered_risks, deltas[delta]) if changed],
+			header=["ID METSYS", "Risque", "Sévérité"]
+		)
+	#
+	# Add the footer of the report
+	#
+	my_docx_manager.break_page()
+	my_docx_manager.append(os.path.join(config.get("PATH_TEMPLATE"), "footer.docx"))
+	#
+	#
+	#
+	my_docx_manager.replace_text("[company_name]", config.get("COMPANY_NAME"))
+	my_docx_manager.replace_text("[company_address]", config.get("COMPANY_ADDRESS"))
+	#
+	# Save the DOCX report, update its tables, export it to PDF and open it
+	#
+	my_docx_manager.save_to_file()
+	my_docx_manager.update_table_of_contents()
+	my_docx_manager.update_table_of_illustrations()
+	my_docx_manager.export()
+	my_docx_manager.open_export()
+
+############################################################################### REPORTS
+
+#
+# Get a name usable in file names from a domain
+# Example: "contoso.local" -> "contoso.local", "unknown domain" -> "unknown_domain"
+#
+@logging.log_call
+def get_domain_file_name(domain:str) -> str:
+	#
+	# Replace the characters forbidden in file names
+	#
+	return re.sub(r"[^\w.-]", "_", domain)
+
+#
+# Get the path of an output file of a domain
+# Example: "./output/ActiveDirectoryAuditReport.docx" -> "./output/ActiveDirectoryAuditReport_contoso.local.docx"
+#
+@logging.log_call
+def get_domain_output_path(path:str, domain:str) -> str:
+	#
+	# Split the path between its name and its extension
+	#
+	name, extension = os.path.splitext(path)
+	#
+	# Return the path with the domain
+	#
+	return f'{name}_{get_domain_file_name(domain)}{extension}'
+
+#
+# Import the modules only needed to build the reports (DOCX and charts), so that parsing the input files or running a cache command does not load them
+#
+@logging.log_call
+def import_report_modules() -> None:
+	#
+	# Replace the placeholders of the modules
+	#
+	global docx_manager, matplotlib, numpy, pandas, seaborn, states
+	#
+	# Import the modules, pyplot explicitly since it is not imported with matplotlib
+	#
+	docx_manager = importlib.import_module("lib.docx_manager")
+	matplotlib = importlib.import_module("matplotlib")
+	importlib.import_module("matplotlib.pyplot")
+	numpy = importlib.import_module("numpy")
+	pandas = importlib.import_module("pandas")
+	seaborn = importlib.import_module("seaborn")
+	states = importlib.import_module("lib.states")
+
+#
+# Import the modules building the reports, and load once the DOCX files used by all the reports (template, documentations of the concepts and risks)
+#
+@logging.log_call
+def preload_report_files(json_database:dict) -> None:
+	#
+	# Import the modules building the reports
+	#
+	import_report_modules()
+	#
+	# Load the DOCX files in memory, the delta reports do not include the documentations, so only the template is loaded
+	#
+	docx_manager.preload_files(
+		[os.path.join(config.get("PATH_TEMPLATE"), file_name) for file_name in ["header.docx", "footer.docx"]] +
+		([] if config.get("since") else
+			[os.path.join(config.get("PATH_CONCEPTS_DOCUMENTATIONS"), documentation["file_name"]) for documentation in json_database["documentations"].values()] +
+			[os.path.join(config.get("PATH_RISKS_DOCUMENTATIONS"), risk["file_name"]) for risk in json_database["risks"]]
+		)
+	)
+
+#
+# Prepare a process to build the reports, with the assets loaded once by the main process
+#
+def initialize_report_builder(config_dict:dict, json_database:dict, files_content:dict, log_level:str) -> None:
+	#
+	# Share the database of the risks with the process
+	#
+	global shared_json_database
+	shared_json_database = json_database
+	#
+	# Import the modules building the reports in the process
+	#
+	import_report_modules()
+	#
+	# Share the configuration and the DOCX files (template, documentations) with the process
+	#
+	config.dict = config_dict
+	docx_manager.FILES_CONTENT.update(files_content)
+	logging.LOG_LEVEL = log_level
+
+#
+# Build the report of a domain
+#
+@logging.log_call
+def build_domain_report(domain:str, domain_input_files:dict, multiple_domains:bool) -> str:
+	#
+	# Keep the configuration of the process, restored once the report is built, since a process of the pool builds the reports of several domains
+	#
+	original_config = dict(config.dict)
+	try:
+		#
+		# Build the report with the outputs named after the domain
+		#
+		return build_domain_report_with_config(domain, domain_input_files, multiple_domains)
+	finally:
+		config.dict = original_config
+
+#
+# Build the report of a domain, changing the configuration of the process
+#
+@logging.log_call
+def build_domain_report_with_config(domain:str, domain_input_files:dict, multiple_domains:bool) -> str:
+	#
+	# If several domains are audited
+	#
+	if multiple_domains:
+		#
+		# Name the outputs and the charts folder after the domain
+		#
+		config.set("PATH_OUTPUT_DOCX", get_domain_output_path(config.get("PATH_OUTPUT_DOCX"), domain))
+		config.set("PATH_OUTPUT_PDF", get_domain_output_path(config.get("PATH_OUTPUT_PDF"), domain))
+		config.set("CHARTS_FOLDER", os.path.join(config.get("CHARTS_FOLDER"), get_domain_file_name(domain)))
+		os.makedirs(config.get("CHARTS_FOLDER"), exist_ok=True)
+	#
+	# Get a copy of the database of the risks, without the results of the other domains
+	#
+	json_database = copy.deepcopy(shared_json_database)
+	#
+	# Process the database with the input files of the domain
+	#
+	json_database = process_input_files(json_database, domain)
+	#
+	# If only the changes since a previous snapshot must be reported
+	#
+	if config.get("since"):
+		#
+		# Build the compact DOCX report of the changed risks
+		#
+		build_delta_docx_document(domain_input_files, json_database)
+	#
+	# Else, build the full DOCX report page by page
+	#
+	else:
+		build_docx_document(domain_input_files, json_database)
+	#
+	# Return the path to the report
+	#
+	return config.get("PATH_OUTPUT_DOCX")
+
+#
+# Build one report per domain, in parallel when several processes are allowed
+#
+@logging.log_call
+def build_reports(json_database:dict, input_files_by_domain:dict, multiple_domains:bool=None, executor:concurrent.futures.ProcessPoolExecutor=None) -> None:
+	#
+	# If there is no input file
+	#
+	if not input_files_by_domain:
+		#
+		# Write it in the console
+		#
+		logging.log(f'No input file found in "{config.get("PATH_INPUTS")}".', "error")
+		#
+		# Quit the function
+		#
+		return
+	#
+	# Check if several domains are audited, if not already known
+	#
+	if multiple_domains is None:
+		multiple_domains = len(input_files_by_domain) > 1
+	#
+	# Limit the number of processes to the number of domains
+	#
+	jobs = min(get_jobs(), len(input_files_by_domain))
+	#
+	# If several domains are audited
+	#
+	if len(input_files_by_domain) > 1:
+		#
+		# Write it in the console
+		#
+		logging.log(f'Building {len(input_files_by_domain)} reports ({", ".join(input_files_by_domain.keys())}) with {jobs} processes.', "info")
+	#
+	# If the processes of the program are already running (watch mode)
+	#
+	if executor is not None:
+		#
+		# Build the reports in these processes, which have already loaded the modules and the DOCX files
+		#
+		build_reports_in_pool(executor, input_files_by_domain, multiple_domains)
+		#
+		# Quit the function
+		#
+		return
+	#
+	# Import the modules building the reports, and load once the DOCX files used by all the reports
+	#
+	preload_report_files(json_database)
+	#
+	# Arguments used to prepare the processes building the reports
+	#
+	initialization_arguments = (config.dict, json_database, docx_manager.FILES_CONTENT, logging.LOG_LEVEL)
+	#
+	# If a single process is enough
+	#
+	if jobs <= 1:
+		#
+		# Build the reports one after the other in the current process, each one with its own configuration
+		#
+		for domain, domain_input_files in input_files_by_domain.items():
+			initialize_report_builder(dict(initialization_arguments[0]), *initialization_arguments[1:])
+			build_domain_report(domain, domain_input_files, multiple_domains)
+		#
+		# Restore the configuration of the program
+		#
+		config.dict = initialization_arguments[0]
+		#
+		# Quit the function
+		#
+		return
+	#
+	# Build the reports in a pool of processes
+	#
+	with concurrent.futures.ProcessPoolExecutor(max_workers=jobs, initializer=initialize_report_builder, initargs=initialization_arguments) as executor:
+		build_reports_in_pool(executor, input_files_by_domain, multiple_domains)
+
+#
+# Build the reports of the domains in a pool of processes
+#
+@logging.log_call
+def build_reports_in_pool(executor:concurrent.futures.ProcessPoolExecutor, input_files_by_domain:dict, multiple_domains:bool) -> None:
+	#
+	# Submit the report of each domain
+	#
+	futures = {executor.submit(build_domain_report, domain, domain_input_files, multiple_domains): domain for domain, domain_input_files in input_files_by_domain.items()}
+	#
+	# Go through the reports as they are built
+	#
+	for future in concurrent.futures.as_completed(futures):
+		#
+		# If the report could not be built
+		#
+		if future.exception():
+			#
+			# Write it in the console
+			#
+			logging.log(f'Unable to build the report of the domain "{futures[future]}" : {future.exception()}', "error")
+		#
+		# Else, if the report has been built
+		#
+		else:
+			#
+			# Write it in the console
+			#
+			logging.log(f'Report of the domain "{futures[future]}" built at "{future.result()}".', "info")
+
+#
+# Create the processes used by the watch mode, prepared once to extract the input files and build the reports
+#
+@logging.log_call
+def create_process_pool(json_database:dict) -> concurrent.futures.ProcessPoolExecutor:
+	#
+	# If a single process is allowed
+	#
+	if get_jobs() <= 1:
+		#
+		# Extract the files and build the reports in the current process
+		#
+		return None
+	#
+	# Import the modules building the reports, and load once the DOCX files used by all the reports
+	#
+	preload_report_files(json_database)
+	#
+	# Return the pool of processes, each one importing the modules and receiving the database, the configuration and the DOCX files when it starts
+	#
+	return concurrent.futures.ProcessPoolExecutor(max_workers=get_jobs(), initializer=initialize_report_builder, initargs=(config.dict, json_database, docx_manager.FILES_CONTENT, logging.LOG_LEVEL))
+
+############################################################################### WATCH
+
+#
+# Get the size and modification time of the input files
+#
+@logging.log_call
+def get_input_files_state() -> dict:
+	#
+	# Create the state of the input files
+	# Example: {"./input/ad_hc_contoso.local.xml": (1024, 1700000000000000000), ...}
+	#
+	input_files_state = {}
+	#
+	# Go through all the input files
+	#
+	for file_path in get_input_files():
+		#
+		# Try to get the size and modification time of the file
+		#
+		try:
+			stat = archives.stat(file_path)
+		#
+		# If the file has been removed in the meantime
+		#
+		except OSError:
+			#
+			# Go to the next file
+			#
+			continue
+		#
+		# Save the size and modification time of the file
+		#
+		input_files_state[file_path] = (stat.st_size, stat.st_mtime_ns)
+	#
+	# Return the state of the input files
+	#
+	return input_files_state
+
+#
+# Get the list of reports used by the report of each domain
+#
+@logging.log_call
+def get_domain_signatures(input_files_by_domain:dict) -> dict:
+	#
+	# Return the tool, datetime and path of all the reports of each domain
+	# Example: {"contoso.local": [("pingcastle", "2023-05-23T14:40:56+02:00", "./input/ad_hc_contoso.local.xml"), ...], ...}
+	#
+	return {domain: [(tool, report_datetime, report["path"]) for tool, sorted_reports in domain_input_files.items() for report_datetime, report in sorted_reports.items()] for domain, domain_input_files in input_files_by_domain.items()}
+
+#
+# Wait for new input files and rebuild the reports of the domains they audit
+#
+@logging.log_call
+def watch_input_files(json_database:dict, input_files_by_domain:dict) -> None:
+	#
+	# Get the number of seconds between two checks of the input folder, and the number of seconds without changes to wait for before processing new files
+	#
+	interval = float(config.get("WATCH_INTERVAL"))
+	debounce = float(config.get("WATCH_DEBOUNCE"))
+	#
+	# Get the current state of the input files and of the reports
+	#
+	input_files_state = get_input_files_state()
+	domain_signatures = get_domain_signatures(input_files_by_domain)
+	#
+	# Write it in the console
+	#
+	logging.log(f'Watching the input files in "{config.get("PATH_INPUTS")}". Press Ctrl+C to quit.', "info")
+	#
+	# Start the processes extracting the input files and building the reports once, so that they stay ready between two changes
+	#
+	executor = create_process_pool(json_database)
+	#
+	# Until the user stops the program
+	#
+	try:
+		while True:
+			#
+			# Wait before the next check
+			#
+			time.sleep(interval)
+			#
+			# If the input files have not changed
+			#
+			if get_input_files_state() == input_files_state:
+				#
+				# Go to the next check
+				#
+				continue
+			#
+			# Wait for the end of the burst of new files (copies in progress, several exports at once...)
+			#
+			new_input_files_state = get_input_files_state()
+			while True:
+				time.sleep(debounce)
+				last_input_files_state = get_input_files_state()
+				if last_input_files_state == new_input_files_state:
+					break
+				new_input_files_state = last_input_files_state
+			input_files_state = new_input_files_state
+			#
+			# Write it in the console
+			#
+			logging.log(f'Changes detected in the input files.', "info")
+			#
+			# Sort the input files, only the new or changed ones are parsed
+			#
+			sorted_input_files = sort_input_files(list(input_files_state.keys()), executor)
+			log_run_summary()
+			#
+			# Save the reports extracted from the new input files
+			#
+			save_cache()
+			#
+			# Group the input files by domain
+			#
+			input_files_by_domain = group_input_files_by_domain(sorted_input_files)
+			new_domain_signatures = get_domain_signatures(input_files_by_domain)
+			#
+			# Record the new snapshots in the history of the audits
+			#
+			record_snapshots(json_database, input_files_by_domain)
+			#
+			# Update the coverage of the mapping with the new snapshots
+			#
+			export_mapping_coverage(json_database)
+			#
+			# Keep only the domains whose reports have changed
+			#
+			changed_input_files_by_domain = {domain: domain_input_files for domain, domain_input_files in input_files_by_domain.items() if domain_signatures.get(domain) != new_domain_signatures[domain]}
+			domain_signatures = new_domain_signatures
+			#
+			# If no report depends on the changed files
+			#
+			if not changed_input_files_by_domain:
+				#
+				# Write it in the console
+				#
+				logging.log(f'No report depends on the changed input files.', "info")
+				#
+				# Go to the next check
+				#
+				continue
+			#
+			# Rebuild the reports of these domains only
+			#
+			build_reports(json_database, changed_input_files_by_domain, len(input_files_by_domain) > 1, executor)
+	#
+	# If the user stops the program
+	#
+	except KeyboardInterrupt:
+		#
+		# Write it in the console
+		#
+		logging.log(f'Stopped watching the input files.', "info")
+	#
+	# In any case
+	#
+	finally:
+		#
+		# Stop the processes
+		#
+		if executor is not None:
+			executor.shutdown(cancel_futures=True)
+
 ############################################################################### MAIN
 
 #
@@ -2025,38 +2970,83 @@ def build_docx_document(sorted_input_files:dict, json_database:dict) -> None:
 #
 @logging.log_call
 def main() -> None:
-	#
-	# Remove the previous generated report
-	#
-	delete_folder_contents("./output")
 	#
 	# Load the content of the configuration (log level, fonts of the current template...)
 	#
 	load_config()
 	#
-	# Parse the arguments given to the script (PingCastle file)
+	# Parse the arguments given to the script (number of processes, watch mode, cache command)
+	#
+	parse_arguments()
+	#
+	# Load the reports already extracted during the previous runs
 	#
-	#parse_arguments()
+	load_cache()
 	#
-	# Get the input files from PingCastle and PurpleKnight
+	# If a command on the cache has been passed to the program
+	#
+	if config.get("cache_command"):
+		#
+		# Run it and quit the program
+		#
+		run_cache_command(config.get("cache_command"))
+		return
+	#
+	# Get the JSON database of the risks, validated and compiled if the JSON file has changed
+	#
+	json_database = get_json_database(force=bool(config.get("compile_mapping")))
+	#
+	# If the mapping of the risks is invalid, or if it had only to be compiled
+	#
+	if json_database is None or config.get("compile_mapping"):
+		#
+		# Quit the program
+		#
+		return
+	#
+	# Remove the previous generated report
+	#
+	delete_folder_contents("./output")
+	#
+	# Get the input files from PingCastle, PurpleKnight and the ANSSI checks
 	#
 	input_files = get_input_files()
 	#
-	# Sort the list of input files by tool and datetime
+	# Sort the list of input files by tool and datetime, parsing only the files missing from the cache
 	#
 	sorted_input_files = sort_input_files(input_files)
 	#
-	# Get the JSON database of the risks
+	# Write the summary of the input files (parsed, cached and skipped files)
+	#
+	log_run_summary()
+	#
+	# Save the reports extracted from the new input files for the next runs
+	#
+	save_cache()
+	#
+	# Group the sorted input files by the domain they audit
+	#
+	input_files_by_domain = group_input_files_by_domain(sorted_input_files)
 	#
-	json_database = get_json_database()
+	# Record the new snapshots in the history of the audits
 	#
-	# Process the database with the sorted input files
+	record_snapshots(json_database, input_files_by_domain)
 	#
-	processed_database = process_input_files(json_database, sorted_input_files)
+	# Write the coverage of the IDs reported by the tools by the mapping of the risks, in all the snapshots of the history
 	#
-	# Build the DOCX report page by page
+	export_mapping_coverage(json_database)
 	#
-	build_docx_document(sorted_input_files, json_database)
+	# Build the DOCX report of each domain
+	#
+	build_reports(json_database, input_files_by_domain)
+	#
+	# If the program must keep running
+	#
+	if config.get("watch"):
+		#
+		# Rebuild the reports each time new input files are added
+		#
+		watch_input_files(json_database, input_files_by_domain)
 
 #
 # If the file is executed on its own, and not imported as part of a bigger program
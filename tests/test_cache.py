@@ -0,0 +1,104 @@
+import gzip
+import os
+import shutil
+import tempfile
+import unittest
+import lib.cache as cache
+import lib.logs as logging
+
+REPORT = {"tool": "pingcastle", "format": "xml", "datetime": "2023-05-23T16:40:56+02:00", "domain": "contoso.local", "risk_ids": ["A-Krbtgt"]}
+
+class TestCache(unittest.TestCase):
+
+	def setUp(self) -> None:
+		logging.LOG_LEVEL = "silent"
+		self.folder = tempfile.mkdtemp()
+		self.file_path = self.write("ad_hc_contoso.local.xml", b"<HealthcheckData>1</HealthcheckData>")
+		self.reports_cache = cache.Cache(os.path.join(self.folder, "cache", "input_reports.json"))
+		self.reports_cache.set(self.file_path, dict(REPORT))
+
+	def tearDown(self) -> None:
+		shutil.rmtree(self.folder)
+		logging.LOG_LEVEL = "info"
+
+	def write(self, file_name:str, content:bytes, mtime_ns:int=1700000000000000000) -> str:
+		file_path = os.path.join(self.folder, file_name)
+		with open(file_path, "wb") as file:
+			file.write(content)
+		os.utime(file_path, ns=(mtime_ns, mtime_ns))
+		return file_path
+
+	def test_unchanged_file(self) -> None:
+		self.assertEqual(self.reports_cache.get(self.file_path), REPORT)
+
+	def test_same_size_and_mtime_is_trusted_without_hashing(self) -> None:
+		# The content changes, but not its size nor its modification time
+		self.write("ad_hc_contoso.local.xml", b"<HealthcheckData>2</HealthcheckData>")
+		self.assertEqual(self.reports_cache.get(self.file_path), REPORT)
+
+	def test_changed_size(self) -> None:
+		self.write("ad_hc_contoso.local.xml", b"<HealthcheckData>10</HealthcheckData>")
+		self.assertIsNone(self.reports_cache.get(self.file_path))
+
+	def test_changed_mtime_with_the_same_content(self) -> None:
+		# Touched file: found again through the hash of its content, with its new modification time
+		self.write("ad_hc_contoso.local.xml", b"<HealthcheckData>1</HealthcheckData>", 1800000000000000000)
+		self.assertEqual(self.reports_cache.get(self.file_path), REPORT)
+		self.assertEqual(self.reports_cache.entries[self.file_path]["mtime"], 1800000000000000000)
+		self.assertTrue(self.reports_cache.modified)
+
+	def test_changed_mtime_and_content(self) -> None:
+		self.write("ad_hc_contoso.local.xml", b"<HealthcheckData>2</HealthcheckData>", 1800000000000000000)
+		self.assertIsNone(self.reports_cache.get(self.file_path))
+
+	def test_copy_found_by_the_hash_of_its_content(self) -> None:
+		copy_path = self.write("copy.xml", b"<HealthcheckData>1</HealthcheckData>", 1800000000000000000)
+		report = self.reports_cache.get(copy_path)
+		self.assertEqual(report, REPORT)
+		# The copy gets its own entry, with the same hash
+		self.assertEqual(self.reports_cache.entries[copy_path]["hash"], self.reports_cache.entries[self.file_path]["hash"])
+		self.assertEqual(self.reports_cache.entries[copy_path]["hash"], cache.hash_file(self.file_path))
+
+	def test_other_version(self) -> None:
+		self.reports_cache.entries[self.file_path]["version"] = cache.CACHE_VERSION - 1
+		self.assertIsNone(self.reports_cache.get(self.file_path))
+		self.assertEqual(self.reports_cache.evict_stale(), 1)
+		self.assertEqual(self.reports_cache.entries, {})
+
+	def test_missed_hash_reused_when_the_file_is_added(self) -> None:
+		new_path = self.write("ad_hc_fabrikam.com.xml", b"<HealthcheckData>3</HealthcheckData>")
+		self.assertIsNone(self.reports_cache.get(new_path))
+		self.reports_cache.set(new_path, dict(REPORT, domain="fabrikam.com"))
+		self.assertEqual(self.reports_cache.entries[new_path]["hash"], cache.hash_file(new_path))
+		self.assertEqual(self.reports_cache.get(new_path)["domain"], "fabrikam.com")
+
+	def test_removed_file_evicted(self) -> None:
+		os.remove(self.file_path)
+		self.assertEqual(self.reports_cache.evict_stale(), 1)
+		self.assertNotIn(self.file_path, self.reports_cache.entries)
+
+	def test_save_and_load(self) -> None:
+		self.assertTrue(self.reports_cache.save())
+		self.assertFalse(self.reports_cache.modified)
+		loaded_cache = cache.Cache(self.reports_cache.path)
+		self.assertEqual(loaded_cache.get(self.file_path), REPORT)
+		self.assertEqual(loaded_cache.hashes, {cache.hash_file(self.file_path): self.file_path})
+
+	def test_invalid_cache_file(self) -> None:
+		os.makedirs(os.path.dirname(self.reports_cache.path), exist_ok=True)
+		with open(self.reports_cache.path, "w", encoding="utf-8") as file:
+			file.write("{")
+		loaded_cache = cache.Cache()
+		self.assertFalse(loaded_cache.load(self.reports_cache.path))
+		self.assertEqual(loaded_cache.entries, {})
+
+	def test_hash_of_a_compressed_file_not_returned(self) -> None:
+		compressed_path = os.path.join(self.folder, "ad_hc_contoso.local.xml.gz")
+		with gzip.open(compressed_path, "wb") as file:
+			file.write(b"<HealthcheckData>1</HealthcheckData>")
+		self.reports_cache.set(compressed_path, dict(REPORT))
+		self.assertIsNone(self.reports_cache.get_hash(compressed_path))
+		self.assertEqual(self.reports_cache.get_hash(self.file_path), cache.hash_file(self.file_path))
+
+if __name__ == '__main__':
+	unittest.main()
@@ -0,0 +1,136 @@
+import datetime
+import unittest
+import numpy
+import lib.states as states
+
+UTC = datetime.timezone.utc
+
+def get_timestamp(day:int, hour:int=12) -> datetime.datetime:
+	return datetime.datetime(2023, 5, day, hour, tzinfo=UTC)
+
+class TestAddSnapshot(unittest.TestCase):
+
+	def test_columns_follow_the_chronological_order(self) -> None:
+		state_matrix = states.StateMatrix([10, 20])
+		self.assertEqual(state_matrix.add_snapshot(get_timestamp(3)), 0)
+		self.assertEqual(state_matrix.add_snapshot(get_timestamp(5)), 1)
+		# An older snapshot is inserted before the next ones
+		self.assertEqual(state_matrix.add_snapshot(get_timestamp(1)), 0)
+		self.assertEqual(state_matrix.add_snapshot(get_timestamp(4)), 2)
+		self.assertEqual(state_matrix.timestamps, [get_timestamp(1), get_timestamp(3), get_timestamp(4), get_timestamp(5)])
+
+	def test_older_snapshot_shifts_the_states_of_the_next_columns(self) -> None:
+		state_matrix = states.StateMatrix([10, 20])
+		state_matrix.set_states(state_matrix.add_snapshot(get_timestamp(3)), [0], states.POSITIVE)
+		state_matrix.set_states(state_matrix.add_snapshot(get_timestamp(5)), [1], states.NEGATIVE)
+		column = state_matrix.add_snapshot(get_timestamp(4))
+		# The new column is untested, the states of the following snapshot moved with it
+		numpy.testing.assert_array_equal(state_matrix.states, [[states.POSITIVE, states.UNTESTED, states.UNTESTED], [states.UNTESTED, states.UNTESTED, states.NEGATIVE]])
+		state_matrix.set_states(column, None, states.POSITIVE)
+		numpy.testing.assert_array_equal(state_matrix.get_history(20), [states.UNTESTED, states.POSITIVE, states.NEGATIVE])
+
+	def test_snapshots_at_the_same_time_share_their_column(self) -> None:
+		state_matrix = states.StateMatrix([10])
+		column = state_matrix.add_snapshot("2023-05-23T16:40:56+02:00")
+		# Same instant written in UTC, from another tool
+		self.assertEqual(state_matrix.add_snapshot("2023-05-23T14:40:56Z"), column)
+		self.assertEqual(len(state_matrix), 1)
+
+	def test_capacity_grows_without_losing_states(self) -> None:
+		state_matrix = states.StateMatrix([10, 20])
+		# Inserted from the most recent to the oldest, beyond the initial capacity
+		days = list(range(states.INITIAL_CAPACITY * 2 + 1, 0, -1))
+		for day in days:
+			column = state_matrix.add_snapshot(datetime.datetime(2023, 1, 1, tzinfo=UTC) + datetime.timedelta(days=day))
+			state_matrix.set_states(column, [day % 2], states.POSITIVE)
+		self.assertEqual(len(state_matrix), len(days))
+		self.assertEqual(state_matrix.timestamps, sorted(state_matrix.timestamps))
+		expected_rows = [day % 2 for day in sorted(days)]
+		numpy.testing.assert_array_equal(state_matrix.states[1], [states.POSITIVE if row == 1 else states.UNTESTED for row in expected_rows])
+		numpy.testing.assert_array_equal(state_matrix.states[0], [states.POSITIVE if row == 0 else states.UNTESTED for row in expected_rows])
+
+class TestLatestTested(unittest.TestCase):
+
+	def setUp(self) -> None:
+		self.state_matrix = states.StateMatrix([10, 20, 30])
+		for day in range(1, 6):
+			self.state_matrix.add_snapshot(get_timestamp(day))
+		# Risk 10 tested in the 1st and 3rd snapshots, risk 20 only in the 4th, risk 30 never
+		self.state_matrix.set_states(0, [0], states.POSITIVE)
+		self.state_matrix.set_states(2, [0], states.NEGATIVE)
+		self.state_matrix.set_states(3, [1], states.POSITIVE)
+
+	def test_untested_snapshots_keep_the_previous_state_tested(self) -> None:
+		numpy.testing.assert_array_equal(self.state_matrix.latest_tested, [
+			[states.POSITIVE, states.POSITIVE, states.NEGATIVE, states.NEGATIVE, states.NEGATIVE],
+			[states.UNTESTED, states.UNTESTED, states.UNTESTED, states.POSITIVE, states.POSITIVE],
+			[states.UNTESTED] * 5
+		])
+
+	def test_forward_fill_is_computed_again_after_a_change(self) -> None:
+		self.state_matrix.latest_tested
+		self.state_matrix.set_states(4, [2], states.POSITIVE)
+		numpy.testing.assert_array_equal(self.state_matrix.get_latest(), [states.NEGATIVE, states.POSITIVE, states.POSITIVE])
+		self.state_matrix.add_snapshot(get_timestamp(2, 18))
+		numpy.testing.assert_array_equal(self.state_matrix.latest_tested[0], [states.POSITIVE, states.POSITIVE, states.POSITIVE, states.NEGATIVE, states.NEGATIVE, states.NEGATIVE])
+
+	def test_states_at_a_datetime(self) -> None:
+		numpy.testing.assert_array_equal(self.state_matrix.get_states_at(get_timestamp(2, 18)), [states.POSITIVE, states.UNTESTED, states.UNTESTED])
+		numpy.testing.assert_array_equal(self.state_matrix.get_states_at(get_timestamp(1, 0)), [states.UNTESTED] * 3)
+		numpy.testing.assert_array_equal(self.state_matrix.get_latest([30, 10]), [states.UNTESTED, states.NEGATIVE])
+
+class TestGetColumn(unittest.TestCase):
+
+	def setUp(self) -> None:
+		self.state_matrix = states.StateMatrix([10])
+		for day in [1, 3, 5]:
+			self.state_matrix.add_snapshot(get_timestamp(day))
+
+	def test_before_the_first_snapshot(self) -> None:
+		self.assertEqual(self.state_matrix.get_column(get_timestamp(1, 11)), -1)
+
+	def test_at_a_snapshot(self) -> None:
+		self.assertEqual(self.state_matrix.get_column(get_timestamp(1)), 0)
+		self.assertEqual(self.state_matrix.get_column("2023-05-03T14:00:00+02:00"), 1)
+
+	def test_between_two_snapshots(self) -> None:
+		self.assertEqual(self.state_matrix.get_column(get_timestamp(4)), 1)
+
+	def test_after_the_last_snapshot(self) -> None:
+		self.assertEqual(self.state_matrix.get_column(get_timestamp(30)), 2)
+
+	def test_empty_matrix(self) -> None:
+		self.assertEqual(states.StateMatrix([10]).get_column(get_timestamp(1)), -1)
+
+class TestTransitionsAndDelta(unittest.TestCase):
+
+	def setUp(self) -> None:
+		self.state_matrix = states.StateMatrix([10, 20])
+		for day, risk_states in enumerate([[states.POSITIVE, states.NEGATIVE], [states.UNTESTED, states.POSITIVE], [states.NEGATIVE, states.POSITIVE]], start=1):
+			column = self.state_matrix.add_snapshot(get_timestamp(day))
+			for row, state in enumerate(risk_states):
+				self.state_matrix.set_states(column, [row], state)
+
+	def test_transitions(self) -> None:
+		numpy.testing.assert_array_equal(self.state_matrix.get_transitions(), [
+			[states.NEW_POSITIVE, states.POSITIVE_NOT_RETESTED, states.NEW_NEGATIVE],
+			[states.NEW_NEGATIVE, states.NEW_POSITIVE, states.STILL_POSITIVE]
+		])
+
+	def test_delta_since_the_first_snapshot(self) -> None:
+		delta = self.state_matrix.get_delta(0)
+		self.assertEqual({name: changed.tolist() for name, changed in delta.items()}, {
+			"new": [False, False],
+			"regressed": [False, True],
+			"fixed": [True, False],
+			"not_retested": [False, False]
+		})
+
+	def test_delta_until_a_snapshot_not_retesting_a_risk(self) -> None:
+		delta = self.state_matrix.get_delta(0, until_column=1)
+		self.assertEqual(delta["not_retested"].tolist(), [True, False])
+		# Nothing can be retested after the last snapshot
+		self.assertFalse(self.state_matrix.get_delta(2)["not_retested"].any())
+
+if __name__ == '__main__':
+	unittest.main()